@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+# *****************************************************************************
+#
+# Benchmarks for the software GigE Vision device.
+#
+#   python3 Benchmarks.py patterns [--width W] [--height H] [--repeat N]
+#   python3 Benchmarks.py advance [--width W] [--height H] [--frames N]
+#   python3 Benchmarks.py pipeline [--format F] [--transmit-ms T] [--depths 1 2 4 ...]
+#   python3 Benchmarks.py pacing [--fps F] [--frames N]
+#   python3 Benchmarks.py multipart [--parts P] [--frames N]
+#
+# *****************************************************************************
+
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import TestPatterns as patterns
+from Pipeline import AcquisitionPipeline
+from Pacer import FramePacer
+from Defines import *
+
+#
+# Reference per-pixel implementations, as MySource used to generate patterns.
+# They are kept to check the vectorized versions byte for byte.
+#
+
+def loop_mono8(img_array, seed):
+    height, width = img_array.shape[:2]
+    for y in range(height):
+        base = (seed + y) & 0xFF
+        for x in range(width):
+            img_array[y,x] = base
+            base = (base + 1) & 0xFF
+
+def loop_rgb(img_array, seed):
+    height, width = img_array.shape[:2]
+    for y in range(height):
+        value = seed + y
+        for x in range(width):
+            img_array[y,x,0] = (value << 4) & 0xFF
+            img_array[y,x,1] = (value << 2) & 0xFF
+            img_array[y,x,2] = value & 0xFF
+            value += 1
+
+def loop_yuv444(img_array, seed):
+    height, width = img_array.shape[:2]
+    for y in range(height):
+        value = seed + y
+        for x in range(width):
+            img_array[y,x,0] = (value << 1) & 0xFF
+            img_array[y,x,1] = value & 0xFF
+            img_array[y,x,2] = 255 - (value << 2) & 0xFF
+            value += 1
+
+def loop_yuv422(img_array, seed):
+    height, width = img_array.shape[:2]
+    for y in range(height):
+        value = seed + y
+        for x in range(width):
+            img_array[y,x,0] = (value << 1) & 0xFF if (( x & 1 ) == 0) else 255 - (value << 2) & 0xFF
+            img_array[y,x,1] = value & 0xFF
+            value += 1
+
+# name: (channels, loop version, vectorized version)
+PATTERNS = {
+    "Mono8": (1, loop_mono8, patterns.fill_mono8),
+    "RGB8": (3, loop_rgb, patterns.fill_rgb),
+    "RGBa8": (4, loop_rgb, patterns.fill_rgb),
+    "YCbCr8_CbYCr": (3, loop_yuv444, patterns.fill_yuv444),
+    "YCbCr422_8_CbYCrY": (2, loop_yuv422, patterns.fill_yuv422),
+}
+
+def time_call(function, repeat):
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_patterns(args):
+    print(f"Test pattern generation at {args.width}x{args.height}, seed {args.seed}")
+    print(f"{'format':<20}{'loop (s)':>12}{'numpy (ms)':>14}{'speedup':>12}  identical")
+    for name, (channels, loop_fill, fill) in PATTERNS.items():
+        shape = (args.height, args.width) if channels == 1 else (args.height, args.width, channels)
+        expected = np.zeros(shape, dtype=np.uint8)
+        actual = np.zeros(shape, dtype=np.uint8)
+
+        loop_time = time_call(lambda: loop_fill(expected, args.seed), 1)
+        numpy_time = time_call(lambda: fill(actual, args.seed), args.repeat)
+        identical = np.array_equal(expected, actual)
+        print(f"{name:<20}{loop_time:>12.2f}{numpy_time * 1e3:>14.2f}{loop_time / numpy_time:>11.0f}x  {identical}")
+
+def bench_advance(args):
+    print(f"Per frame transmit cost at {args.width}x{args.height}, {args.frames} frames")
+    print(f"{'format':<20}{'copy+inc (fps)':>16}{'add (fps)':>12}  identical")
+    for name, (channels, loop_fill, fill) in PATTERNS.items():
+        shape = (args.height, args.width) if channels == 1 else (args.height, args.width, channels)
+        primed = np.zeros(shape, dtype=np.uint8)
+        fill(primed, args.seed)
+        dst = np.empty_like(primed)
+        expected = np.empty_like(primed)
+
+        # Previous transmit path: copy the working pattern, then advance it in place
+        src = primed.copy()
+        start = time.perf_counter()
+        for i in range(args.frames):
+            np.copyto(dst, src)
+            src += 1
+        inc_time = time.perf_counter() - start
+        np.subtract(src, 1, out=expected, dtype=np.uint8, casting="unsafe")
+
+        # Current transmit path: add the frame's phase to the primed pattern in one pass
+        start = time.perf_counter()
+        for i in range(args.frames):
+            np.add(primed, i & 0xFF, out=dst, dtype=np.uint8, casting="unsafe")
+        add_time = time.perf_counter() - start
+
+        identical = np.array_equal(dst, expected)
+        print(f"{name:<20}{args.frames / inc_time:>16.0f}{args.frames / add_time:>12.0f}  {identical}")
+
+def bench_pipeline(args):
+    # The transmitter is simulated with a sleep, which like the eBUS send
+    # path releases the GIL, so only the overlap with pattern generation is
+    # measured. Pacing is left out to show the raw throughput.
+    channels, loop_fill, fill = PATTERNS[args.format]
+    shape = (args.height, args.width) if channels == 1 else (args.height, args.width, channels)
+    seed = [0]
+
+    def generate(img_array):
+        fill(img_array, seed[0])
+        seed[0] += 1
+
+    start = time.perf_counter()
+    for i in range(10):
+        generate(np.empty(shape, dtype=np.uint8))
+    fill_ms = (time.perf_counter() - start) / 10 * 1e3
+
+    print(f"{args.format} {args.width}x{args.height}: {fill_ms:.2f} ms to generate, {args.transmit_ms:.2f} ms to transmit")
+    print(f"{'depth':>6}{'fps':>10}{'stalls':>10}")
+    for depth in args.depths:
+        pipeline = AcquisitionPipeline(generate, depth)
+        for i in range(depth):
+            pipeline.queue(np.empty(shape, dtype=np.uint8))
+        pipeline.start()
+
+        stalls = 0
+        start = time.perf_counter()
+        for i in range(args.frames):
+            # A stall is a retrieve that found no frame ready
+            frame = pipeline.retrieve(0)
+            if frame is None:
+                stalls += 1
+                frame = pipeline.retrieve()
+            time.sleep(args.transmit_ms / 1e3)
+            pipeline.queue(frame)
+        elapsed = time.perf_counter() - start
+        pipeline.stop()
+        print(f"{depth:>6}{args.frames / elapsed:>10.0f}{stalls:>10}")
+
+def run_paced(wait, frames):
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for i in range(frames):
+        wait()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    return frames / elapsed, 100 * cpu / elapsed
+
+def bench_pacing(args):
+    # Previous pacing: poll every 100us until a period has passed since the
+    # last frame, as RetrieveBuffer did around PvFPSStabilizer
+    polled = FramePacer(args.fps)
+    last = [None]
+
+    def poll():
+        period = 1.0 / args.fps
+        if last[0] is None:
+            last[0] = time.perf_counter() - period
+        while time.perf_counter() - last[0] < period:
+            time.sleep(0.0001)
+        now = time.perf_counter()
+        polled.record(now - last[0] - period)
+        last[0] = now
+
+    pacer = FramePacer(args.fps, PACING_SPIN)
+
+    print(f"{'pacing':<10}{'fps':>10}{'cpu %':>8}")
+    for name, wait, stats in (("polled", poll, polled), ("deadline", pacer.wait, pacer)):
+        fps, cpu = run_paced(wait, args.frames)
+        print(f"{name:<10}{fps:>10.1f}{cpu:>8.1f}")
+        print(stats.report())
+
+def run_attach(next_parts, frames):
+    # Stands in for AttachPart, which only keeps a reference to each part
+    attached = [None] * 8
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(frames):
+        for j, part in enumerate(next_parts()):
+            attached[j] = part
+    elapsed = time.perf_counter() - start
+    allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed / frames * 1e3, allocated / 2**20
+
+def bench_multipart(args):
+    shape = (args.height, args.width)
+    primed_parts = []
+    for i in range(args.parts):
+        part = np.empty(shape, dtype=np.uint8)
+        patterns.fill_mono8(part, i)
+        primed_parts.append(part)
+
+    # Previous fill_test_pattern: flatten() copies, then advance in place
+    sources = [part.copy() for part in primed_parts]
+
+    def flatten_and_advance():
+        flat = [src.flatten() for src in sources]
+        for src in sources:
+            src += 1
+        return flat
+
+    store = patterns.PartStore(primed_parts, args.slots)
+
+    print(f"{args.parts} parts of {args.width}x{args.height}, {args.frames} frames, {args.slots} store slots ({store.nbytes / 2**20:.0f} MiB)")
+    print(f"{'fill':<12}{'ms/frame':>10}{'peak alloc (MiB)':>18}")
+    for name, next_parts in (("flatten", flatten_and_advance), ("part store", store.next)):
+        ms, peak = run_attach(next_parts, args.frames)
+        print(f"{name:<12}{ms:>10.2f}{peak:>18.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Software GigE Vision device benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_patterns = subparsers.add_parser("patterns", help="loop vs vectorized test pattern generation")
+    parser_patterns.add_argument("--width", type=int, default=WIDTH_MAX)
+    parser_patterns.add_argument("--height", type=int, default=HEIGHT_MAX)
+    parser_patterns.add_argument("--seed", type=int, default=250)
+    parser_patterns.add_argument("--repeat", type=int, default=10)
+    parser_patterns.set_defaults(run=bench_patterns)
+
+    parser_advance = subparsers.add_parser("advance", help="copy+increment vs single-pass pattern advance")
+    parser_advance.add_argument("--width", type=int, default=WIDTH_MAX)
+    parser_advance.add_argument("--height", type=int, default=HEIGHT_MAX)
+    parser_advance.add_argument("--seed", type=int, default=250)
+    parser_advance.add_argument("--frames", type=int, default=300)
+    parser_advance.set_defaults(run=bench_advance)
+
+    parser_pipeline = subparsers.add_parser("pipeline", help="source throughput vs pipeline depth")
+    parser_pipeline.add_argument("--format", choices=PATTERNS.keys(), default="RGB8")
+    parser_pipeline.add_argument("--width", type=int, default=WIDTH_MAX)
+    parser_pipeline.add_argument("--height", type=int, default=HEIGHT_MAX)
+    parser_pipeline.add_argument("--frames", type=int, default=200)
+    parser_pipeline.add_argument("--transmit-ms", type=float, default=5.0)
+    parser_pipeline.add_argument("--depths", type=int, nargs="+", default=[1, 2, 4, 8, BUFFERCOUNT])
+    parser_pipeline.set_defaults(run=bench_pipeline)
+
+    parser_pacing = subparsers.add_parser("pacing", help="polled vs deadline frame pacing")
+    parser_pacing.add_argument("--fps", type=float, default=500)
+    parser_pacing.add_argument("--frames", type=int, default=2000)
+    parser_pacing.set_defaults(run=bench_pacing)
+
+    parser_multipart = subparsers.add_parser("multipart", help="flatten() vs preallocated part store")
+    parser_multipart.add_argument("--width", type=int, default=WIDTH_MAX)
+    parser_multipart.add_argument("--height", type=int, default=HEIGHT_MAX)
+    parser_multipart.add_argument("--parts", type=int, default=3)
+    parser_multipart.add_argument("--slots", type=int, default=BUFFERCOUNT)
+    parser_multipart.add_argument("--frames", type=int, default=200)
+    parser_multipart.set_defaults(run=bench_multipart)
+
+    args = parser.parse_args()
+    args.run(args)
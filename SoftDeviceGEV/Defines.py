@@ -6,6 +6,14 @@
 
 BUFFERCOUNT = 16
 DEFAULT_FPS = 30
+# Least part of each frame period the pacer spins instead of sleeping, in seconds;
+# the pacer adds the measured sleep overshoot on top (see Pacer.py)
+PACING_SPIN = 0.0001
+
+# Buffers the sources fill ahead of the transmitter (see Pipeline.py), and
+# how long RetrieveBuffer waits for the next one, in seconds
+PIPELINE_DEPTH = BUFFERCOUNT
+RETRIEVE_TIMEOUT = 0.01
 
 WIDTH_MIN = 64
 WIDTH_MAX = 1920
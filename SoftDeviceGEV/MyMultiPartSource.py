@@ -13,27 +13,34 @@ import struct
 import eBUS as eb
 import numpy as np
 import Utilities as utils
+import TestPatterns as patterns
+from Pipeline import AcquisitionPipeline
+from Pacer import FramePacer
 from Defines import *
 
 class MyMultiPartSource(eb.IPvStreamingChannelSource):
 
-    _DATA_TYPE_1 = eb.PvMultiPart3DImage
-    _PIXEL_TYPE_1 = eb.PvPixelCoord3D_A8
-    _DATA_TYPE_2 = eb.PvMultiPartConfidenceMap
-    _PIXEL_TYPE_2 = eb.PvPixelConfidence8
+    # (data type, pixel type) of each part; pass parts= to stream others
+    _3D_PART = (eb.PvMultiPart3DImage, eb.PvPixelCoord3D_A8)
+    _CONFIDENCE_PART = (eb.PvMultiPartConfidenceMap, eb.PvPixelConfidence8)
+    _INTENSITY_PART = (eb.PvMultiPart2DImage, eb.PvPixelMono8)
+    _DEFAULT_PARTS = (_3D_PART, _CONFIDENCE_PART)
 
-    def __init__(self):
+    def __init__(self, pipeline_depth=PIPELINE_DEPTH, fps=DEFAULT_FPS, parts=None):
         super().__init__()
+        self._parts = list(parts or self._DEFAULT_PARTS)
         self._width = WIDTH_DEFAULT
         self._height = HEIGHT_DEFAULT
         self._pixel_type = eb.PvPixelMono8
-        self._acquisition_buffer = None
+        self._pipeline = AcquisitionPipeline(self.acquire_buffer, pipeline_depth)
         self._test_pattern_buffer = eb.PvBuffer()
+        self._part_store = None
+        self._buffer_count = 0
         self._seed = 0
         self._frame_count = 0
         self._chunk_mode_active = False
         self._chunk_sample_enabled = False
-        self._stabilizer = eb.PvFPSStabilizer()
+        self._pacer = FramePacer(fps, PACING_SPIN)
         self._multipart_allowed = False
         self._supported_pixel_types = [
             eb.PvPixelMono8
@@ -92,6 +99,17 @@ class MyMultiPartSource(eb.IPvStreamingChannelSource):
     def SetOffsetY(self, offset_y):
         return eb.PV_NOT_SUPPORTED
 
+    def GetFrameRate(self):
+        return self._pacer.fps
+
+    def SetFrameRate(self, fps):
+        # 0 streams as fast as the pipeline fills buffers
+        if fps < 0:
+            return eb.PV_INVALID_PARAMETER
+
+        self._pacer.set_fps(fps)
+        return eb.PV_OK
+
     def GetChunksSize(self):
         return self.GetRequiredChunkSize()
 
@@ -131,54 +149,67 @@ class MyMultiPartSource(eb.IPvStreamingChannelSource):
         print("Streaming channel closed")
 
     def OnStreamingStart(self):
-        self._stabilizer.Reset()
+        self._pacer.reset()
         self.AllocMultiPart(self._test_pattern_buffer)
 
         # Prime test pattern
         container = self._test_pattern_buffer.GetMultiPartContainer()
-        self.fill_test_pattern_mono8(container.GetPart(0))
-        self.fill_test_pattern_mono8(container.GetPart(1))
+        primed_parts = []
+        for i in range(len(self._parts)):
+            self.fill_test_pattern_mono8(container.GetPart(i))
+            primed_parts.append(container.GetPart(i).GetImage().GetDataPointer())
+
+        # One slot per buffer we hand out, so an attached slot is never
+        # rewritten while its buffer is still queued or being transmitted
+        self._part_store = patterns.PartStore(primed_parts, BUFFERCOUNT)
+        self._pipeline.start()
 
         print("Streaming start")
 
     def OnStreamingStop(self):
         print("Streaming stop")
+        self._pipeline.stop()
+        print(self._pacer.report())
 
     def AllocBuffer(self):
-        buffer = eb.PvBuffer(eb.PvPayloadTypeMultiPart)
-        self.AllocMultiPart(buffer)
-        return buffer
+        if self._buffer_count < BUFFERCOUNT:
+            self._buffer_count += 1
+            buffer = eb.PvBuffer(eb.PvPayloadTypeMultiPart)
+            self.AllocMultiPart(buffer)
+            return buffer
+
+        return None
 
     def FreeBuffer(self, pvbuffer):
-        return
+        self._buffer_count -= 1
 
     def QueueBuffer(self, pvbuffer):
-        # We use mAcqusitionBuffer as a 1-deep acquisition pipeline
-        if not self._acquisition_buffer:
-            self._acquisition_buffer = pvbuffer
-            self.fill_test_pattern()
-            self.add_chunk_sample(self._acquisition_buffer)
-            self._frame_count += 1
+        # Buffers are filled ahead of time by the pipeline's producer thread
+        if self._pipeline.queue(pvbuffer):
             return eb.PV_OK
 
-        # We already have a pvbuffer queued for acquisition
+        # The pipeline already holds pipeline_depth buffers
         return eb.PV_BUSY
 
     def RetrieveBuffer(self, not_used):
-        if not self._acquisition_buffer:
-            # No pvbuffer queued for acquisition
+        if self._pipeline.aborted:
+            # Hand back everything the pipeline holds right away, unpaced
+            pvbuffer = self._pipeline.retrieve(0)
+            if not pvbuffer:
+                return eb.PV_NO_AVAILABLE_DATA, None
+            return eb.PV_OK, pvbuffer
+
+        pvbuffer = self._pipeline.retrieve(RETRIEVE_TIMEOUT)
+        if not pvbuffer:
+            # No filled pvbuffer ready yet
             return eb.PV_NO_AVAILABLE_DATA, None
 
-        while not self._stabilizer.IsTimeToDisplay(DEFAULT_FPS):
-            time.sleep(0.0001)
-
-        # Remove pvbuffer from 1-deep pipeline
-        pvbuffer = self._acquisition_buffer
-        self._acquisition_buffer = None
+        self._pacer.wait()
         return eb.PV_OK, pvbuffer
 
     def AbortQueuedBuffers(self):
-        pass
+        # Stop filling; RetrieveBuffer returns the pending and ready buffers as they are
+        self._pipeline.abort()
 
     def GetRequiredChunkSize(self):
         return CHUNKSIZE if (self._chunk_mode_active and self._chunk_sample_enabled) else 0
@@ -187,33 +218,24 @@ class MyMultiPartSource(eb.IPvStreamingChannelSource):
         buffer.Reset(eb.PvPayloadTypeMultiPart)
         container = buffer.GetMultiPartContainer()
         container.Reset()
-        container.AddImagePart(self._DATA_TYPE_1, self._width, self._height, self._PIXEL_TYPE_1)
-        container.AddImagePart(self._DATA_TYPE_2, self._width, self._height, self._PIXEL_TYPE_2)
+        for data_type, pixel_type in self._parts:
+            container.AddImagePart(data_type, self._width, self._height, pixel_type)
         container.AllocAllParts()
 
-    def fill_test_pattern(self):
-            src_container = self._test_pattern_buffer.GetMultiPartContainer()
-            src_1 = src_container.GetPart(0).GetImage().GetDataPointer()
-            src_2 = src_container.GetPart(1).GetImage().GetDataPointer()
-            dst_container = self._acquisition_buffer.GetMultiPartContainer()
-
-            dst_container.AttachPart(0, src_1.flatten())
-            dst_container.AttachPart(1, src_2.flatten())
+    def acquire_buffer(self, pvbuffer):
+        # Runs on the pipeline's producer thread
+        self.fill_test_pattern(pvbuffer)
+        self.add_chunk_sample(pvbuffer)
+        self._frame_count += 1
 
-            # Advance the test pattern
-            src_1 += 1
-            src_2 += 1
+    def fill_test_pattern(self, pvbuffer):
+        # Attach the next phase of every part straight from the part store
+        dst_container = pvbuffer.GetMultiPartContainer()
+        for i, part in enumerate(self._part_store.next()):
+            dst_container.AttachPart(i, part)
 
     def fill_test_pattern_mono8(self, section):
-        height = section.GetImage().GetHeight()
-        width = section.GetImage().GetWidth()
-        img_array = section.GetImage().GetDataPointer()
-        
-        for y in range(height):
-            base = (self._seed + y) & 0xFF
-            for x in range(width) :
-                img_array[y,x] = base
-                base = (base + 1) & 0xFF
+        patterns.fill_mono8(section.GetImage().GetDataPointer(), self._seed)
         self._seed += 1
 
     def add_chunk_sample(self, pvbuffer):
@@ -13,12 +13,15 @@ import struct
 import eBUS as eb
 import numpy as np
 import Utilities as utils
+import TestPatterns as patterns
+from Pipeline import AcquisitionPipeline
+from Pacer import FramePacer
 from Defines import *
 
 class MySource(eb.IPvRegisterEventSink, eb.IPvStreamingChannelSource):
     channel_count = 0;
 
-    def __init__(self):
+    def __init__(self, pipeline_depth=PIPELINE_DEPTH, fps=DEFAULT_FPS):
         # Since this class uses multiple inheritence, the __init__ method
         # of each base class must be called explicitly.
         eb.IPvRegisterEventSink.__init__( self )
@@ -28,12 +31,12 @@ class MySource(eb.IPvRegisterEventSink, eb.IPvStreamingChannelSource):
         self.height = HEIGHT_DEFAULT
         self.pixel_type = eb.PvPixelMono8
         self.buffer_count = 0
-        self.acquisition_buffer = None
+        self.pipeline = AcquisitionPipeline(self.acquire_buffer, pipeline_depth)
         self.seed = 0
         self.frame_count = 0
         self.chunk_mode_active = False
         self.chunk_sample_enabled = False
-        self.stabilizer = eb.PvFPSStabilizer()
+        self.pacer = FramePacer(fps, PACING_SPIN)
         self.supported_pixel_types = [
             eb.PvPixelMono8,
             eb.PvPixelRGB8,
@@ -44,6 +47,7 @@ class MySource(eb.IPvRegisterEventSink, eb.IPvStreamingChannelSource):
             eb.PvPixelYCbCr8_CbYCr
         ]
         self.test_pattern_buffer = eb.PvBuffer()
+        self.pattern_phase = 0
         self.channel_number = MySource.channel_count;
         MySource.channel_count = MySource.channel_count + 1;
 
@@ -100,6 +104,17 @@ class MySource(eb.IPvRegisterEventSink, eb.IPvStreamingChannelSource):
             return eb.PV_OK, self.supported_pixel_types[index]
         return eb.PV_INVALID_PARAMETER, 0
 
+    def GetFrameRate(self):
+        return self.pacer.fps
+
+    def SetFrameRate(self, fps):
+        # 0 streams as fast as the pipeline fills buffers
+        if fps < 0:
+            return eb.PV_INVALID_PARAMETER
+
+        self.pacer.set_fps(fps)
+        return eb.PV_OK
+
     def GetChunksSize(self):
         return self.GetRequiredChunkSize()
 
@@ -140,11 +155,14 @@ class MySource(eb.IPvRegisterEventSink, eb.IPvStreamingChannelSource):
 
     def OnStreamingStart(self):
         print("Streaming start")
-        self.stabilizer.Reset()
+        self.pacer.reset()
         self.prime_test_pattern()
+        self.pipeline.start()
 
     def OnStreamingStop(self):
         print("Streaming stop")
+        self.pipeline.stop()
+        print(self.pacer.report())
 
     def AllocBuffer(self):
         if self.buffer_count < BUFFERCOUNT:
@@ -157,35 +175,32 @@ class MySource(eb.IPvRegisterEventSink, eb.IPvStreamingChannelSource):
         self.buffer_count -= 1
 
     def QueueBuffer(self, pvbuffer):
-        # We use mAcqusitionBuffer as a 1-deep acquisition pipeline
-        if not self.acquisition_buffer:
-            # No pvbuffer queued, accept it
-            self.acquisition_buffer = pvbuffer
-            # Acquire pvbuffer - could be done in another thread
-            self.resize_buffer_if_needed(self.acquisition_buffer)
-            self.fill_test_pattern()
-            self.add_chunk_sample(self.acquisition_buffer)
-            self.frame_count += 1
+        # Buffers are filled ahead of time by the pipeline's producer thread
+        if self.pipeline.queue(pvbuffer):
             return eb.PV_OK
 
-        # We already have a pvbuffer queued for acquisition
+        # The pipeline already holds pipeline_depth buffers
         return eb.PV_BUSY
 
     def RetrieveBuffer(self, not_used):
-        if not self.acquisition_buffer:
-            # No pvbuffer queued for acquisition
+        if self.pipeline.aborted:
+            # Hand back everything the pipeline holds right away, unpaced
+            pvbuffer = self.pipeline.retrieve(0)
+            if not pvbuffer:
+                return eb.PV_NO_AVAILABLE_DATA, None
+            return eb.PV_OK, pvbuffer
+
+        pvbuffer = self.pipeline.retrieve(RETRIEVE_TIMEOUT)
+        if not pvbuffer:
+            # No filled pvbuffer ready yet
             return eb.PV_NO_AVAILABLE_DATA, None
 
-        while not self.stabilizer.IsTimeToDisplay(DEFAULT_FPS):
-            time.sleep(0.0001)
-
-        # Remove pvbuffer from 1-deep pipeline
-        pvbuffer = self.acquisition_buffer
-        self.acquisition_buffer = None
+        self.pacer.wait()
         return eb.PV_OK, pvbuffer
 
     def AbortQueuedBuffers(self):
-        pass
+        # Stop filling; RetrieveBuffer returns the pending and ready buffers as they are
+        self.pipeline.abort()
 
     def GetRequiredChunkSize(self):
         return CHUNKSIZE if (self.chunk_mode_active and self.chunk_sample_enabled) else 0
@@ -199,14 +214,22 @@ class MySource(eb.IPvRegisterEventSink, eb.IPvStreamingChannelSource):
                 or (image.GetMaximumChunkLength() != required_chunk_size ):
             image.Alloc(self.width, self.height, self.pixel_type, 0, 0, required_chunk_size)
 
-    def fill_test_pattern(self):
+    def acquire_buffer(self, pvbuffer):
+        # Runs on the pipeline's producer thread
+        self.resize_buffer_if_needed(pvbuffer)
+        self.fill_test_pattern(pvbuffer)
+        self.add_chunk_sample(pvbuffer)
+        self.frame_count += 1
+
+    def fill_test_pattern(self, pvbuffer):
+        # The pattern advances by incrementing every byte: frame n is the primed
+        # pattern plus n, written in a single pass instead of copying a working
+        # frame and then incrementing it. Technically this isn't a 'perfect'
+        # increment for the YUV patterns.
         src = self.test_pattern_buffer.GetImage().GetDataPointer()
-        dst = self.acquisition_buffer.GetImage().GetDataPointer()
-        np.copyto(dst,src)
-        # Since the data pointer is a numpy array we can simply ask numpy
-        # to increment every value to 'advance' the test pattern. Technically
-        # this isn't a 'perfect' increment for the YUV patterns.
-        src += 1
+        dst = pvbuffer.GetImage().GetDataPointer()
+        np.add(src, self.pattern_phase, out=dst, dtype=np.uint8, casting="unsafe")
+        self.pattern_phase = (self.pattern_phase + 1) & 0xFF
 
     def prime_test_pattern(self):
         self.test_pattern_buffer.GetImage().Alloc(self.width, self.height, self.pixel_type, 0, 0, 0)
@@ -221,63 +244,22 @@ class MySource(eb.IPvRegisterEventSink, eb.IPvStreamingChannelSource):
             self.fill_test_pattern_yuv444(self.test_pattern_buffer)
         elif self.pixel_type == eb.PvPixelYCbCr422_8_CbYCrY:
             self.fill_test_pattern_yuv422(self.test_pattern_buffer)
+        self.pattern_phase = 0
 
     def fill_test_pattern_mono8(self, pvbuffer):
-        image = pvbuffer.GetImage()
-        height = image.GetHeight()
-        width = image.GetWidth()
-        img_array = image.GetDataPointer()
-        
-        for y in range(height) :
-            base = (self.seed + y) & 0xFF
-            for x in range(width) :
-                img_array[y,x] = base
-                base = (base + 1) & 0xFF
+        patterns.fill_mono8(pvbuffer.GetImage().GetDataPointer(), self.seed)
         self.seed += 1
 
     def fill_test_pattern_rgb(self, pvbuffer):
-        image = pvbuffer.GetImage()
-        height = image.GetHeight()
-        width = image.GetWidth()
-        img_array = image.GetDataPointer()
-
-        for y in range(height):
-            value = self.seed + y
-            for x in range(width):
-                # Write current pixel
-                img_array[y,x,0] = (value << 4) & 0xFF
-                img_array[y,x,1] = (value << 2) & 0xFF
-                img_array[y,x,2] = value & 0xFF
-                value += 1
+        patterns.fill_rgb(pvbuffer.GetImage().GetDataPointer(), self.seed)
         self.seed += 1
 
     def fill_test_pattern_yuv444(self, pvbuffer):
-        image = pvbuffer.GetImage()
-        height = image.GetHeight()
-        width = image.GetWidth()
-        img_array = image.GetDataPointer()
-
-        for y in range(height):
-            value = self.seed + y
-            for x in range(width):
-                img_array[y,x,0] = (value << 1) & 0xFF
-                img_array[y,x,1] = value & 0xFF
-                img_array[y,x,2] = 255 - (value << 2) & 0xFF
-                value += 1
+        patterns.fill_yuv444(pvbuffer.GetImage().GetDataPointer(), self.seed)
         self.seed += 1
 
     def fill_test_pattern_yuv422(self, pvbuffer):
-        image = pvbuffer.GetImage()
-        height = image.GetHeight()
-        width = image.GetWidth()
-        img_array = image.GetDataPointer()
-
-        for y in range(height):
-            value = self.seed + y
-            for x in range(width):
-                img_array[y,x,0] = (value << 1) & 0xFF if (( x & 1 ) == 0) else 255 - (value << 2) & 0xFF
-                img_array[y,x,1] = value & 0xFF
-                value += 1
+        patterns.fill_yuv422(pvbuffer.GetImage().GetDataPointer(), self.seed)
         self.seed += 1
 
     def add_chunk_sample(self, pvbuffer):
@@ -0,0 +1,118 @@
+# *****************************************************************************
+#
+# Frame pacing for the software GigE Vision device sources.
+#
+# Frames are released on absolute deadlines (start + n / fps) rather than
+# "at least 1/fps after the last one", so timing errors do not accumulate.
+# Each wait sleeps until shortly before the deadline and spins for the rest,
+# which keeps the CPU mostly idle even at several hundred fps. How early it
+# wakes up is learned from how far past the requested time sleep() actually
+# returned: the margin is 'spin' plus a running OVERSHOOT_QUANTILE quantile of
+# the measured overshoot, which follows the system's typical scheduling delay
+# without chasing the rare multi-millisecond stalls (spinning through those
+# would cost more CPU than the polled loop it replaces). A frame more than a
+# period late is caught up on by the following ones; the schedule is only
+# restarted after RESYNC_FRAMES of them in a row (the producer really
+# stalled). How late every frame was released is kept in a jitter histogram.
+#
+# *****************************************************************************
+
+import time
+
+import numpy as np
+
+
+# Upper edges of the jitter histogram bins, in microseconds; the last bin
+# collects everything later than JITTER_BINS_US[-1]
+JITTER_BINS_US = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Quantile of the sleep overshoot the spin margin tracks, and how far one
+# frame moves the estimate, in seconds
+OVERSHOOT_QUANTILE = 0.5
+OVERSHOOT_STEP = 0.00001
+# Consecutive frames more than a period late before the schedule restarts
+RESYNC_FRAMES = 3
+
+
+class FramePacer:
+    def __init__(self, fps, spin=0.0001):
+        self.spin = spin
+        self.set_fps(fps)
+        self.reset()
+
+    def set_fps(self, fps):
+        # fps <= 0 disables pacing
+        self.fps = fps
+        self.period = 1.0 / fps if fps > 0 else 0.0
+        self.deadline = None
+
+    def reset(self):
+        self.deadline = None
+        self.overshoot = 0.0
+        self.late_frames = 0
+        self.frames = 0
+        self.resyncs = 0
+        self.jitter_counts = np.zeros(len(JITTER_BINS_US) + 1, dtype=np.int64)
+        self.jitter_max = 0.0
+
+    def wait(self):
+        """
+        Block until the next frame is due. Returns how late it was released,
+        in seconds.
+        """
+        if self.period == 0:
+            return 0.0
+
+        now = time.perf_counter()
+        if self.deadline is None:
+            # First frame goes out right away
+            self.deadline = now
+
+        # Never spin for more than half a period
+        margin = min(self.spin + self.overshoot, 0.5 * self.period)
+        remaining = self.deadline - now
+        if remaining > margin:
+            requested = remaining - margin
+            time.sleep(requested)
+            # Stochastic quantile estimate: up by q steps when the sleep overshot
+            # the estimate, down by (1 - q) steps when it didn't
+            overshoot = time.perf_counter() - now - requested
+            if overshoot > self.overshoot:
+                self.overshoot += OVERSHOOT_QUANTILE * OVERSHOOT_STEP
+            else:
+                self.overshoot = max(0.0, self.overshoot - (1 - OVERSHOOT_QUANTILE) * OVERSHOOT_STEP)
+        while time.perf_counter() < self.deadline:
+            pass
+
+        lateness = time.perf_counter() - self.deadline
+        self.record(lateness)
+
+        self.deadline += self.period
+        if lateness > self.period:
+            self.late_frames += 1
+            if self.late_frames >= RESYNC_FRAMES:
+                # Fell behind for several frames (e.g. the producer stalled):
+                # restart the schedule instead of bursting to catch up
+                self.deadline = time.perf_counter() + self.period
+                self.resyncs += 1
+                self.late_frames = 0
+        else:
+            self.late_frames = 0
+        return lateness
+
+    def record(self, lateness):
+        self.frames += 1
+        self.jitter_max = max(self.jitter_max, lateness)
+        self.jitter_counts[np.searchsorted(JITTER_BINS_US, lateness * 1e6)] += 1
+
+    def histogram(self):
+        # (bin label, count) pairs
+        labels = [f"<={edge}us" for edge in JITTER_BINS_US] + [f">{JITTER_BINS_US[-1]}us"]
+        return list(zip(labels, self.jitter_counts.tolist()))
+
+    def report(self):
+        lines = [f"{self.frames} frames at {self.fps} fps, max jitter {self.jitter_max * 1e6:.0f}us, {self.resyncs} resyncs"]
+        for label, count in self.histogram():
+            if count:
+                lines.append(f"  {label:>10} {count}")
+        return "\n".join(lines)
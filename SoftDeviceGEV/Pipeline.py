@@ -0,0 +1,113 @@
+# *****************************************************************************
+#
+# N-deep acquisition pipeline for the software GigE Vision device sources.
+#
+# The eBUS transmit side hands empty buffers to QueueBuffer and picks up
+# filled ones in RetrieveBuffer. With a 1-deep pipeline the pattern for the
+# next frame is only generated once the previous one has been retrieved, so
+# the transmitter waits on it every frame. Here a producer thread fills
+# queued buffers ahead of time, up to 'depth' buffers at once. abort() hands
+# every buffer back to the transmit side at once, without filling the ones
+# still pending.
+#
+# Only the standard library is used so the pipeline can be benchmarked
+# without eBUS.
+#
+# *****************************************************************************
+
+import queue
+import threading
+
+
+class AcquisitionPipeline:
+    def __init__(self, fill, depth):
+        # fill(pvbuffer) is called on the producer thread for every buffer
+        self.fill = fill
+        self.depth = max(1, depth)
+        self.frames_filled = 0
+        self._pending = queue.Queue()
+        self._ready = queue.Queue()
+        self._count = 0
+        self._lock = threading.Lock()
+        self._aborted = threading.Event()
+        self._thread = None
+
+    @property
+    def count(self):
+        # Buffers currently held by the pipeline, filled or not
+        return self._count
+
+    def queue(self, pvbuffer):
+        """
+        Accept an empty buffer. Returns False when the pipeline already holds
+        depth buffers, in which case the caller keeps the buffer (PV_BUSY).
+        """
+        with self._lock:
+            if self._count >= self.depth:
+                return False
+            self._count += 1
+        self._pending.put(pvbuffer)
+        return True
+
+    def retrieve(self, timeout=None):
+        # Next filled buffer in queue order, or None if none is ready in time
+        try:
+            if timeout == 0:
+                pvbuffer = self._ready.get_nowait()
+            else:
+                pvbuffer = self._ready.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._count -= 1
+        return pvbuffer
+
+    @property
+    def aborted(self):
+        # True from abort() until the next start()
+        return self._aborted.is_set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._aborted.clear()
+        if self.is_running():
+            return
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Buffers queued before stop() are still filled; anything queued
+        # afterwards waits in the pipeline for the next start()
+        if not self.is_running():
+            return
+        self._pending.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def abort(self):
+        """
+        Stop the producer and make every buffer the pipeline holds, filled or
+        not, retrievable right away. Pending buffers are not filled.
+        """
+        self._aborted.set()
+        self.stop()
+        # Buffers the producer never picked up
+        while True:
+            try:
+                pvbuffer = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if pvbuffer is not None:
+                self._ready.put(pvbuffer)
+
+    def _produce(self):
+        while True:
+            pvbuffer = self._pending.get()
+            if pvbuffer is None:
+                break
+            if not self._aborted.is_set():
+                self.fill(pvbuffer)
+                self.frames_filled += 1
+            self._ready.put(pvbuffer)
@@ -0,0 +1,84 @@
+# *****************************************************************************
+#
+# Test pattern generators for the software GigE Vision device.
+#
+# Each fill_* function writes the same bytes as the original per-pixel loops
+# in MySource, but with broadcast NumPy arithmetic. Every pattern byte only
+# depends on (seed + y + x) modulo 256, so the whole frame is built from one
+# uint8 row ramp and one uint8 column ramp; uint8 wrap-around stands in for
+# the '& 0xFF' masks of the loop versions.
+#
+# Only NumPy is needed here so the patterns can be benchmarked without eBUS.
+#
+# *****************************************************************************
+
+import numpy as np
+
+
+def pattern_base(height, width, seed):
+    # (seed + y + x) & 0xFF for every pixel, as a (height, width) uint8 array
+    rows = ((np.arange(height) + seed) & 0xFF).astype(np.uint8)
+    cols = (np.arange(width) & 0xFF).astype(np.uint8)
+    return np.add.outer(rows, cols)
+
+def fill_mono8(img_array, seed):
+    height, width = img_array.shape[:2]
+    img_array[...] = pattern_base(height, width, seed).reshape(img_array.shape)
+
+def fill_rgb(img_array, seed):
+    # Works for RGB8/BGR8 and the 4 channel variants, alpha is left untouched
+    height, width = img_array.shape[:2]
+    value = pattern_base(height, width, seed)
+    np.left_shift(value, 4, out=img_array[:, :, 0])
+    np.left_shift(value, 2, out=img_array[:, :, 1])
+    img_array[:, :, 2] = value
+
+def fill_yuv444(img_array, seed):
+    height, width = img_array.shape[:2]
+    value = pattern_base(height, width, seed)
+    np.left_shift(value, 1, out=img_array[:, :, 0])
+    img_array[:, :, 1] = value
+    np.subtract(255, value << 2, out=img_array[:, :, 2], dtype=np.uint8)
+
+def fill_yuv422(img_array, seed):
+    height, width = img_array.shape[:2]
+    value = pattern_base(height, width, seed)
+    # Even columns carry Cb, odd columns carry Cr
+    np.left_shift(value[:, 0::2], 1, out=img_array[:, 0::2, 0])
+    np.subtract(255, value[:, 1::2] << 2, out=img_array[:, 1::2, 0], dtype=np.uint8)
+    img_array[:, :, 1] = value
+
+class PartStore:
+    """
+    Preallocated pattern storage for multipart buffers, attached to the
+    transmit buffers without copying.
+
+    Each slot holds one contiguous array per part, and next() writes the
+    next pattern phase into the following slot in a single pass per part.
+    The flat views handed out stay valid until the slot comes round again,
+    so there must be at least as many slots as buffers that can be in
+    flight at once: two for a ping-pong pair, BUFFERCOUNT for the pipelined
+    sources.
+    """
+    def __init__(self, primed_parts, slots):
+        self.primed = [np.ascontiguousarray(part, dtype=np.uint8).copy() for part in primed_parts]
+        self.slots = [[np.empty_like(part) for part in self.primed] for i in range(max(2, slots))]
+        # Flat views are made once so next() does not allocate
+        self.flat = [[part.reshape(-1) for part in slot] for slot in self.slots]
+        self.index = 0
+        self.phase = 0
+
+    @property
+    def nbytes(self):
+        return sum(part.nbytes for slot in self.slots for part in slot)
+
+    def next(self):
+        """
+        Flat uint8 views of every part for the next transmitted frame.
+        """
+        for dst, src in zip(self.slots[self.index], self.primed):
+            np.add(src, self.phase, out=dst, dtype=np.uint8, casting="unsafe")
+        flat = self.flat[self.index]
+        self.index = (self.index + 1) % len(self.slots)
+        self.phase = (self.phase + 1) & 0xFF
+        return flat
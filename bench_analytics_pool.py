@@ -0,0 +1,88 @@
+'''
+Throughput of the frame analytics (lobe stats and pointing error of the
+seven hexagon lobes) in the calling process against AnalyticsPool with an
+increasing number of worker processes, on 640x512 Mono8 frames. Also checks
+that the pool returns the same results, in frame order.
+
+    python3 bench_analytics_pool.py [--workers 1 2 4] [--frames N] [--method max|centroid]
+'''
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+from lib.analytics_pool import FrameAnalysis, AnalyticsPool
+
+
+def generate_hexagon_vertices(center, radius):
+    angles_rad = np.radians(np.array([60 * i for i in range(6)]))
+    x = center[0] + radius * np.cos(angles_rad)
+    y = center[1] + radius * np.sin(angles_rad)
+    return np.vstack([np.column_stack([x, y]), center])
+
+def make_frames(count, width, height, centers, seed=0):
+    # Gaussian lobes that wander a few pixels around the vertices, plus noise
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    frames = np.empty((count, height, width), dtype=np.uint8)
+    for frame in frames:
+        image = rng.normal(8, 2, (height, width))
+        for cx, cy in centers + rng.normal(0, 3, centers.shape):
+            image += 200 * np.exp(-((x - cx)**2 + (y - cy)**2) / (2 * 6.0**2))
+        frame[:] = np.clip(image, 0, 255)
+    return frames
+
+def run_inline(analysis, frames, count):
+    start = time.perf_counter()
+    results = [analysis(frames[i % len(frames)]) for i in range(count)]
+    return time.perf_counter() - start, results
+
+def run_pool(analysis, frames, count, workers):
+    with AnalyticsPool(frames.shape[1:], analysis, workers=workers) as pool:
+        # Warm the workers up (imports, integrator cache) before timing
+        pool.submit(frames[0])
+        pool.get()
+
+        results = []
+        start = time.perf_counter()
+        for i in range(count):
+            pool.submit(frames[i % len(frames)], block_id=i)
+            # Collect whatever is already done so the result queue stays short
+            while pool.pending() and (item := pool.get(timeout=0)) is not None:
+                results.append(item)
+        while pool.pending():
+            results.append(pool.get())
+        elapsed = time.perf_counter() - start
+    return elapsed, results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--radius", type=int, default=20)
+    parser.add_argument("--spacing", type=int, default=100)
+    parser.add_argument("--knn", type=int, default=30)
+    parser.add_argument("--method", choices=["max", "centroid"], default="centroid")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    centers = generate_hexagon_vertices((args.width // 2, args.height // 2), args.spacing).astype(int)
+    frames = make_frames(16, args.width, args.height, centers)
+    analysis = FrameAnalysis(centers, args.radius, knn=args.knn, method=args.method)
+    print(f"{len(centers)} lobes on {args.width}x{args.height} Mono8, {args.method} pointing, "
+          f"{args.frames} frames, {os.cpu_count()} CPUs")
+
+    elapsed, expected = run_inline(analysis, frames, args.frames)
+    print(f"inline       {args.frames / elapsed:10.0f} fps")
+
+    for workers in args.workers:
+        elapsed, results = run_pool(analysis, frames, args.frames, workers)
+        in_order = [block_id for seq, block_id, result in results] == list(range(args.frames))
+        identical = all(np.array_equal(result["lobes"], reference["lobes"]) and
+                        np.array_equal(result["pointing_error"], reference["pointing_error"], equal_nan=True)
+                        for (seq, block_id, result), reference in zip(results, expected))
+        print(f"{workers} worker{'s' if workers > 1 else ' '}    {args.frames / elapsed:10.0f} fps"
+              f"  (in order: {in_order}, identical: {identical})")
@@ -0,0 +1,104 @@
+'''
+Cost of orienting and displaying a frame: np.transpose followed by the flip
+selected in the GUI (the old path, which hands pyqtgraph negative strides)
+against lib/orientation.py's TransformPlan, which displays the plain
+transpose and lets the image item mirror it. Also times the binned previews
+the zoomed-out view uses (lib/preview.py), on their own and through setImage.
+
+The numpy part always runs. The setImage part needs pyqtgraph and PyQt5 and
+renders off-screen (ImageItem.render() builds the QImage that a repaint
+would draw).
+
+    python3 bench_display_transform.py [--mode LR-UD] [--frames N]
+'''
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+from lib.orientation import TransformPlan, ORIENTATIONS
+from lib.preview import PreviewPyramid
+
+try:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import pyqtgraph as pg
+    from PyQt5.QtGui import QTransform
+    pyqtgraph_is_available = True
+except ImportError:
+    pyqtgraph_is_available = False
+
+
+def branch_transform(image, mode):
+    # What GUI.update_image used to do on every frame
+    if mode == 'UD-LR':
+        return np.fliplr(np.flipud(image))
+    elif mode == 'LR-UD':
+        return np.flipud(np.fliplr(image))
+    elif mode == 'UD':
+        return np.flipud(image)
+    elif mode == 'LR':
+        return np.fliplr(image)
+    return image
+
+def time_per_frame(function, frames):
+    start = time.perf_counter()
+    for i in range(frames):
+        function()
+    return (time.perf_counter() - start) / frames
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--mode", choices=list(ORIENTATIONS), default="LR-UD")
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+
+    frame = np.random.default_rng(0).integers(0, 256, (args.height, args.width), dtype=np.uint8)
+    plan = TransformPlan.from_name(args.mode)
+    identical = np.array_equal(branch_transform(np.transpose(frame), args.mode), plan.oriented(frame))
+    print(f"{args.width}x{args.height} Mono8, mode {args.mode}, identical views: {identical}")
+
+    old_time = time_per_frame(lambda: branch_transform(np.transpose(frame), args.mode), args.frames * 10)
+    plan_time = time_per_frame(lambda: plan.oriented(frame), args.frames * 10)
+    print(f"orient   transpose + flips {old_time * 1e6:8.2f} us/frame, planned view {plan_time * 1e6:8.2f} us/frame")
+
+    pyramid = PreviewPyramid((1, 2, 4))
+    for factor in pyramid.factors[1:]:
+        bin_time = time_per_frame(lambda: pyramid.binned(frame, factor), args.frames)
+        print(f"bin {factor}x{factor}  {bin_time * 1e6:8.1f} us/frame")
+
+    if not pyqtgraph_is_available:
+        print("pyqtgraph/PyQt5 not available, skipping the setImage timings")
+    else:
+        app = pg.mkQApp()
+        item = pg.ImageItem()
+        transform = QTransform(*plan.display_matrix(plan.oriented(frame).shape))
+
+        def old_path():
+            item.setImage(branch_transform(np.transpose(frame), args.mode), levels=(0, 255))
+            item.render()
+
+        def planned_path():
+            item.setImage(plan.unflipped(frame), levels=(0, 255))
+            item.setTransform(transform)
+            item.render()
+
+        old_time = time_per_frame(old_path, args.frames)
+        item.resetTransform()
+        plan_time = time_per_frame(planned_path, args.frames)
+        print(f"setImage negative strides  {old_time * 1e6:8.1f} us/frame, planned {plan_time * 1e6:8.1f} us/frame"
+              f"  ({old_time / plan_time:.2f}x)")
+
+        for factor in pyramid.factors[1:]:
+            preview_transform = QTransform(*plan.display_matrix(plan.oriented(frame).shape, factor))
+
+            def preview_path():
+                item.setImage(plan.unflipped(pyramid.binned(frame, factor)), levels=(0, 255))
+                item.setTransform(preview_transform)
+                item.render()
+
+            preview_time = time_per_frame(preview_path, args.frames)
+            print(f"setImage {factor}x{factor} preview  {preview_time * 1e6:8.1f} us/frame  ({old_time / preview_time:.2f}x)")
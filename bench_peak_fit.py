@@ -0,0 +1,62 @@
+'''
+Accuracy and cost of the pointing-error methods on synthetic Gaussian spots.
+Every frame has a spot near each of the seven hexagon vertices, moved by a
+random sub-pixel offset; each method's (dx, dy) from lib/pointing.py is
+compared with the true offset. Times are per frame for all seven windows.
+
+    python3 bench_peak_fit.py [--sigma S] [--noise N] [--frames N]
+'''
+
+import time
+import argparse
+
+import numpy as np
+
+import lib.pointing as pointing
+
+
+def generate_hexagon_vertices(center, radius):
+    angles_rad = np.radians(np.array([60 * i for i in range(6)]))
+    x = center[0] + radius * np.cos(angles_rad)
+    y = center[1] + radius * np.sin(angles_rad)
+    return np.vstack([np.column_stack([x, y]), center])
+
+def make_frame(rng, width, height, centers, offsets, sigma, peak, noise):
+    image = rng.normal(0, noise, (height, width)) if noise else np.zeros((height, width))
+    for (cx, cy), (dx, dy) in zip(centers, offsets):
+        # Only the window around each spot, the tails are negligible further out
+        x0, x1 = max(cx - 8*int(sigma) - 8, 0), min(cx + 8*int(sigma) + 8, width)
+        y0, y1 = max(cy - 8*int(sigma) - 8, 0), min(cy + 8*int(sigma) + 8, height)
+        y, x = np.mgrid[y0:y1, x0:x1]
+        image[y0:y1, x0:x1] += peak * np.exp(-((x - cx - dx)**2 + (y - cy - dy)**2) / (2 * sigma**2))
+    return np.clip(np.round(image), 0, 255).astype(np.uint8)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--spacing", type=int, default=100)
+    parser.add_argument("--knn", type=int, default=30)
+    parser.add_argument("--sigma", type=float, default=2.5)
+    parser.add_argument("--peak", type=float, default=200)
+    parser.add_argument("--noise", type=float, default=2.0)
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = generate_hexagon_vertices((args.width // 2, args.height // 2), args.spacing).astype(int)
+    truth = rng.uniform(-2, 2, (args.frames, len(centers), 2))
+    frames = [make_frame(rng, args.width, args.height, centers, offsets, args.sigma, args.peak, args.noise)
+              for offsets in truth]
+    print(f"{len(centers)} spots, sigma {args.sigma} px, peak {args.peak:.0f}, noise {args.noise} counts, "
+          f"{args.frames} frames, knn {args.knn}")
+    print(f"{'method':>10} {'rms err px':>11} {'max err px':>11} {'us/frame':>9}")
+
+    for method in pointing.METHODS:
+        kernel = pointing.pointing_kernel(frames[0].shape, centers, args.knn)
+        start = time.perf_counter()
+        results = [kernel.measure(frame, method) for frame in frames]
+        elapsed = (time.perf_counter() - start) / args.frames
+        measured = np.array([np.column_stack([stats["dx"], stats["dy"]]) for stats in results])
+        errors = np.hypot(*(measured - truth).transpose(2, 0, 1))
+        print(f"{method:>10} {np.sqrt(np.mean(errors**2)):11.3f} {errors.max():11.3f} {elapsed * 1e6:9.1f}")
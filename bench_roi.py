@@ -0,0 +1,121 @@
+'''
+Times the hexagon lobe sums: full-frame ogrid masks (as the scripts used to
+do) against the cached ROI indices in lib/roi.py, and the full per-lobe
+statistics (sum, max, centroid, count) from LobeIntegrator. Also times the
+GUI's efficiency ROIs (EllipseRegion masks, which replaced getArrayRegion)
+and the pointing error of the lobe windows, one window at a time against the
+batched kernel in lib/pointing.py.
+
+    python3 bench_roi.py [--width W] [--height H] [--radius R] [--frames N]
+'''
+
+import time
+import argparse
+
+import numpy as np
+
+import lib.roi as roi
+import lib.pointing as pointing
+
+
+def generate_hexagon_vertices(center, radius):
+    angles_rad = np.radians(np.array([60 * i for i in range(6)]))
+    x = center[0] + radius * np.cos(angles_rad)
+    y = center[1] + radius * np.sin(angles_rad)
+    return np.vstack([np.column_stack([x, y]), center])
+
+def ogrid_sums(image_data, centers, radius_pixels):
+    sums = []
+    for center in centers:
+        y, x = np.ogrid[-center[1]:image_data.shape[0]-center[1], -center[0]:image_data.shape[1]-center[0]]
+        mask = x*x + y*y <= radius_pixels*radius_pixels
+        sums.append(np.sum(image_data[mask]))
+    return sums
+
+def vertex(minus, center, plus):
+    # Vertex of the parabola through (-1, minus), (0, center), (1, plus), 0 unless it is a maximum
+    curvature = minus - 2*center + plus
+    return (minus - plus) / (2*curvature) if curvature < 0 else 0.0
+
+def fit_peak(window, row, col, method):
+    # One window's sub-pixel peak; the 2D quadratic is an explicit least-squares fit
+    height, width = window.shape
+    if not (0 < row < height - 1 and 0 < col < width - 1):
+        return row, col
+    patch = window[row-1:row+2, col-1:col+2].astype(np.float64)
+    if method == "gaussian":
+        patch = np.log(np.maximum(patch, 1.0))
+    if method in ("parabolic", "gaussian"):
+        dy = vertex(patch[0, 1], patch[1, 1], patch[2, 1])
+        dx = vertex(patch[1, 0], patch[1, 1], patch[1, 2])
+    else:
+        y, x = np.mgrid[-1:2, -1:2].reshape(2, -1)
+        terms = np.column_stack([np.ones(9), x, y, x*x/2, x*y, y*y/2])
+        a, gx, gy, hxx, hxy, hyy = np.linalg.lstsq(terms, patch.reshape(-1), rcond=None)[0]
+        if hxx < 0 and hxx*hyy - hxy*hxy > 0:
+            dx, dy = np.linalg.solve([[hxx, hxy], [hxy, hyy]], [-gx, -gy])
+        else:
+            dx = dy = 0.0
+    return row + np.clip(dy, -1, 1), col + np.clip(dx, -1, 1)
+
+def window_pointing_errors(image_data, centers, knn, method):
+    # One window at a time, as the GUI used to: sliced [x, y] from the display image
+    errors = []
+    for x, y in centers:
+        window = image_data[y-knn:y+knn, x-knn:x+knn].T
+        if method == "max":
+            coord = np.unravel_index(np.argmax(window), window.shape)
+        elif method != "centroid":
+            coord = fit_peak(window, *np.unravel_index(np.argmax(window), window.shape), method)
+        else:
+            rows, cols = np.indices(window.shape)
+            coord = (np.average(rows, weights=window), np.average(cols, weights=window))
+        errors.append(np.sqrt(np.sum((np.array(coord) - knn)**2))*15/2.8)
+    return np.array(errors)
+
+def time_per_frame(function, frames):
+    start = time.perf_counter()
+    for i in range(frames):
+        function()
+    return (time.perf_counter() - start) / frames
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--radius", type=int, default=20)
+    parser.add_argument("--spacing", type=int, default=50)
+    parser.add_argument("--knn", type=int, default=30)
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    image_data = rng.integers(0, 256, (args.height, args.width), dtype=np.uint8)
+    centers = generate_hexagon_vertices((args.width // 2, args.height // 2), args.spacing).astype(int)
+
+    expected = ogrid_sums(image_data, centers, args.radius)
+    actual = roi.sum_in_circles(image_data, centers, args.radius)
+    print(f"{len(centers)} lobes of radius {args.radius} px on {args.width}x{args.height}, identical: {np.array_equal(expected, actual)}")
+
+    ogrid_time = time_per_frame(lambda: ogrid_sums(image_data, centers, args.radius), args.frames)
+    cached_time = time_per_frame(lambda: roi.sum_in_circles(image_data, centers, args.radius), args.frames)
+    print(f"ogrid masks  {ogrid_time * 1e6:10.1f} us/frame")
+    print(f"cached ROIs  {cached_time * 1e6:10.1f} us/frame  ({ogrid_time / cached_time:.0f}x)")
+
+    integrator = roi.lobe_integrator(image_data.shape, centers, args.radius)
+    stats_time = time_per_frame(lambda: integrator.measure(image_data), args.frames)
+    print(f"lobe stats   {stats_time * 1e6:10.1f} us/frame  (sum, max, centroid, count)")
+
+    inner = roi.EllipseRegion((args.width // 2, args.height // 2), (300 // 15, 300 // 15))
+    outer = roi.EllipseRegion((args.width // 2 - 20, args.height // 2 - 20), (900 // 15, 900 // 15))
+    ellipse_time = time_per_frame(lambda: (inner.sum(image_data), outer.sum(image_data)), args.frames)
+    print(f"GUI ROIs     {ellipse_time * 1e6:10.1f} us/frame  (inner + full ROI sums)")
+
+    for method in pointing.METHODS:
+        expected = window_pointing_errors(image_data, centers, args.knn, method)
+        actual, rms = pointing.pointing_error(image_data, centers, args.knn, method)
+        loop_time = time_per_frame(lambda: window_pointing_errors(image_data, centers, args.knn, method), args.frames)
+        batched_time = time_per_frame(lambda: pointing.pointing_error(image_data, centers, args.knn, method), args.frames)
+        print(f"pointing {method:8} loop {loop_time * 1e6:8.1f} us/frame, batched {batched_time * 1e6:8.1f} us/frame"
+              f"  ({loop_time / batched_time:.1f}x, identical: {np.allclose(expected, actual['error'])})")
+    print(roi.cache_info())
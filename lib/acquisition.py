@@ -0,0 +1,378 @@
+'''
+Shared acquisition engine for the eBUS scripts.
+
+Every script used to carry its own copy of connect_to_device / open_stream /
+configure_stream_buffers / acquire_images. They now live here, together with
+AcquisitionEngine which owns the RetrieveBuffer/QueueBuffer hot loop and
+hands frames to pluggable per-frame consumers.
+
+Consumers come in two flavours:
+  * inline consumers run on the retrieval thread and get a zero-copy view of
+    the PvBuffer. They must be cheap and must not keep the array, because the
+    buffer is requeued as soon as they return.
+  * threaded consumers (the default) run on their own worker thread behind a
+    bounded queue and get a private copy of the frame. If a worker falls
+    behind, frames for that worker are dropped and counted instead of
+    stalling the stream.
+
+With ownership=True nothing is copied. Each Frame keeps its PvBuffer checked
+out of the stream until every holder has called release(); the engine puts it
+back in the stream on the retrieval thread. Consumers that want to keep a
+frame past their own call take a reference with retain(), and frame.copy()
+is the only way to get data that outlives the last release(). At most
+max_checked_out buffers are held at once; frames arriving beyond that are
+requeued untouched and counted as dropped.
+'''
+
+import time
+import queue
+import threading
+from collections import deque
+
+import eBUS as eb
+
+BUFFER_COUNT = 16
+
+
+class Frame:
+    """
+    A single acquired frame as handed to consumers. Outside ownership mode
+    retain()/release() are no-ops, so consumers can call them unconditionally.
+    """
+    __slots__ = ('data', 'block_id', 'timestamp', 'pixel_type', 'pvbuffer', '_engine', '_refs')
+
+    def __init__(self, data, block_id=0, timestamp=0, pixel_type=None, engine=None, pvbuffer=None):
+        self.data = data
+        self.block_id = block_id
+        self.timestamp = timestamp
+        self.pixel_type = pixel_type
+        self.pvbuffer = pvbuffer
+        self._engine = engine
+        self._refs = 1
+
+    def retain(self):
+        if self._engine is not None:
+            self._engine._retain(self)
+        return self
+
+    def release(self):
+        if self._engine is not None:
+            self._engine._release(self)
+
+    def copy(self):
+        # Detached frame that stays valid after the PvBuffer is requeued
+        return Frame(self.data.copy(), self.block_id, self.timestamp, self.pixel_type)
+
+
+def connect_to_device(connection_ID):
+    # Connect to the GigE Vision or USB3 Vision device
+    print("Connecting to device.")
+    result, device = eb.PvDevice.CreateAndConnect(connection_ID)
+    if device == None:
+        print(f"Unable to connect to device: {result.GetCodeString()} ({result.GetDescription()})")
+    return device
+
+def open_stream(connection_ID):
+    # Open stream to the GigE Vision or USB3 Vision device
+    print("Opening stream from device.")
+    result, stream = eb.PvStream.CreateAndOpen(connection_ID)
+    if stream == None:
+        print(f"Unable to stream from device. {result.GetCodeString()} ({result.GetDescription()})")
+    return stream
+
+def configure_stream(device, stream):
+    # If this is a GigE Vision device, configure GigE Vision specific streaming parameters
+    if isinstance(device, eb.PvDeviceGEV):
+        # Negotiate packet size
+        device.NegotiatePacketSize()
+        # Configure device streaming destination
+        device.SetStreamDestination(stream.GetLocalIPAddress(), stream.GetLocalPort())
+
+def configure_stream_buffers(device, stream, buffer_count=BUFFER_COUNT):
+    buffer_list = []
+    # Reading payload size from device
+    size = device.GetPayloadSize()
+
+    # Use buffer_count or the maximum number of buffers, whichever is smaller
+    buffer_count = min(buffer_count, stream.GetQueuedBufferMaximum())
+
+    # Allocate buffers
+    for i in range(buffer_count):
+        # Create new pvbuffer object
+        pvbuffer = eb.PvBuffer()
+        # Have the new pvbuffer object allocate payload memory
+        pvbuffer.Alloc(size)
+        # Add to external list - used to eventually release the buffers
+        buffer_list.append(pvbuffer)
+
+    # Queue all buffers in the stream
+    for pvbuffer in buffer_list:
+        stream.QueueBuffer(pvbuffer)
+    print(f"Created {buffer_count} buffers")
+    return buffer_list
+
+def close_stream(stream):
+    # Close the stream
+    print("Closing stream")
+    stream.Close()
+    eb.PvStream.Free(stream)
+
+def stop_on_key(kb, interrupted=None):
+    """
+    should_stop for AcquisitionEngine.run: true once kb is stopping, a key
+    was pressed or interrupted() returns true. The key is consumed, so a
+    later kb.getch() waits for a new one.
+    """
+    def should_stop():
+        if kb.is_stopping() or (interrupted is not None and interrupted()):
+            return True
+        if kb.kbhit():
+            kb.getch()
+            return True
+        return False
+    return should_stop
+
+def disconnect_device(device):
+    # Disconnect the device
+    print("Disconnecting device")
+    device.Disconnect()
+    eb.PvDevice.Free(device)
+
+
+class ConsumerWorker(threading.Thread):
+    """
+    Runs one threaded consumer behind a bounded queue so analytics never
+    execute on the retrieval thread.
+    """
+    def __init__(self, consumer, queue_size=64):
+        super().__init__(daemon=True)
+        self.consumer = consumer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.frames_dropped = 0
+        self.frames_processed = 0
+
+    def submit(self, frame):
+        # The queued frame holds its own reference until the consumer is done
+        frame.retain()
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            frame.release()
+            self.frames_dropped += 1
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            try:
+                self.consumer(frame)
+            except Exception as e:
+                print(f"\nException in consumer {self.consumer}: {e}")
+            frame.release()
+            self.frames_processed += 1
+
+    def stop(self):
+        # Let the worker finish whatever is already queued
+        self.queue.put(None)
+        self.join()
+
+
+class AcquisitionEngine:
+    """
+    Owns the RetrieveBuffer/QueueBuffer loop for one device/stream pair.
+
+    Usage:
+        engine = AcquisitionEngine(device, stream)
+        engine.add_consumer(show_frame, inline=True)
+        engine.add_consumer(compute_roi_sums)
+        engine.run(should_stop=stop_on_key(kb))
+    """
+    def __init__(self, device, stream, timeout=1000, stats_interval=0.5, verbose=True,
+                 ownership=False, max_checked_out=8):
+        self.device = device
+        self.stream = stream
+        self.timeout = timeout
+        self.stats_interval = stats_interval
+        self.verbose = verbose
+        self.ownership = ownership
+        self.max_checked_out = max_checked_out
+
+        self.inline_consumers = []
+        self.threaded_consumers = []
+        self.workers = []
+
+        self.frames_acquired = 0
+        self.frames_failed = 0
+        self.frames_checked_out = 0
+        self.checkout_drops = 0
+        self.frame_rate = 0.0
+        self.bandwidth = 0.0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._ref_lock = threading.Lock()
+        self._released = deque()
+
+    def add_consumer(self, consumer, inline=False, queue_size=64):
+        """
+        Register consumer(frame). Inline consumers get a view into the
+        PvBuffer; threaded consumers get a copy (a view in ownership mode)
+        and run on their own worker.
+        """
+        if inline:
+            self.inline_consumers.append(consumer)
+        else:
+            self.threaded_consumers.append((consumer, queue_size))
+
+    @property
+    def frames_dropped(self):
+        return self.checkout_drops + sum(worker.frames_dropped for worker in self.workers)
+
+    def _retain(self, frame):
+        with self._ref_lock:
+            if frame._refs == 0:
+                raise RuntimeError(f"Frame {frame.block_id} was already released")
+            frame._refs += 1
+
+    def _release(self, frame):
+        with self._ref_lock:
+            if frame._refs == 0:
+                raise RuntimeError(f"Frame {frame.block_id} released more times than retained")
+            frame._refs -= 1
+            if frame._refs:
+                return
+            self.frames_checked_out -= 1
+        # Requeued by the retrieval thread so only one thread ever talks to the stream
+        self._released.append(frame.pvbuffer)
+
+    def request_stop(self):
+        self._stop_event.set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        # Run the acquisition loop on a background thread
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self, should_stop=None):
+        # Get device parameters need to control streaming
+        device_params = self.device.GetParameters()
+
+        # Map the GenICam AcquisitionStart and AcquisitionStop commands
+        start = device_params.Get("AcquisitionStart")
+        stop = device_params.Get("AcquisitionStop")
+
+        # Get stream parameters
+        stream_params = self.stream.GetParameters()
+
+        # Map a few GenICam stream stats counters
+        frame_rate = stream_params.Get("AcquisitionRate")
+        bandwidth = stream_params["Bandwidth"]
+
+        self._stop_event.clear()
+        self.workers = [ConsumerWorker(consumer, queue_size) for consumer, queue_size in self.threaded_consumers]
+        for worker in self.workers:
+            worker.start()
+
+        # Hoist everything we can out of the hot loop
+        stream = self.stream
+        timeout = self.timeout
+        inline_consumers = self.inline_consumers
+        workers = self.workers
+        stop_event = self._stop_event
+        ownership = self.ownership
+        released = self._released
+        perf_counter = time.perf_counter
+        next_stats = perf_counter() + self.stats_interval
+
+        try:
+            # Enable streaming and send the AcquisitionStart command
+            print("Enabling streaming and sending AcquisitionStart command.")
+            self.device.StreamEnable()
+            start.Execute()
+
+            while not stop_event.is_set() and not (should_stop and should_stop()):
+                # Give back buffers whose frames have been released by every holder
+                while released:
+                    stream.QueueBuffer(released.popleft())
+
+                # Retrieve next pvbuffer
+                result, pvbuffer, operational_result = stream.RetrieveBuffer(timeout)
+                if not result.IsOK():
+                    # Retrieve pvbuffer failure
+                    self.frames_failed += 1
+                    continue
+
+                requeue = True
+                if operational_result.IsOK() and pvbuffer.GetPayloadType() == eb.PvPayloadTypeImage:
+                    image = pvbuffer.GetImage()
+                    image_data = image.GetDataPointer()
+                    if not ownership:
+                        frame = Frame(image_data, pvbuffer.GetBlockID(), pvbuffer.GetTimestamp(), image.GetPixelType())
+                        for consumer in inline_consumers:
+                            consumer(frame)
+                        if workers:
+                            # One private copy shared (read-only) by all threaded consumers
+                            frame = frame.copy()
+                            for worker in workers:
+                                worker.submit(frame)
+                        self.frames_acquired += 1
+                    elif self.frames_checked_out >= self.max_checked_out:
+                        # Consumers are sitting on too many buffers, keep the stream fed instead
+                        self.checkout_drops += 1
+                    else:
+                        with self._ref_lock:
+                            self.frames_checked_out += 1
+                        frame = Frame(image_data, pvbuffer.GetBlockID(), pvbuffer.GetTimestamp(),
+                                      image.GetPixelType(), self, pvbuffer)
+                        for consumer in inline_consumers:
+                            consumer(frame)
+                        for worker in workers:
+                            worker.submit(frame)
+                        self.frames_acquired += 1
+                        # Drop the engine's own reference, the buffer is requeued once consumers are done
+                        requeue = False
+                        frame.release()
+                else:
+                    self.frames_failed += 1
+
+                if requeue:
+                    # Re-queue the pvbuffer in the stream object
+                    stream.QueueBuffer(pvbuffer)
+
+                # GenICam reads are slow, only poll the stats counters periodically
+                now = perf_counter()
+                if now >= next_stats:
+                    next_stats = now + self.stats_interval
+                    result, self.frame_rate = frame_rate.GetValue()
+                    result, self.bandwidth = bandwidth.GetValue()
+                    if self.verbose:
+                        print(f"Frames: {self.frames_acquired} Dropped: {self.frames_dropped} "
+                              f"{self.frame_rate:.1f} FPS  {self.bandwidth / 1000000.0:.1f} Mb/s     ", end='\r')
+        finally:
+            # Runs when a consumer raised too, so the device never keeps streaming
+            # and the workers always exit
+            # Tell the device to stop sending images.
+            print("\nSending AcquisitionStop command to the device")
+            stop.Execute()
+
+            # Disable streaming on the device
+            print("Disable streaming on the controller.")
+            self.device.StreamDisable()
+
+            # Abort all buffers from the stream and dequeue
+            print("Aborting buffers still in stream")
+            stream.AbortQueuedBuffers()
+            while stream.GetQueuedBufferCount() > 0:
+                result, pvbuffer, operational_result = stream.RetrieveBuffer()
+
+            for worker in workers:
+                worker.stop()
+            released.clear()
@@ -0,0 +1,180 @@
+'''
+Multi-process frame analytics fed through shared memory.
+
+Per-frame math run on threads (the GUI analytics worker, the engine
+consumers) shares one core with the acquisition loop because of the GIL.
+AnalyticsPool moves it into worker processes instead: frames are copied into
+a ring of slots in a multiprocessing.shared_memory block, only the slot
+number goes through a queue, and each worker computes the lobe sums,
+centroids and pointing error of the frame in place. Results come back in
+submission order whatever order the workers finish in.
+
+    analysis = FrameAnalysis(centers, radius, knn=30)
+    with AnalyticsPool((512, 640), analysis, workers=4) as pool:
+        pool.submit(image_data, block_id)
+        ...
+        seq, block_id, result = pool.get(timeout=1)
+
+Centers are (x, y) in the frame, as in lib/roi.py. The pointing error is
+only measured on single-channel frames; RGB frames get lobe stats only.
+
+control_stream.py uses it as its analytics backend when ANALYTICS_PROCESSES
+is set. The GUI keeps its threaded FrameAnalytics: the analysis a pool runs
+is fixed when its workers start, while the GUI's vertices and ROIs move
+with the mouse.
+'''
+
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import lib.roi as roi
+import lib.pointing as pointing
+
+
+class FrameAnalysis:
+    """
+    Everything measured on one frame: LobeIntegrator stats of every lobe and
+    the pointing error of every lobe window (peak or centroid offset from
+    the window center). Picklable, so it can be handed to worker processes.
+    """
+    def __init__(self, centers, radius, knn=30, method="max", scale=pointing.POINTING_SCALE):
+        if method not in pointing.METHODS:
+            raise ValueError(f"Unknown pointing method {method!r}")
+        self.centers = np.array(centers, dtype=int).reshape(-1, 2)
+        self.radius = float(radius)
+        self.knn = int(knn)
+        self.method = method
+        self.scale = scale
+
+    def __call__(self, image_data):
+        lobes = roi.lobe_integrator(image_data.shape[:2], self.centers, self.radius).measure(image_data)
+        if image_data.ndim != 2:
+            return {"lobes": lobes, "pointing_error": None, "offsets": None, "rms": np.nan}
+        offsets, rms = pointing.pointing_error(image_data, self.centers, self.knn, self.method, self.scale)
+        return {"lobes": lobes, "pointing_error": offsets["error"], "offsets": offsets, "rms": rms}
+
+
+def _worker(shm_name, shape, dtype, slots, analysis, tasks, results, free):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frames = np.ndarray((slots,) + shape, dtype=dtype, buffer=shm.buf)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, block_id = task
+            try:
+                result = analysis(frames[slot])
+            except Exception as e:
+                print(f"\nException in analytics worker: {e}")
+                result = None
+            # Results never point into the slot, so it can be refilled right away
+            free.put(slot)
+            results.put((seq, block_id, result))
+    finally:
+        del frames
+        shm.close()
+
+
+class AnalyticsPool:
+    def __init__(self, shape, analysis, workers=2, slots=None, dtype=np.uint8):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.analysis = analysis
+        self.n_workers = max(1, workers)
+        # Enough slots for every worker to have one frame in hand and one waiting
+        self.slots = slots or 2 * self.n_workers
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.frames_returned = 0
+        self.processes = []
+        self._pending = {}
+
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots * frame_bytes)
+        self.frames = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.tasks = mp.Queue()
+        self.results = mp.Queue()
+        self.free = mp.Queue()
+        for slot in range(self.slots):
+            self.free.put(slot)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if self.processes:
+            return
+        args = (self.shm.name, self.shape, self.dtype, self.slots, self.analysis,
+                self.tasks, self.results, self.free)
+        self.processes = [mp.Process(target=_worker, args=args, daemon=True) for i in range(self.n_workers)]
+        for process in self.processes:
+            process.start()
+
+    def submit(self, image_data, block_id=0, timeout=None):
+        """
+        Copy a frame into a free slot and queue it. Waits up to timeout for a
+        slot (forever with None); returns the frame's sequence number, or
+        None if it was dropped.
+        """
+        try:
+            if timeout == 0:
+                slot = self.free.get_nowait()
+            else:
+                slot = self.free.get(timeout=timeout)
+        except queue.Empty:
+            self.frames_dropped += 1
+            return None
+        np.copyto(self.frames[slot], image_data)
+        seq = self.frames_submitted
+        self.frames_submitted += 1
+        self.tasks.put((seq, slot, block_id))
+        return seq
+
+    def get(self, timeout=None):
+        """
+        (seq, block_id, result) of the next frame in submission order, or None
+        if it is not ready within timeout.
+        """
+        seq = self.frames_returned
+        while seq not in self._pending:
+            try:
+                item = self.results.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            self._pending[item[0]] = item
+        self.frames_returned += 1
+        return self._pending.pop(seq)
+
+    def pending(self):
+        # Frames submitted but not yet returned by get()
+        return self.frames_submitted - self.frames_returned
+
+    def close(self):
+        # Workers finish the frames already queued before they exit; their
+        # results are kept for get()
+        if self.shm is None:
+            return
+        for process in self.processes:
+            self.tasks.put(None)
+        while any(process.is_alive() for process in self.processes):
+            # A worker can't exit while its results are still unread
+            try:
+                item = self.results.get(timeout=0.05)
+                self._pending[item[0]] = item
+            except queue.Empty:
+                pass
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        del self.frames
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
@@ -0,0 +1,240 @@
+'''
+Offline re-analysis of recorded sessions.
+
+Lobe sums, pointing error and efficiency are otherwise only measured live,
+one frame at a time. To try another lobe radius, window size or pointing
+method on a recording (lib/recorder.py), analyse_session() streams it in
+chunks of frames and runs the same kernels on a whole chunk at once:
+
+    lobes      one gather of every lobe pixel of every frame in the chunk,
+               then one np.add.reduceat along the pixel axis (the indices
+               of lib/roi.py's LobeIntegrator)
+    pointing   one take of every vertex window of every frame (the indices
+               of lib/pointing.py's PointingKernel), then a single argmax,
+               peak fit or CentroidEngine pass over the (frames * vertices)
+               window stack
+
+Chunks are spread over a process pool. Workers open the recording
+themselves, so only (start, stop) goes to them and only the per-frame
+columns come back. Results are written as one compressed .npz with a
+column per quantity, frame-indexed like the recording's metadata:
+
+    block_id, timestamp, host_time    (n,)    from the recording
+    lobe_sum, lobe_max, lobe_x,
+    lobe_y                            (n, v)  per lobe, see roi.LOBE_DTYPE
+    dx, dy, error                     (n, v)  per vertex, see
+                                              pointing.POINTING_DTYPE
+    rms_error, efficiency, lobe_share (n,)
+
+plus the centers, radius, knn, method and efficiency radii the columns were
+computed with. Efficiency is the live view's metric: the sum inside an
+inner circle over the sum inside a full circle, both around the main lobe
+(the GUI's concentric ROIs, without their background offsets); nan unless
+efficiency_radii are given. lobe_share is the main lobe's share of the
+summed lobes, nan with fewer than two lobes. Frames are (row,
+col) and centers (x, y), as in lib/roi.py. The pointing columns need
+single-channel frames; for RGB recordings (control_stream.py records RGB8
+as well as Mono8) they are nan.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import lib.roi as roi
+import lib.pointing as pointing
+import lib.peak_fit as peak_fit
+from lib.centroid import CentroidEngine
+from lib.recorder import SessionReader
+
+RESULTS_FILE = "analysis.npz"
+# Frames per chunk: enough to amortise the per-chunk numpy calls while the
+# gathered lobe pixels and windows of a chunk stay a few MB
+CHUNK_SIZE = 64
+
+
+def stack_rms_error(errors):
+    """
+    pointing.rms_error for every row of an (n, v) array of errors.
+    """
+    valid = ~np.isnan(errors)
+    # As in rms_error, the first valid vertex of each frame is left out
+    used = valid & (np.cumsum(valid, axis=1) > 1)
+    counts = used.sum(axis=1)
+    squares = np.where(used, errors, 0.0)**2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, np.sqrt(squares.sum(axis=1) / counts), np.nan)
+
+
+class StackAnalysis:
+    """
+    Lobe stats, pointing error and efficiency of a stack of frames. Picklable,
+    so it can be handed to worker processes. main_lobe indexes the main lobe
+    (the center, last in the hexagon vertex lists); efficiency_radii are the
+    (inner, full) radii in pixels of the efficiency circles around it.
+    """
+    def __init__(self, centers, radius, knn=30, method="max", scale=pointing.POINTING_SCALE,
+                 background=0.0, threshold=0.0, main_lobe=-1, efficiency_radii=None):
+        if method not in pointing.METHODS:
+            raise ValueError(f"Unknown pointing method {method!r}")
+        self.centers = np.array(centers, dtype=int).reshape(-1, 2)
+        self.radius = float(radius)
+        self.knn = int(knn)
+        self.method = method
+        self.scale = scale
+        self.background = float(background)
+        self.threshold = float(threshold)
+        self.main_lobe = main_lobe
+        self.efficiency_radii = None if efficiency_radii is None else tuple(float(r) for r in efficiency_radii)
+        self._centroids = None
+
+    def __getstate__(self):
+        # Each process builds its own centroid buffers
+        state = self.__dict__.copy()
+        state["_centroids"] = None
+        return state
+
+    def lobes(self, frames):
+        """
+        (n, v) sum, max, x and y of every lobe of every frame in an
+        (n, h, w[, c]) stack.
+        """
+        count, lobes = len(frames), len(self.centers)
+        integrator = roi.lobe_integrator(frames.shape[1:3], self.centers, self.radius)
+        sums = np.zeros((count, lobes), dtype=np.uint64)
+        peaks = np.zeros((count, lobes))
+        x = np.full((count, lobes), np.nan)
+        y = np.full((count, lobes), np.nan)
+        if not len(integrator.indices):
+            return sums, peaks, x, y
+
+        if frames.ndim == 4:
+            pixels = frames.reshape(count, -1, frames.shape[3])[:, integrator.indices].sum(axis=2, dtype=np.uint64)
+        else:
+            pixels = frames.reshape(count, -1)[:, integrator.indices]
+        weights = pixels.astype(np.float64)
+        starts, filled = integrator._starts, integrator.filled
+
+        sums[:, filled] = np.add.reduceat(pixels, starts, axis=1, dtype=np.uint64)
+        peaks[:, filled] = np.maximum.reduceat(weights, starts, axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x[:, filled] = np.add.reduceat(weights * integrator.cols, starts, axis=1) / sums[:, filled]
+            y[:, filled] = np.add.reduceat(weights * integrator.rows, starts, axis=1) / sums[:, filled]
+        return sums, peaks, x, y
+
+    def circle_sums(self, frames, center, radius):
+        # (n,) sum of every channel within radius of center, for every frame
+        count = len(frames)
+        integrator = roi.lobe_integrator(frames.shape[1:3], [center], radius)
+        pixels = frames.reshape((count, -1) + frames.shape[3:])[:, integrator.indices]
+        return pixels.reshape(count, -1).sum(axis=1, dtype=np.uint64)
+
+    def efficiency(self, frames):
+        """
+        (n,) inner circle sum over full circle sum around the main lobe, as
+        the live view measures it with its ROIs.
+        """
+        if self.efficiency_radii is None:
+            return np.full(len(frames), np.nan)
+        center = self.centers[self.main_lobe]
+        inner, full = (self.circle_sums(frames, center, radius) for radius in self.efficiency_radii)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return inner / full
+
+    def pointing(self, frames):
+        """
+        (n, v) dx, dy and error of every vertex window of every frame in an
+        (n, h, w) stack, nan where the window is off the frame.
+        """
+        if frames.ndim != 3:
+            raise ValueError(f"Pointing needs an (n, h, w) stack of single-channel frames, got shape {frames.shape}")
+        count = len(frames)
+        kernel = pointing.pointing_kernel(frames.shape[1:3], self.centers, self.knn, self.scale,
+                                          self.background, self.threshold)
+        dx = np.full((count, len(self.centers)), np.nan)
+        dy = np.full((count, len(self.centers)), np.nan)
+        if kernel.valid.any():
+            size = 2 * self.knn
+            # Every window of every frame as one (n * valid vertices, size, size)
+            # stack, indexed [x, y] like the kernel's
+            windows = np.ascontiguousarray(frames).reshape(count, -1).take(kernel.flat, axis=1)
+            windows = windows.reshape(-1, size, size)
+            if self.method == "centroid":
+                if self._centroids is None:
+                    self._centroids = CentroidEngine(self.background, self.threshold)
+                xs, ys, totals = self._centroids.measure(windows)
+            else:
+                xs, ys = peak_fit.argmax_peaks(windows)
+                if self.method != "max":
+                    xs, ys = peak_fit.fit_peaks(windows, xs, ys, self.method)
+            dx[:, kernel.valid] = xs.reshape(count, -1) - self.knn
+            dy[:, kernel.valid] = ys.reshape(count, -1) - self.knn
+        return dx, dy, np.hypot(dx, dy) * self.scale
+
+    def __call__(self, frames):
+        """
+        Dict of per-frame columns (see the module docstring) for a stack of
+        frames.
+        """
+        sums, peaks, x, y = self.lobes(frames)
+        if frames.ndim == 3:
+            dx, dy, error = self.pointing(frames)
+        else:
+            dx = dy = error = np.full((len(frames), len(self.centers)), np.nan)
+        if len(self.centers) > 1:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                lobe_share = sums[:, self.main_lobe] / sums.sum(axis=1)
+        else:
+            lobe_share = np.full(len(frames), np.nan)
+        return {"lobe_sum": sums, "lobe_max": peaks, "lobe_x": x, "lobe_y": y,
+                "dx": dx, "dy": dy, "error": error, "rms_error": stack_rms_error(error),
+                "efficiency": self.efficiency(frames), "lobe_share": lobe_share}
+
+
+def _analyse_chunk(path, start, stop, analysis):
+    session = SessionReader(path)
+    return start, analysis(session.frames(start, stop))
+
+def analyse_session(path, analysis, output=None, chunk_size=CHUNK_SIZE, workers=None, progress=None):
+    """
+    Run analysis over every frame of the recording at path and save the
+    columns to output (RESULTS_FILE in the recording by default). workers=0
+    runs in this process; None uses one worker per CPU. progress, if given,
+    is called with (frames done, total frames) as chunks complete. Returns
+    the columns.
+    """
+    session = SessionReader(path)
+    total = len(session)
+    ranges = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+    chunks = {}
+
+    def collect(start, columns):
+        chunks[start] = columns
+        if progress:
+            progress(sum(len(c["efficiency"]) for c in chunks.values()), total)
+
+    if workers == 0 or len(ranges) < 2:
+        for start, stop in ranges:
+            collect(*_analyse_chunk(path, start, stop, analysis))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_analyse_chunk, path, start, stop, analysis) for start, stop in ranges]
+            for future in futures:
+                collect(*future.result())
+
+    if chunks:
+        columns = {name: np.concatenate([chunks[start][name] for start, stop in ranges])
+                   for name in chunks[0]}
+    else:
+        # Empty recording: columns of the right shapes and types, with no rows
+        blank = np.zeros((1,) + session.shape, dtype=session.frames_data.dtype)
+        columns = {name: value[:0] for name, value in analysis(blank).items()}
+    for name in ("block_id", "timestamp", "host_time"):
+        columns[name] = np.array(session.meta[name])
+
+    output = output or os.path.join(path, RESULTS_FILE)
+    np.savez_compressed(output, centers=analysis.centers, radius=analysis.radius, knn=analysis.knn,
+                        method=analysis.method, efficiency_radii=np.array(analysis.efficiency_radii or (), dtype=float),
+                        **columns)
+    return columns
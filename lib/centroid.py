@@ -0,0 +1,93 @@
+'''
+Allocation-free intensity-weighted centroids.
+
+The GUI's find_centroid_coord built two full index grids with np.indices and
+averaged them against the window, truncating the result to whole pixels.
+The centroid is separable: the row coordinate only needs the row marginal
+(the window summed along its columns) and the column coordinate only the
+column marginal, each dotted with a vector of pixel positions. CentroidEngine
+keeps those position vectors and every intermediate buffer per window shape,
+so once a shape has been seen a centroid allocates no arrays at all.
+
+Windows can be single (h, w) arrays or stacks (..., h, w), e.g. all hexagon
+vertex windows at once. Coordinates are sub-pixel, with pixel i at i (the
+convention of np.indices), in (row, col) order.
+'''
+
+import numpy as np
+
+
+class _Workspace:
+    # Buffers for one window shape, reused by every call
+    def __init__(self, shape):
+        lead, (height, width) = shape[:-2], shape[-2:]
+        self.row_positions = np.arange(height, dtype=np.float64)
+        self.col_positions = np.arange(width, dtype=np.float64)
+        self.work = np.empty(shape, dtype=np.float64)
+        self.below = np.empty(shape, dtype=bool)
+        self.row_marginal = np.empty(lead + (height,))
+        self.col_marginal = np.empty(lead + (width,))
+        self.total = np.empty(lead)
+        self.row = np.empty(lead)
+        self.col = np.empty(lead)
+
+
+class CentroidEngine:
+    """
+    Intensity-weighted centroid with optional background subtraction and
+    threshold. background is subtracted from every pixel and negative values
+    are clipped to 0; pixels still below threshold afterwards are ignored.
+    A window without signal gives nan.
+    """
+    def __init__(self, background=0.0, threshold=0.0):
+        self.background = float(background)
+        self.threshold = float(threshold)
+        self._workspaces = {}
+
+    def workspace(self, shape):
+        workspace = self._workspaces.get(shape)
+        if workspace is None:
+            workspace = self._workspaces[shape] = _Workspace(shape)
+        return workspace
+
+    def weights(self, window):
+        """
+        The pixel weights the centroid uses, in a reused float64 buffer: the
+        window after background and threshold.
+        """
+        workspace = self.workspace(window.shape)
+        # Casting into the buffer up front keeps the reductions below from
+        # allocating their own casting buffers
+        np.copyto(workspace.work, window)
+        if self.background:
+            np.subtract(workspace.work, self.background, out=workspace.work)
+            np.maximum(workspace.work, 0, out=workspace.work)
+        if self.threshold:
+            np.less(workspace.work, self.threshold, out=workspace.below)
+            np.copyto(workspace.work, 0, where=workspace.below)
+        return workspace.work
+
+    def measure(self, window):
+        """
+        (row, col, total) arrays over the leading axes of window. They are
+        buffers owned by the engine and overwritten by the next call with the
+        same window shape; copy them to keep them.
+        """
+        workspace = self.workspace(window.shape)
+        weights = self.weights(window)
+        np.sum(weights, axis=-1, out=workspace.row_marginal)
+        np.sum(weights, axis=-2, out=workspace.col_marginal)
+        np.sum(workspace.row_marginal, axis=-1, out=workspace.total)
+        np.matmul(workspace.row_marginal, workspace.row_positions, out=workspace.row)
+        np.matmul(workspace.col_marginal, workspace.col_positions, out=workspace.col)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            np.divide(workspace.row, workspace.total, out=workspace.row)
+            np.divide(workspace.col, workspace.total, out=workspace.col)
+        return workspace.row, workspace.col, workspace.total
+
+    def centroid(self, window):
+        """
+        Sub-pixel (row, col) of a single (h, w) window.
+        """
+        row, col, total = self.measure(window)
+        return float(row), float(col)
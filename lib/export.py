@@ -0,0 +1,123 @@
+'''
+Binary export of GUI measurements, off the GUI thread.
+
+Saving used to write the frame with np.savetxt (one formatted float per
+pixel), then every history as CSV and the matplotlib plots, all on the GUI
+thread. An ExportJob instead holds a snapshot of the arrays to save and
+writes them as one compressed .npz: the frame in its own dtype, and every
+history one column per entry ("p_err_hist/rms", ...) so a single quantity
+loads without the rest. Entries are written one at a time through zipfile,
+which is what np.savez_compressed does, so progress can be reported between
+them.
+
+CSV files and PNG plots are derived outputs: the same arrays through
+np.savetxt, and plots drawn on an Agg canvas of their own (pyplot's global
+state isn't safe off the main thread). They are only written when asked for.
+
+    job = ExportJob(base_path)
+    job.add_array('frame', frame)
+    job.add_columns('eff_hist', eff_hist, ['time', 'efficiency'])
+    job.add_plot('eff_hist', 'time', 'efficiency', 'Time (s)', 'Efficiency', scale=100)
+    job.run(progress=lambda done, total, label: ...)
+
+run() writes base_path + '.npz' and, with derived=True, base_path + '_<name>.csv'
+and base_path + '_<name>.png' files.
+'''
+
+import zipfile
+
+import numpy as np
+
+
+class ExportJob:
+    def __init__(self, base_path, derived=False, compress=True):
+        self.base_path = base_path
+        self.derived = derived
+        self.compress = compress
+        self.arrays = {}
+        self.tables = {}
+        self.columns = {}
+        self.plots = []
+
+    def add_array(self, name, array, csv=True):
+        # Stored as is; with csv, also a CSV when derived outputs are on
+        self.arrays[name] = np.asarray(array)
+        if csv:
+            self.tables[name] = self.arrays[name]
+
+    def add_columns(self, name, table, columns):
+        """
+        A (rows, columns) table stored column by column as name/<column>.
+        """
+        table = np.asarray(table)
+        for i, column in enumerate(columns):
+            self.arrays[f"{name}/{column}"] = np.ascontiguousarray(table[:, i])
+        self.tables[name] = table
+        self.columns[name] = list(columns)
+
+    def add_plot(self, name, x, y, xlabel, ylabel, scale=1.0, ylim=None):
+        # Plot column y against column x of a table added with add_columns
+        self.plots.append((name, x, y, xlabel, ylabel, scale, ylim))
+
+    @property
+    def npz_path(self):
+        return self.base_path + ".npz"
+
+    def steps(self):
+        return len(self.arrays) + (len(self.tables) + len(self.plots) if self.derived else 0)
+
+    def run(self, progress=None):
+        """
+        Write everything, calling progress(done, total, label) after each
+        step. Returns the paths written.
+        """
+        total, done = self.steps(), 0
+        compression = zipfile.ZIP_DEFLATED if self.compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(self.npz_path, "w", compression, allowZip64=True) as archive:
+            for name, array in self.arrays.items():
+                with archive.open(name + ".npy", "w", force_zip64=True) as f:
+                    np.lib.format.write_array(f, array, allow_pickle=False)
+                done += 1
+                if progress:
+                    progress(done, total, name)
+        paths = [self.npz_path]
+        if not self.derived:
+            return paths
+
+        for name, table in self.tables.items():
+            path = f"{self.base_path}_{name}.csv"
+            np.savetxt(path, table, delimiter=",")
+            paths.append(path)
+            done += 1
+            if progress:
+                progress(done, total, path)
+        for plot in self.plots:
+            path = self._plot(*plot)
+            if path:
+                paths.append(path)
+            done += 1
+            if progress:
+                progress(done, total, path or plot[0])
+        return paths
+
+    def _plot(self, name, x, y, xlabel, ylabel, scale, ylim):
+        table = self.tables.get(name)
+        if table is None or not len(table):
+            return None
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        columns = self.columns[name]
+        figure = Figure(figsize=(10, 7))
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        axes.plot(table[:, columns.index(x)], scale * table[:, columns.index(y)])
+        axes.set_xlabel(xlabel, fontsize=14)
+        axes.set_ylabel(ylabel, fontsize=14)
+        axes.grid()
+        if ylim is not None:
+            axes.set_ylim(*ylim)
+        axes.tick_params(labelsize=14)
+        path = f"{self.base_path}_{name}.png"
+        figure.savefig(path)
+        return path
@@ -0,0 +1,201 @@
+'''
+Fixed-capacity ring of preallocated numpy frames.
+
+Used between the acquisition thread and anything slower than the camera
+(display, recorders). Two modes:
+  * display mode (default): put() never blocks. When the ring is full the
+    oldest frame is overwritten and counted in frames_dropped, and
+    get_latest() hands back the newest frame and skips the rest.
+  * lossless mode: put() waits for a free slot, so recorders see every frame
+    as long as they keep up on average.
+
+The backing store is allocated on the first put() (or whenever the frame
+shape changes, e.g. after a window change), so nothing grows at runtime.
+'''
+
+import threading
+
+import numpy as np
+
+
+class FrameRing:
+    def __init__(self, capacity, shape=None, dtype=np.uint8, lossless=False):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.lossless = lossless
+        self.dtype = np.dtype(dtype)
+        self.frames = None
+        self.meta = [None] * capacity
+
+        self.head = 0       # next slot to read
+        self.count = 0      # frames currently held
+        self.frames_written = 0
+        self.frames_dropped = 0
+
+        self._cond = threading.Condition()
+        self._closed = False
+        if shape is not None:
+            self._alloc(tuple(shape))
+
+    def _alloc(self, shape):
+        self.frames = np.empty((self.capacity,) + shape, dtype=self.dtype)
+        self.head = 0
+        self.count = 0
+
+    @property
+    def depth(self):
+        return self.count
+
+    @property
+    def shape(self):
+        return None if self.frames is None else self.frames.shape[1:]
+
+    def put(self, frame, meta=None, timeout=None):
+        """
+        Copy frame into the next slot. Returns False only in lossless mode
+        when no slot freed up within timeout (the frame is then counted as
+        dropped).
+        """
+        with self._cond:
+            if self.frames is None or self.frames.shape[1:] != frame.shape:
+                self._alloc(frame.shape)
+
+            if self.count == self.capacity:
+                if self.lossless:
+                    if not self._cond.wait_for(lambda: self.count < self.capacity or self._closed, timeout):
+                        self.frames_dropped += 1
+                        return False
+                    if self._closed:
+                        return False
+                else:
+                    # Drop the oldest frame to make room
+                    self.head = (self.head + 1) % self.capacity
+                    self.count -= 1
+                    self.frames_dropped += 1
+
+            tail = (self.head + self.count) % self.capacity
+            np.copyto(self.frames[tail], frame)
+            self.meta[tail] = meta
+            self.count += 1
+            self.frames_written += 1
+            self._cond.notify_all()
+            return True
+
+    def _wait_for_data(self, timeout):
+        return self._cond.wait_for(lambda: self.count > 0 or self._closed, timeout) and self.count > 0
+
+    def _pop(self, index, out):
+        frame = self.frames[index]
+        if out is None:
+            out = frame.copy()
+        else:
+            np.copyto(out, frame)
+        return out
+
+    def wait(self, timeout=None):
+        # True once a frame is available, without taking it
+        with self._cond:
+            return self._wait_for_data(timeout)
+
+    def get(self, timeout=None, out=None):
+        """
+        Oldest frame in FIFO order (the recorder path), or None on timeout.
+        The frame is copied into out if given, otherwise into a new array.
+        """
+        with self._cond:
+            if not self._wait_for_data(timeout):
+                return None
+            frame = self._pop(self.head, out)
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+            self._cond.notify_all()
+            return frame
+
+    def get_with_meta(self, timeout=None, out=None):
+        with self._cond:
+            if not self._wait_for_data(timeout):
+                return None, None
+            meta = self.meta[self.head]
+            frame = self._pop(self.head, out)
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+            self._cond.notify_all()
+            return frame, meta
+
+    def get_latest(self, timeout=None, out=None):
+        """
+        Newest frame, discarding anything older (the display path). Skipped
+        frames are added to frames_dropped.
+        """
+        with self._cond:
+            if not self._wait_for_data(timeout):
+                return None
+            newest = (self.head + self.count - 1) % self.capacity
+            frame = self._pop(newest, out)
+            self.frames_dropped += self.count - 1
+            self.head = (newest + 1) % self.capacity
+            self.count = 0
+            self._cond.notify_all()
+            return frame
+
+    def clear(self):
+        with self._cond:
+            self.head = 0
+            self.count = 0
+            self._cond.notify_all()
+
+    def close(self):
+        # Wake up anything blocked in put()/get()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FrameSlot:
+    """
+    Latest-frame-wins handoff for acquisition Frames in ownership mode.
+
+    Nothing is copied: the slot only holds a reference to the checked-out
+    frame. A frame replaced before anyone took it is released back to the
+    stream and counted in frames_dropped. take() hands the reference over to
+    the caller, who must release() it when done.
+    """
+    def __init__(self):
+        self.frame = None
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self._cond = threading.Condition()
+
+    @property
+    def depth(self):
+        return 0 if self.frame is None else 1
+
+    def put(self, frame):
+        frame.retain()
+        with self._cond:
+            previous, self.frame = self.frame, frame
+            self.frames_written += 1
+            if previous is not None:
+                self.frames_dropped += 1
+            self._cond.notify_all()
+        if previous is not None:
+            previous.release()
+
+    def wait(self, timeout=None):
+        # True once a frame is waiting, without taking it
+        with self._cond:
+            return self._cond.wait_for(lambda: self.frame is not None, timeout)
+
+    def take(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.frame is not None, timeout):
+                return None
+            frame, self.frame = self.frame, None
+            return frame
+
+    def clear(self):
+        with self._cond:
+            frame, self.frame = self.frame, None
+        if frame is not None:
+            frame.release()
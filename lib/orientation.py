@@ -0,0 +1,65 @@
+'''
+Display orientation of camera frames, planned once instead of per frame.
+
+The GUI shows frames in pyqtgraph's col-major order (image[x, y], i.e. the
+transpose of the (row, col) frame) and optionally mirrored along either
+axis. Applying np.transpose and then np.flipud/np.fliplr on every frame
+costs a few Python-level calls and a branch on the selected mode, and
+hands pyqtgraph a frame with negative strides.
+
+TransformPlan folds the transpose and both flips into one axis order and
+one indexing tuple, so oriented() is a single view of the frame whatever
+the mode. For display, the flips can be left to the image item instead:
+unflipped() is the plain transpose (positive strides, F-contiguous for a
+C-contiguous frame) and display_matrix() the affine map that mirrors it on
+screen, so the pixel at view position (x, y) is oriented()[x, y] either way.
+'''
+
+import numpy as np
+
+# Flip combo box entry -> (flip x, flip y), with x and y the display axes.
+# UD flips axis 0 of the transposed frame and LR axis 1, as np.flipud and
+# np.fliplr did; flipping both in either order is the same view.
+ORIENTATIONS = {
+    'None': (False, False),
+    'UD': (True, False),
+    'LR': (False, True),
+    'LR-UD': (True, True),
+    'UD-LR': (True, True),
+}
+
+_FORWARD = slice(None)
+_REVERSED = slice(None, None, -1)
+
+
+class TransformPlan:
+    def __init__(self, flip_x=False, flip_y=False, transpose=True):
+        self.flips = (bool(flip_x), bool(flip_y))
+        self.transpose = transpose
+        self.axes = (1, 0) if transpose else (0, 1)
+        self.index = tuple(_REVERSED if flip else _FORWARD for flip in self.flips)
+
+    @classmethod
+    def from_name(cls, name, transpose=True):
+        return cls(*ORIENTATIONS[name], transpose=transpose)
+
+    def oriented(self, frame_data):
+        """
+        The frame in display orientation, as one view (no copy).
+        """
+        return frame_data.transpose(self.axes)[self.index]
+
+    def unflipped(self, frame_data):
+        # Display axis order without the flips, for an image item that applies display_matrix()
+        return frame_data.transpose(self.axes)
+
+    def display_matrix(self, shape, scale=1):
+        """
+        (m11, m12, m21, m22, dx, dy) of the affine map from unflipped() pixel
+        coordinates to view coordinates, in QTransform argument order, for a
+        displayed image of the given shape. For a preview binned by 'scale',
+        shape is still the full-resolution one.
+        """
+        flip_x, flip_y = self.flips
+        return (-float(scale) if flip_x else float(scale), 0.0, 0.0, -float(scale) if flip_y else float(scale),
+                float(shape[0]) if flip_x else 0.0, float(shape[1]) if flip_y else 0.0)
@@ -0,0 +1,91 @@
+'''
+Sub-pixel peak localization around the argmax.
+
+An integer argmax quantizes the pointing error to whole pixels (15/2.8 urad
+steps). These fits refine it from the 3x3 neighbourhood of the brightest
+pixel only, so they cost a few array operations for all windows together:
+
+    parabolic   a parabola through the three pixels along each axis
+    gaussian    the same on the log of the pixel values, exact for a
+                Gaussian spot (values are floored at one count first)
+    quadratic   a least-squares 2D quadratic over the full 3x3 neighbourhood,
+                which also accounts for a tilted (xy-coupled) spot
+
+A peak on the window edge, or a neighbourhood that is not a maximum (flat
+or saddle-shaped), keeps its integer position. Offsets are limited to one
+pixel either way.
+'''
+
+import numpy as np
+
+FIT_METHODS = ("parabolic", "gaussian", "quadratic")
+
+_STEPS = np.arange(-1, 2)
+
+
+def neighbourhoods(windows, rows, cols):
+    """
+    (n, 3, 3) float64 neighbourhoods of (rows[i], cols[i]) in an (n, h, w)
+    stack, plus a mask of the peaks that have a full neighbourhood.
+    """
+    height, width = windows.shape[1:]
+    inside = (rows > 0) & (rows < height - 1) & (cols > 0) & (cols < width - 1)
+    rows, cols = np.clip(rows, 1, height - 2), np.clip(cols, 1, width - 2)
+    index = np.arange(len(windows))[:, None, None]
+    patch = windows[index, rows[:, None, None] + _STEPS[:, None], cols[:, None, None] + _STEPS]
+    return patch.astype(np.float64), inside
+
+def _vertex(minus, center, plus):
+    # Offset of the vertex of the parabola through (-1, minus), (0, center), (1, plus)
+    curvature = minus - 2*center + plus
+    with np.errstate(invalid="ignore", divide="ignore"):
+        offset = (minus - plus) / (2*curvature)
+    return np.where(curvature < 0, offset, 0.0)
+
+def _quadratic(patch):
+    # Least-squares f = a + gx*x + gy*y + (hxx*x^2 + 2*hxy*x*y + hyy*y^2)/2 on the
+    # 3x3 grid, x along columns and y along rows; the peak is -H^-1 g
+    gx = (patch[:, :, 2] - patch[:, :, 0]).sum(axis=1) / 6
+    gy = (patch[:, 2, :] - patch[:, 0, :]).sum(axis=1) / 6
+    hxx = (patch[:, :, 0] - 2*patch[:, :, 1] + patch[:, :, 2]).sum(axis=1) / 3
+    hyy = (patch[:, 0, :] - 2*patch[:, 1, :] + patch[:, 2, :]).sum(axis=1) / 3
+    hxy = (patch[:, 2, 2] - patch[:, 2, 0] - patch[:, 0, 2] + patch[:, 0, 0]) / 4
+    det = hxx*hyy - hxy*hxy
+    maximum = (hxx < 0) & (det > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dx = (hxy*gy - hyy*gx) / det
+        dy = (hxy*gx - hxx*gy) / det
+    return np.where(maximum, dy, 0.0), np.where(maximum, dx, 0.0)
+
+def fit_peaks(windows, rows, cols, method="parabolic"):
+    """
+    Sub-pixel (rows, cols) of the peaks at integer (rows, cols) in an
+    (n, h, w) stack of windows.
+    """
+    patch, inside = neighbourhoods(windows, rows, cols)
+    if method == "parabolic":
+        dy = _vertex(patch[:, 0, 1], patch[:, 1, 1], patch[:, 2, 1])
+        dx = _vertex(patch[:, 1, 0], patch[:, 1, 1], patch[:, 1, 2])
+    elif method == "gaussian":
+        logs = np.log(np.maximum(patch, 1.0))
+        dy = _vertex(logs[:, 0, 1], logs[:, 1, 1], logs[:, 2, 1])
+        dx = _vertex(logs[:, 1, 0], logs[:, 1, 1], logs[:, 1, 2])
+    elif method == "quadratic":
+        dy, dx = _quadratic(patch)
+    else:
+        raise ValueError(f"Unknown peak fit {method!r}")
+    dy = np.where(inside, np.clip(dy, -1, 1), 0.0)
+    dx = np.where(inside, np.clip(dx, -1, 1), 0.0)
+    return rows + dy, cols + dx
+
+def argmax_peaks(windows):
+    # Integer (rows, cols) of the first maximum of every window in an (n, h, w) stack
+    return np.divmod(windows.reshape(len(windows), -1).argmax(axis=1), windows.shape[2])
+
+def locate_peak(window, method="parabolic"):
+    """
+    Sub-pixel (row, col) of the brightest pixel of a single (h, w) window.
+    """
+    stack = window[None]
+    rows, cols = fit_peaks(stack, *argmax_peaks(stack), method)
+    return float(rows[0]), float(cols[0])
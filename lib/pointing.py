@@ -0,0 +1,139 @@
+'''
+Batched pointing error of the hexagon lobes.
+
+Each lobe is looked for in a 2*knn square window around its vertex, and its
+pointing error is the distance from the window center to the window's peak
+(or intensity-weighted centroid), in micro-radians. Instead of slicing and
+measuring the windows one by one, PointingKernel gathers every window that
+lies fully inside the frame into one (n, 2*knn, 2*knn) array with a single
+take (a sliding-window view for strided frames), and finds all peaks with
+one argmax and all centroids with a CentroidEngine (lib/centroid.py), which
+works from the row and column marginals in reused buffers. The peak-fit
+methods refine the argmax of every window to sub-pixel precision from its
+3x3 neighbourhood (lib/peak_fit.py).
+
+Frames are (row, col) and vertices (x, y), as in lib/roi.py. Windows that
+reach past the frame edge get nan. Windows are gathered x-major, window[x, y],
+the layout the GUI used to slice them from its display image, so the max
+method breaks ties between equal pixels the way the per-window loop did: the
+smallest x, then the smallest y.
+'''
+
+import threading
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from lib.centroid import CentroidEngine
+import lib.peak_fit as peak_fit
+
+# Micro-radians of pointing error per pixel of offset
+POINTING_SCALE = 15/2.8
+
+METHODS = ("max", "centroid") + peak_fit.FIT_METHODS
+
+# Per-vertex results of PointingKernel.measure(): offset of the peak or
+# centroid from the window center in pixels, and its length in micro-radians
+POINTING_DTYPE = np.dtype([("dx", np.float64), ("dy", np.float64), ("error", np.float64)])
+
+
+def rms_error(errors):
+    """
+    RMS of the valid pointing errors. As in the GUI, the first valid vertex
+    is left out; nan if fewer than two are valid.
+    """
+    valid = errors[~np.isnan(errors)]
+    return np.sqrt(np.mean(valid[1:]**2)) if len(valid) > 1 else np.nan
+
+
+class PointingKernel:
+    """
+    Pointing error of a fixed set of vertex windows. background and threshold
+    apply to the centroid method (see CentroidEngine). The window and
+    centroid buffers are reused between frames, so measure() is serialized
+    by a lock when a kernel is shared between threads.
+    """
+    def __init__(self, shape, centers, knn, scale=POINTING_SCALE, background=0.0, threshold=0.0):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.centers = np.array(centers, dtype=int).reshape(-1, 2)
+        self.knn = int(knn)
+        self.scale = scale
+        self.centroids = CentroidEngine(background, threshold)
+        self._windows = None
+        self._lock = threading.Lock()
+        height, width = self.shape
+        x, y, k = self.centers[:, 0], self.centers[:, 1], self.knn
+        self.valid = (x - k >= 0) & (x + k <= width) & (y - k >= 0) & (y + k <= height)
+        # Top-left corner of every window that fits
+        self.x0 = x[self.valid] - k
+        self.y0 = y[self.valid] - k
+        # Flat pixel index of every window pixel, for C-contiguous frames, in
+        # window[x, y] order
+        offsets = np.arange(2 * k)
+        self.flat = ((self.y0[:, None, None] + offsets) * width
+                     + self.x0[:, None, None] + offsets[:, None]).astype(np.intp)
+
+    def __len__(self):
+        return len(self.centers)
+
+    def windows(self, image_data):
+        # (n_valid, 2*knn, 2*knn) copy of the windows, indexed [x, y], gathered in
+        # one indexing step. Callers with a strided frame should make it contiguous
+        # once per frame: the fallback allocates a fresh stack every call
+        if image_data.flags.c_contiguous:
+            if self._windows is None or self._windows.dtype != image_data.dtype:
+                self._windows = np.empty(self.flat.shape, dtype=image_data.dtype)
+            return image_data.reshape(-1).take(self.flat, out=self._windows)
+        size = 2 * self.knn
+        return sliding_window_view(image_data, (size, size))[self.y0, self.x0].transpose(0, 2, 1)
+
+    def measure(self, image_data, method="max"):
+        """
+        POINTING_DTYPE array with one entry per vertex, nan where the window
+        is off the frame (or, for centroids, holds no signal).
+        """
+        # Filled as a plain (n, 3) float array and viewed as POINTING_DTYPE
+        values = np.full((len(self.centers), len(POINTING_DTYPE.names)), np.nan)
+        stats = values.view(POINTING_DTYPE).reshape(-1)
+        if not self.valid.any():
+            return stats
+
+        if method not in METHODS:
+            raise ValueError(f"Unknown pointing method {method!r}")
+        with self._lock:
+            windows = self.windows(image_data)
+            if method == "centroid":
+                xs, ys, totals = self.centroids.measure(windows)
+            else:
+                # First maximum with the smallest x, then y (the windows are [x, y])
+                xs, ys = peak_fit.argmax_peaks(windows)
+                if method != "max":
+                    xs, ys = peak_fit.fit_peaks(windows, xs, ys, method)
+
+            measured = values[self.valid]
+            measured[:, 0] = xs - self.knn
+            measured[:, 1] = ys - self.knn
+        measured[:, 2] = np.hypot(measured[:, 0], measured[:, 1]) * self.scale
+        values[self.valid] = measured
+        return stats
+
+def pointing_kernel(shape, centers, knn, scale=POINTING_SCALE, background=0.0, threshold=0.0):
+    """
+    Cached PointingKernel for frames of the given (height, width).
+    """
+    key = tuple((int(center[0]), int(center[1])) for center in centers)
+    return _pointing_kernel((int(shape[0]), int(shape[1])), key, int(knn), float(scale),
+                            float(background), float(threshold))
+
+@lru_cache(maxsize=64)
+def _pointing_kernel(shape, centers, knn, scale, background, threshold):
+    return PointingKernel(shape, centers, knn, scale, background, threshold)
+
+def pointing_error(image_data, centers, knn, method="max", scale=POINTING_SCALE, background=0.0, threshold=0.0):
+    """
+    (per-vertex POINTING_DTYPE array, RMS error) for one frame.
+    """
+    kernel = pointing_kernel(image_data.shape[:2], centers, knn, scale, background, threshold)
+    stats = kernel.measure(image_data, method)
+    return stats, rms_error(stats["error"])
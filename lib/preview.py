@@ -0,0 +1,66 @@
+'''
+Binned previews of camera frames for the live image view.
+
+Zoomed out, the image view shows several frame pixels per screen pixel, yet
+pyqtgraph still levels and converts the full frame on every display tick.
+PreviewPyramid bins the frame by 2, 4, ... (the mean of each factor x factor
+block, rounded down) and picks the largest factor that still leaves at least
+one binned pixel per screen pixel, so the preview looks the same on screen
+at a fraction of the rendering cost. When zoomed in, the full frame is used.
+
+Binning sums strided row and column slices into reused uint16 buffers. This
+gives the same result as a reshape-mean over (h/f, f, w/f, f) blocks, but
+numpy's reduction over the small block axes is about 20x slower. Frames are
+(row, col); rows and columns that don't fill a whole block are dropped.
+'''
+
+import numpy as np
+
+
+class PreviewPyramid:
+    def __init__(self, factors=(1, 2, 4)):
+        if max(factors) > 16:
+            # Block sums of 8-bit pixels have to fit the uint16 buffers
+            raise ValueError("Bin factors above 16 are not supported")
+        self.factors = sorted(set(factors) | {1})
+        self._buffers = {}
+
+    def factor_for(self, pixels_per_screen_pixel):
+        """
+        Largest bin factor that doesn't exceed the number of frame pixels per
+        screen pixel (the smaller of the two axes).
+        """
+        factor = 1
+        for candidate in self.factors:
+            if candidate <= pixels_per_screen_pixel:
+                factor = candidate
+        return factor
+
+    def _buffers_for(self, shape, factor):
+        key = (shape, factor)
+        buffers = self._buffers.get(key)
+        if buffers is None:
+            height, width = shape[0] // factor, shape[1] // factor
+            buffers = self._buffers[key] = (np.empty((height, shape[1]), dtype=np.uint16),
+                                            np.empty((height, width), dtype=np.uint16),
+                                            np.empty((height, width), dtype=np.uint8))
+        return buffers
+
+    def binned(self, frame_data, factor):
+        """
+        The frame binned by factor, as a uint8 array owned by the pyramid and
+        overwritten by the next call with the same shape and factor. Factor 1
+        returns the frame itself.
+        """
+        if factor == 1:
+            return frame_data
+        rows, sums, preview = self._buffers_for(frame_data.shape[:2], factor)
+        height, width = preview.shape
+        np.copyto(rows, frame_data[0:height*factor:factor])
+        for i in range(1, factor):
+            np.add(rows, frame_data[i:height*factor:factor], out=rows)
+        np.copyto(sums, rows[:, 0:width*factor:factor])
+        for i in range(1, factor):
+            np.add(sums, rows[:, i:width*factor:factor], out=sums)
+        np.floor_divide(sums, factor*factor, out=preview, casting='unsafe')
+        return preview
@@ -0,0 +1,224 @@
+'''
+Raw frame recorder and reader.
+
+Writing a colormapped PNG per frame puts PNG compression and file creation
+in the acquisition path. FrameRecorder instead copies raw frames into a
+preallocated, memory-mapped container and leaves colormapping and video
+encoding to an offline pass over the recording. A recording is a directory:
+
+    frames.npy     (capacity, height, width) frames, in arrival order
+    meta.npy       (capacity,) records: block_id, timestamp, host_time and
+                   optionally a fixed number of ROI sums per frame
+    session.json   frame shape, dtype, capacity and the number of frames
+                   actually recorded, plus the lobe centers (x, y) and
+                   radius in pixels the sums were measured with, when the
+                   recorder was given them
+
+Both arrays are plain .npy files, so np.load(..., mmap_mode='r') opens them
+without reading them in. Rows past the recorded count are zero.
+
+write() is a memory copy into the mapping; the OS writes pages back in the
+background. Call it from a threaded engine consumer (the queue in front of
+it absorbs disk stalls, and frames are dropped there rather than holding up
+RetrieveBuffer). Storage is allocated on the first frame, which also fixes
+the frame shape; later frames of another shape, or beyond capacity, are
+skipped and counted, with a warning the first time the recording is full.
+
+host_time is wall-clock seconds since the epoch, but advanced with
+time.monotonic() from the moment the recorder was created, so clock
+adjustments during a run can't make it go backwards.
+
+SessionReader maps a recording back for offline work: indexing, slicing and
+timestamp lookups are views into the files, so an hour-long run is never
+decoded or loaded into RAM as a whole.
+'''
+
+import os
+import json
+import time
+
+import numpy as np
+
+FRAMES_FILE = "frames.npy"
+META_FILE = "meta.npy"
+SESSION_FILE = "session.json"
+
+
+def record_dtype(n_sums=0):
+    fields = [("block_id", np.uint64), ("timestamp", np.uint64), ("host_time", np.float64)]
+    if n_sums:
+        fields.append(("sums", np.float64, (n_sums,)))
+    return np.dtype(fields)
+
+
+class FrameRecorder:
+    def __init__(self, path, capacity, n_sums=0, centers=None, radius=None):
+        self.path = path
+        self.capacity = capacity
+        self.n_sums = n_sums
+        self.count = 0
+        self.frames_skipped = 0
+        self.closed = False
+        self.frames = None
+        self.meta = None
+        self.shape = None
+        self.dtype = None
+        self.full_warned = False
+        # host_time = wall clock at creation + monotonic time since
+        self._wall_start = time.time()
+        self._monotonic_start = time.monotonic()
+        self.centers = None
+        self.radius = None
+        if centers is not None:
+            self.set_geometry(centers, radius)
+        os.makedirs(path, exist_ok=True)
+
+    def _allocate(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.frames = np.lib.format.open_memmap(os.path.join(self.path, FRAMES_FILE), mode="w+",
+                                                dtype=self.dtype, shape=(self.capacity,) + self.shape)
+        self.meta = np.lib.format.open_memmap(os.path.join(self.path, META_FILE), mode="w+",
+                                              dtype=record_dtype(self.n_sums), shape=(self.capacity,))
+        self._write_session()
+
+    def write(self, image_data, block_id=0, timestamp=0, sums=None):
+        """
+        Append one frame and its metadata. Returns False if it was skipped.
+        """
+        if self.closed:
+            self.frames_skipped += 1
+            return False
+        if self.frames is None:
+            self._allocate(image_data.shape, image_data.dtype)
+        if self.count >= self.capacity or image_data.shape != self.shape:
+            if self.count >= self.capacity and not self.full_warned:
+                print(f"\nWarning: recording {self.path} is full ({self.capacity} frames), "
+                      "further frames are not recorded")
+                self.full_warned = True
+            self.frames_skipped += 1
+            return False
+        i = self.count
+        self.frames[i] = image_data
+        record = self.meta[i]
+        record["block_id"] = block_id
+        record["timestamp"] = timestamp
+        record["host_time"] = self._wall_start + (time.monotonic() - self._monotonic_start)
+        if self.n_sums and sums is not None:
+            record["sums"] = sums
+        self.count += 1
+        return True
+
+    def set_geometry(self, centers, radius):
+        # Lobe centers (x, y) and radius in pixels behind the recorded sums, for
+        # callers that only know them once the first frame has arrived
+        self.centers = [[int(x), int(y)] for x, y in np.asarray(centers).reshape(-1, 2)]
+        self.radius = None if radius is None else float(radius)
+        if self.frames is not None:
+            self._write_session()
+
+    def set_sums(self, index, sums):
+        # ROI sums of an already written frame, for sums computed after the frame was recorded
+        if self.meta is not None and self.n_sums and 0 <= index < self.count:
+            self.meta[index]["sums"] = sums
+
+    def _write_session(self):
+        session = {"shape": list(self.shape), "dtype": self.dtype.str, "capacity": self.capacity,
+                   "n_sums": self.n_sums, "count": self.count, "frames_skipped": self.frames_skipped}
+        if self.centers is not None:
+            session["centers"] = self.centers
+            session["radius"] = self.radius
+        with open(os.path.join(self.path, SESSION_FILE), "w") as f:
+            json.dump(session, f, indent=2)
+
+    def flush(self):
+        # Push the mapped pages to disk and record how far the recording got
+        if self.frames is None:
+            return
+        self.frames.flush()
+        self.meta.flush()
+        self._write_session()
+
+    def close(self):
+        self.flush()
+        self.closed = True
+        # Drop the mappings so the files can be reopened (or removed) straight away
+        self.frames = None
+        self.meta = None
+
+
+class SessionReader:
+    """
+    Random access to a recording made by FrameRecorder, without reading it
+    into memory. Frames and metadata are read-only views into the mapped
+    files: reader[i] is one frame, reader[a:b] (or frames(a, b)) a range of
+    them, and at_time()/index_of_block() turn a timestamp or BlockID into a
+    frame index.
+    """
+    def __init__(self, path):
+        self.path = path
+        session_path = os.path.join(path, SESSION_FILE)
+        self.session = {}
+        if os.path.exists(session_path):
+            with open(session_path) as f:
+                self.session = json.load(f)
+        frames = np.load(os.path.join(path, FRAMES_FILE), mmap_mode="r")
+        meta = np.load(os.path.join(path, META_FILE), mmap_mode="r")
+        count = self.session.get("count")
+        if count is None or count == 0:
+            # Recorder didn't get to close (or flush): written rows have a host time
+            written = np.flatnonzero(meta["host_time"])
+            count = int(written[-1]) + 1 if len(written) else 0
+        self.frames_data = frames[:count]
+        self.meta = meta[:count]
+
+    def __len__(self):
+        return len(self.frames_data)
+
+    def __getitem__(self, index):
+        return self.frames_data[index]
+
+    def __iter__(self):
+        return iter(self.frames_data)
+
+    @property
+    def shape(self):
+        return self.frames_data.shape[1:]
+
+    @property
+    def centers(self):
+        # (n, 2) lobe centers (x, y) the recorder was given, or None
+        centers = self.session.get("centers")
+        return None if centers is None else np.array(centers, dtype=int).reshape(-1, 2)
+
+    @property
+    def radius(self):
+        # Lobe radius in pixels the recorder was given, or None
+        return self.session.get("radius")
+
+    def frames(self, start=0, stop=None, step=1):
+        return self.frames_data[start:stop:step]
+
+    def chunks(self, size):
+        # (start index, frames) views of consecutive blocks of frames
+        for start in range(0, len(self), size):
+            yield start, self.frames_data[start:start + size]
+
+    def at_time(self, t, clock="timestamp"):
+        """
+        Index of the last frame at or before t on the given clock
+        ("timestamp", the device tick counter, or "host_time", seconds since
+        the epoch advanced by a monotonic clock). Both increase through a
+        recording, so this is a binary search over the mapped metadata.
+        """
+        index = int(np.searchsorted(self.meta[clock], t, side="right")) - 1
+        if index < 0:
+            raise IndexError(f"{t} is before the first frame")
+        return index
+
+    def index_of_block(self, block_id):
+        # BlockIDs wrap around on long runs, so the first match is returned
+        matches = np.flatnonzero(self.meta["block_id"] == block_id)
+        if not len(matches):
+            raise KeyError(block_id)
+        return int(matches[0])
@@ -0,0 +1,224 @@
+'''
+Cached circular ROIs for the lobe intensity measurements.
+
+The scripts used to build an np.ogrid grid and a full-frame boolean mask for
+every circle on every frame, then sum through boolean indexing. The circle
+geometry never changes while streaming, so it is computed once per
+(image shape, center, radius) and kept in an LRU cache as row spans: one
+[start, stop) range of flat pixel indices per image row the circle covers.
+A set of circles (the hexagon lobes) is expanded once into flat indices, so
+summing all of them is one gather plus one np.add.reduceat per frame.
+LobeIntegrator builds on the same indices to get sum, peak, centroid and
+pixel count of every lobe from one gather.
+
+The pixel set is exactly the one the ogrid masks selected
+(dx*dx + dy*dy <= radius*radius around an integer center, clipped to the
+image), and sums are returned as uint64 like np.sum over a uint8 frame.
+Centers are (x, y), as in cv2.circle.
+'''
+
+from functools import lru_cache
+
+import numpy as np
+
+# Entries kept in each LRU cache. Spans are a few hundred bytes per circle and
+# index sets a few kB per lobe, so this covers many layouts and image sizes.
+CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _circle_spans(shape, center, radius):
+    height, width = shape
+    cx, cy = center
+    reach = int(np.floor(radius))
+    y0, y1 = max(cy - reach, 0), min(cy + reach + 1, height)
+    x0, x1 = max(cx - reach, 0), min(cx + reach + 1, width)
+    if y0 >= y1 or x0 >= x1:
+        spans = np.empty((0, 2), dtype=np.intp)
+    else:
+        # Same test as the full-frame ogrid mask, on the bounding box only
+        y, x = np.ogrid[y0 - cy:y1 - cy, x0 - cx:x1 - cx]
+        mask = x*x + y*y <= radius*radius
+        counts = mask.sum(axis=1)
+        rows = np.nonzero(counts)[0]
+        # A circle row is one contiguous run of columns
+        starts = (rows + y0) * width + x0 + mask[rows].argmax(axis=1)
+        spans = np.column_stack([starts, starts + counts[rows]]).astype(np.intp)
+    spans.setflags(write=False)
+    return spans
+
+def circle_spans(shape, center, radius):
+    """
+    Row spans of a circle as an (n, 2) array of flat [start, stop) indices
+    into an image of the given (height, width). The array is shared through
+    the cache and is read-only.
+    """
+    return _circle_spans((int(shape[0]), int(shape[1])),
+                         (int(center[0]), int(center[1])), float(radius))
+
+def cache_info():
+    return {"spans": _circle_spans.cache_info(), "sets": _circle_set.cache_info(),
+            "integrators": _lobe_integrator.cache_info()}
+
+def cache_clear():
+    _circle_spans.cache_clear()
+    _circle_set.cache_clear()
+    _lobe_integrator.cache_clear()
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _circle_set(shape, centers, radius):
+    # Flat pixel indices of every circle back to back, plus where each starts
+    spans = [_circle_spans(shape, center, radius) for center in centers]
+    counts = np.array([(stops - starts).sum() for starts, stops in (s.T for s in spans)], dtype=np.intp)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.intp)
+    all_spans = np.concatenate(spans) if spans else np.empty((0, 2), dtype=np.intp)
+    lengths = all_spans[:, 1] - all_spans[:, 0]
+    # Expand [start, stop) spans into consecutive indices without a Python loop
+    indices = (np.repeat(all_spans[:, 0] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+               + np.arange(lengths.sum())).astype(np.intp)
+    for array in (indices, offsets, counts):
+        array.setflags(write=False)
+    return indices, offsets, counts
+
+def circle_indices(shape, centers, radius):
+    """
+    (indices, offsets, counts) for a set of equal circles: the flat pixel
+    indices of all circles concatenated, the position where each circle's
+    run starts, and its pixel count. Cached like circle_spans.
+    """
+    key = tuple((int(center[0]), int(center[1])) for center in centers)
+    return _circle_set((int(shape[0]), int(shape[1])), key, float(radius))
+
+def _pixels(image_data):
+    # Flat (height*width, channels) view; only copies non-contiguous frames
+    height, width = image_data.shape[:2]
+    return np.ascontiguousarray(image_data).reshape(height * width, -1)
+
+def sum_in_circle(image_data, center, radius):
+    """
+    Sum of all pixel values (every channel) within radius of center.
+    """
+    indices, offsets, counts = circle_indices(image_data.shape, [center], radius)
+    return _pixels(image_data)[indices].sum(dtype=np.uint64)
+
+def sum_in_circles(image_data, centers, radius):
+    """
+    sum_in_circle for each center, with one gather and one reduceat for all
+    of them.
+    """
+    indices, offsets, counts = circle_indices(image_data.shape, centers, radius)
+    sums = np.zeros(len(counts), dtype=np.uint64)
+    if len(indices):
+        pixels = _pixels(image_data)[indices]
+        # reduceat needs strictly increasing offsets, so skip empty circles
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(pixels, offsets[filled], axis=0, dtype=np.uint64).sum(axis=1)
+    return sums
+
+
+# Per-lobe results of LobeIntegrator.measure()
+LOBE_DTYPE = np.dtype([("sum", np.uint64), ("max", np.float64), ("x", np.float64),
+                       ("y", np.float64), ("count", np.int64)])
+
+
+class LobeIntegrator:
+    """
+    Sum, peak, intensity-weighted centroid and pixel count of every lobe in
+    one pass over the frame.
+
+    All lobes share a sparse pixel-to-lobe map: the flat indices of every
+    lobe back to back (see circle_indices), so overlapping lobes are fine.
+    A frame is gathered once and every statistic is a single reduceat over
+    that gather. Multi-channel frames are summed over their channels first.
+
+    Build one per layout with lobe_integrator(), which caches them.
+    """
+    def __init__(self, shape, centers, radius):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.centers = np.array(centers, dtype=int).reshape(-1, 2)
+        self.radius = float(radius)
+        self.indices, self.offsets, self.counts = circle_indices(self.shape, self.centers, self.radius)
+        self.rows, self.cols = np.divmod(self.indices, self.shape[1])
+        self.filled = self.counts > 0
+        self._starts = self.offsets[self.filled]
+
+    def __len__(self):
+        return len(self.counts)
+
+    def measure(self, image_data):
+        stats = np.zeros(len(self.counts), dtype=LOBE_DTYPE)
+        stats["count"] = self.counts
+        stats["x"] = stats["y"] = np.nan
+        if not len(self.indices):
+            return stats
+
+        pixels = _pixels(image_data)[self.indices]
+        values = pixels[:, 0] if pixels.shape[1] == 1 else pixels.sum(axis=1, dtype=np.uint64)
+        weights = values.astype(np.float64)
+
+        sums = np.add.reduceat(values, self._starts, dtype=np.uint64)
+        stats["sum"][self.filled] = sums
+        stats["max"][self.filled] = np.maximum.reduceat(weights, self._starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # Lobes with no signal get a nan centroid
+            stats["x"][self.filled] = np.add.reduceat(weights * self.cols, self._starts) / sums
+            stats["y"][self.filled] = np.add.reduceat(weights * self.rows, self._starts) / sums
+        return stats
+
+def lobe_integrator(shape, centers, radius):
+    """
+    Cached LobeIntegrator for frames of the given (height, width), so the
+    per-frame cost is only measure().
+    """
+    key = tuple((int(center[0]), int(center[1])) for center in centers)
+    return _lobe_integrator((int(shape[0]), int(shape[1])), key, float(radius))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _lobe_integrator(shape, centers, radius):
+    return LobeIntegrator(shape, centers, radius)
+
+
+class EllipseRegion:
+    """
+    Integer pixel mask of the ellipse inscribed in an axis-aligned rectangle,
+    as drawn by pyqtgraph's CircleROI/EllipseROI.
+
+    pos and size are in array index units along axes (0, 1) of the frames
+    passed to sum(), which is how ROIs map onto an ImageItem. A pixel is
+    inside when its center is. The mask only covers the bounding box and is
+    rebuilt when the geometry or the frame shape changes, so a sum is one
+    dot product over the box instead of a resampled getArrayRegion.
+    """
+    def __init__(self, pos=(0, 0), size=(0, 0)):
+        self.shape = None
+        self.box = None
+        self.weights = None
+        self.set_geometry(pos, size)
+
+    def set_geometry(self, pos, size):
+        self.pos = (float(pos[0]), float(pos[1]))
+        self.size = (float(size[0]), float(size[1]))
+        self.shape = None
+
+    def _build(self, shape):
+        (x0, y0), (w, h) = self.pos, self.size
+        i0, i1 = max(int(np.floor(x0)), 0), min(int(np.ceil(x0 + w)), shape[0])
+        j0, j1 = max(int(np.floor(y0)), 0), min(int(np.ceil(y0 + h)), shape[1])
+        i1, j1 = max(i0, i1), max(j0, j1)
+        i, j = np.ogrid[i0:i1, j0:j1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inside = ((i + 0.5 - (x0 + w/2)) / (w/2))**2 + ((j + 0.5 - (y0 + h/2)) / (h/2))**2 <= 1
+        self.box = (slice(i0, i1), slice(j0, j1))
+        self.weights = inside.astype(np.float64)
+        self.shape = shape
+
+    @property
+    def count(self):
+        return 0 if self.weights is None else int(self.weights.sum())
+
+    def sum(self, image_data):
+        shape = image_data.shape[:2]
+        if shape != self.shape:
+            self._build(shape)
+        region = image_data[self.box]
+        return np.tensordot(region, self.weights, axes=([0, 1], [0, 1])).sum()
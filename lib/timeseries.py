@@ -0,0 +1,107 @@
+'''
+Typed time-series storage for the GUI measurements.
+
+TimeSeriesRing keeps the last `capacity` rows of a few float64 columns for
+plotting. Every row is written twice, at i and i + capacity, so the rows in
+time order are always one contiguous slice: append() is O(1) and view()
+never copies.
+
+HistoryStore keeps every row of a measurement history (eff_hist, roi_hist,
+p_err_hist) in fixed-size chunks. With a spill path, full chunks are
+appended to a raw float64 file instead of staying in memory, so long runs
+don't grow the process; to_array() reads everything back in order.
+'''
+
+import os
+
+import numpy as np
+
+
+class TimeSeriesRing:
+    def __init__(self, columns, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.columns = list(columns)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.capacity = capacity
+        self.data = np.full((2 * capacity, len(self.columns)), np.nan)
+        self.head = 0       # next row to write, in [0, capacity)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, *values):
+        row = self.data[self.head]
+        row[:] = values
+        self.data[self.head + self.capacity] = row
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def view(self):
+        # (count, n_columns) rows in time order, a view into the ring
+        start = self.head + self.capacity - self.count
+        return self.data[start:start + self.count]
+
+    def column(self, name):
+        return self.view()[:, self.index[name]]
+
+    def last(self):
+        return None if self.count == 0 else self.data[self.head + self.capacity - 1]
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+
+class HistoryStore:
+    def __init__(self, columns, chunk_rows=4096, spill_path=None):
+        self.columns = list(columns)
+        self.chunk_rows = chunk_rows
+        self.spill_path = spill_path
+        self.spilled_rows = 0
+        self.chunks = []
+        self.chunk = np.empty((chunk_rows, len(self.columns)))
+        self.fill = 0
+        if spill_path is not None:
+            # Start every store with an empty file
+            os.makedirs(os.path.dirname(os.path.abspath(spill_path)), exist_ok=True)
+            open(spill_path, "wb").close()
+
+    def __len__(self):
+        return self.spilled_rows + len(self.chunks) * self.chunk_rows + self.fill
+
+    def append(self, *values):
+        self.chunk[self.fill] = values
+        self.fill += 1
+        if self.fill == self.chunk_rows:
+            self._retire_chunk()
+
+    def _retire_chunk(self):
+        if self.spill_path is None:
+            self.chunks.append(self.chunk)
+            self.chunk = np.empty_like(self.chunk)
+        else:
+            with open(self.spill_path, "ab") as f:
+                self.chunk.tofile(f)
+            self.spilled_rows += self.chunk_rows
+        self.fill = 0
+
+    def to_array(self):
+        """
+        Every row so far as one (rows, n_columns) array, oldest first.
+        """
+        parts = []
+        if self.spilled_rows:
+            parts.append(np.fromfile(self.spill_path, dtype=np.float64,
+                                     count=self.spilled_rows * len(self.columns)).reshape(-1, len(self.columns)))
+        parts.extend(self.chunks)
+        parts.append(self.chunk[:self.fill])
+        return np.concatenate(parts)
+
+    def clear(self):
+        self.chunks = []
+        self.fill = 0
+        self.spilled_rows = 0
+        if self.spill_path is not None:
+            open(self.spill_path, "wb").close()
@@ -0,0 +1,133 @@
+'''
+Video export off the acquisition path.
+
+Colormapping, drawing the overlay and encoding every frame on one consumer
+thread caps the export at whatever that thread manages, and a VideoWriter
+opened up front has to guess the frame size and rate. VideoExporter splits
+the work instead:
+
+    submit(frame)   called from an engine consumer; only queues the frame on
+                    a thread pool and never waits. Frames arriving while
+                    max_pending frames are still in flight are dropped and
+                    counted, so a slow disk or encoder never backs up into
+                    acquisition.
+    render          the pool threads colormap and draw (cv2 releases the GIL
+                    while it works, so they run in parallel).
+    writer thread   takes the rendered frames in the order they were
+                    submitted, which is BlockID order because the engine
+                    hands frames over as it retrieves them, whichever pool
+                    thread finishes first, and is the only thread that
+                    touches the VideoWriter.
+
+The writer is opened on the first rendered frame, with that frame's size.
+Unless fps is given, it is the rate frames were submitted at over the first
+rate_frames frames (the acquisition rate, less anything dropped upstream),
+so the video plays back in real time.
+
+    exporter = VideoExporter('output.mp4', render=colormap_with_circle)
+    engine.add_consumer(exporter.submit)
+    ...
+    exporter.close()
+'''
+
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# Frames whose arrival times give the frame rate when none is specified
+RATE_FRAMES = 30
+
+
+class VideoExporter:
+    def __init__(self, path, render, fps=None, workers=2, max_pending=64, fourcc='mp4v', rate_frames=RATE_FRAMES):
+        self.path = path
+        self.render = render
+        self.fps = fps
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.max_pending = max_pending
+        self.rate_frames = rate_frames
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.frames_written = 0
+        self.frame_size = None
+        self.writer = None
+        self._arrivals = []
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="video-render")
+        self._ordered = queue.Queue()
+        self.closed = False
+        self._writer_thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer_thread.start()
+
+    def submit(self, frame):
+        """
+        Queue a frame for rendering and encoding. Returns False if it was
+        dropped because max_pending frames are still in flight.
+        """
+        if self.closed or not self._pending.acquire(blocking=False):
+            self.frames_dropped += 1
+            return False
+        if len(self._arrivals) < self.rate_frames:
+            self._arrivals.append(time.perf_counter())
+        # The render keeps its own reference (a no-op outside ownership mode)
+        frame.retain()
+        future = self._pool.submit(self._render, frame)
+        self._ordered.put((frame.block_id, future))
+        self.frames_submitted += 1
+        return True
+
+    def _render(self, frame):
+        try:
+            return self.render(frame)
+        finally:
+            frame.release()
+
+    def _frame_rate(self):
+        if self.fps:
+            return float(self.fps)
+        arrivals = self._arrivals
+        if len(arrivals) > 1 and arrivals[-1] > arrivals[0]:
+            return (len(arrivals) - 1) / (arrivals[-1] - arrivals[0])
+        return 30.0
+
+    def _open(self, image):
+        # Wait until the submit rate has been measured, or submitting stopped
+        # (no more than max_pending frames can arrive while nothing is written)
+        while len(self._arrivals) < min(self.rate_frames, self.max_pending) and not self.closed:
+            time.sleep(0.01)
+        height, width = image.shape[:2]
+        self.frame_size = (width, height)
+        self.fps = self._frame_rate()
+        self.writer = cv2.VideoWriter(self.path, self.fourcc, self.fps, self.frame_size, image.ndim == 3)
+
+    def _write_loop(self):
+        while True:
+            item = self._ordered.get()
+            if item is None:
+                break
+            block_id, future = item
+            try:
+                image = future.result()
+                if image is not None:
+                    if self.writer is None:
+                        self._open(image)
+                    if image.shape[1::-1] == self.frame_size:
+                        self.writer.write(image)
+                        self.frames_written += 1
+            except Exception as e:
+                print(f"\nException exporting frame {block_id}: {e}")
+            self._pending.release()
+
+    def close(self):
+        # Encode everything already submitted, then finish the file
+        if self.closed:
+            return
+        self.closed = True
+        self._pool.shutdown(wait=True)
+        self._ordered.put(None)
+        self._writer_thread.join()
+        if self.writer is not None:
+            self.writer.release()
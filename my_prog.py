@@ -2,12 +2,18 @@ import os
 import numpy as np
 import eBUS as eb
 import lib.PvSampleUtils as psu
+import lib.acquisition as acq
+import lib.roi as roi
+from lib.recorder import FrameRecorder, SessionReader
 import cv2
 import datetime
 import pandas as pd
 
 BUFFER_COUNT = 50
 IMAGE_DIR = 'images'
+# Frames preallocated in the raw recording (640x512 Mono8 is 320 kB per frame)
+RECORD_CAPACITY = 10000
+RADIUS_MM = 0.3  # Radius of the lobe circles in mm
 
 kb = psu.PvKb()
 opencv_is_available=True
@@ -23,55 +29,6 @@ except:
 if not os.path.exists(IMAGE_DIR):
     os.makedirs(IMAGE_DIR)
 
-def connect_to_device(connection_ID):
-    # Connect to the GigE Vision or USB3 Vision device
-    print("Connecting to device.")
-    result, device = eb.PvDevice.CreateAndConnect(connection_ID)
-    if device == None:
-        print(f"Unable to connect to device: {result.GetCodeString()} ({result.GetDescription()})")
-    return device
-
-def open_stream(connection_ID):
-    # Open stream to the GigE Vision or USB3 Vision device
-    print("Opening stream from device.")
-    result, stream = eb.PvStream.CreateAndOpen(connection_ID)
-    if stream == None:
-        print(f"Unable to stream from device. {result.GetCodeString()} ({result.GetDescription()})")
-    return stream
-
-def configure_stream(device, stream):
-    # If this is a GigE Vision device, configure GigE Vision specific streaming parameters
-    if isinstance(device, eb.PvDeviceGEV):
-        # Negotiate packet size
-        device.NegotiatePacketSize()
-        # Configure device streaming destination
-        device.SetStreamDestination(stream.GetLocalIPAddress(), stream.GetLocalPort())
-
-def configure_stream_buffers(device, stream):
-    buffer_list = []
-    # Reading payload size from device
-    size = device.GetPayloadSize()
-
-    # Use BUFFER_COUNT or the maximum number of buffers, whichever is smaller
-    buffer_count = stream.GetQueuedBufferMaximum()
-    if buffer_count > BUFFER_COUNT:
-        buffer_count = BUFFER_COUNT
-
-    # Allocate buffers
-    for i in range(buffer_count):
-        # Create new pvbuffer object
-        pvbuffer = eb.PvBuffer()
-        # Have the new pvbuffer object allocate payload memory
-        pvbuffer.Alloc(size)
-        # Add to external list - used to eventually release the buffers
-        buffer_list.append(pvbuffer)
-    
-    # Queue all buffers in the stream
-    for pvbuffer in buffer_list:
-        stream.QueueBuffer(pvbuffer)
-    print(f"Created {buffer_count} buffers")
-    return buffer_list
-
 # def process_pv_buffer(pvbuffer, image_count):
 #     """
 #     Use this method to process the buffer with your own algorithm.
@@ -102,12 +59,8 @@ def sum_of_intensity_within_circle(image_data, radius_mm, pixel_size):
     # Get the center of the image
     center = (image_data.shape[1] // 2, image_data.shape[0] // 2)
 
-    # Create a mask for the circle
-    y, x = np.ogrid[-center[1]:image_data.shape[0]-center[1], -center[0]:image_data.shape[1]-center[0]]
-    mask = x*x + y*y <= radius_pixels*radius_pixels
-
-    # Calculate the sum of pixel intensities within the circle
-    sum_intensity = np.sum(image_data[mask])
+    # Calculate the sum of pixel intensities within the circle (cached mask)
+    sum_intensity = roi.sum_in_circle(image_data, center, radius_pixels)
 
     return sum_intensity
 
@@ -116,17 +69,15 @@ def process_multiple_circles(image_data, centers, radius_mm):
     # Calculate the radius in pixels
     radius_pixels = int(radius_mm / pixel_size)
     centers = centers.astype(int)
-    sum_intensities = []
-    idx = 0
-    for center in centers:
-        # Create a mask for the circle
-        y, x = np.ogrid[-center[1]:image_data.shape[0]-center[1], -center[0]:image_data.shape[1]-center[0]]
-        mask = x*x + y*y <= radius_pixels*radius_pixels
-
-        # Calculate the sum of pixel intensities within the circle
-        sum_intensity = np.sum(image_data[mask])
-        sum_intensities.append(sum_intensity)
+    # Integrate every lobe in one pass
+    lobes = roi.lobe_integrator(image_data.shape, centers, radius_pixels).measure(image_data)
+    sum_intensities = list(lobes['sum'])
+    return sum_intensities
 
+def draw_circles(image_data, centers, radius_mm):
+    pixel_size = 15e-3  # Pixel size in mm
+    radius_pixels = int(radius_mm / pixel_size)
+    for center in centers.astype(int):
         # Draw the circle on the image
         cv2.circle(image_data, center, radius_pixels, (0, 0, 255), 2, lineType=cv2.LINE_AA)
         # add index of center near circle
@@ -138,7 +89,7 @@ def process_multiple_circles(image_data, centers, radius_mm):
         # cv2.putText(image_data, text, (center[0] - radius_pixels, center[1] - radius_pixels), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
 
     # cv2.imwrite(os.path.join(IMAGE_DIR, 'image_with_circles.png'), image_data)
-    return sum_intensities
+    return image_data
 
 def generate_hexagon_vertices(center, radius):
     # Define the angles for the vertices of the hexagon
@@ -156,159 +107,105 @@ def generate_hexagon_vertices(center, radius):
 
     return vertices
 
-def process_pv_buffer(pvbuffer, image_count):
+def process_pv_buffer(frame, recorder):
     """
     Use this method to process the buffer with your own algorithm.
     """
     print_string_value = "Image Processing"
-    pixel_size = 15e-3  # Pixel size in mm
-
-    image = pvbuffer.GetImage()
-    pixel_type = image.GetPixelType()
 
-    # Verify we can handle this format, otherwise continue.
-    if (pixel_type != eb.PvPixelMono8) and (pixel_type != eb.PvPixelRGB8):
-        return pvbuffer
+    # Only raw Mono8 frames are measured and recorded; colormapping happens offline
+    if frame.pixel_type != eb.PvPixelMono8:
+        return None
 
     # Retrieve Numpy array
-    image_data = image.GetDataPointer()
+    image_data = frame.data
     image_size = image_data.shape
 
-    # Apply 'jet' colormap
-    # image_data = cv2.applyColorMap(image_data, cv2.COLORMAP_JET)
-    # Apply 'hot' colormap
-    image_data = cv2.applyColorMap(image_data, cv2.COLORMAP_HOT)
-
-    # Calculate the sum of intensity within a circle
-    radius_mm = 0.3  # Set the radius in mm
+    # Calculate the sum of intensity within each circle
     centers = generate_hexagon_vertices((image_size[1]//2, image_size[0]//2), 50)
-    sum_intensity = process_multiple_circles(image_data, centers, radius_mm)
+    sum_intensity = process_multiple_circles(image_data, centers, RADIUS_MM)
+    if recorder.centers is None:
+        # Stored with the recording so it can be re-analysed with the same lobes
+        recorder.set_geometry(centers.astype(int), int(RADIUS_MM / 15e-3))
     # sum_of_intensity_within_circle(image_data, radius_mm, pixel_size)
-    # process_multiple_circles(image_data, centers, radius_mm)
-    print(f'Sum of intensity within a circle of radius {radius_mm} mm: {sum_intensity}')
-
-    # Draw the circle on the image
-    # center = (370,256)#(image_data.shape[1] // 2, image_data.shape[0] // 2)
-    # radius_pixels = int(radius_mm / pixel_size)
-    # cv2.circle(image_data, center, radius_pixels, (0, 0, 255), 2, lineType=cv2.LINE_AA)
+    print(f'Sum of intensity within a circle of radius {RADIUS_MM} mm: {sum_intensity}')
 
-    # Write the sum of intensity on the image
-    # text = f'Sum of intensity: {sum_intensity}'
-    # cv2.putText(image_data, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-
-    # Save the image
-    cv2.imwrite(os.path.join(IMAGE_DIR, f'image_{image_count}.png'), image_data)    
+    # Raw frame and its metadata go into the memory-mapped recording
+    recorder.write(image_data, frame.block_id, frame.timestamp, sum_intensity)
     return sum_intensity
 
-# function to read the images from the IMG_DIR and convert to video
-def images_to_video():
-    # get the list of images
-    images = [img for img in os.listdir(IMAGE_DIR) if img.endswith(".png")]
-    # sort the images
-    images.sort()
-    # get the first image
-    frame = cv2.imread(os.path.join(IMAGE_DIR, images[0]))
-    # get the height, width and number of channels of the image
-    height, width, channels = frame.shape
+# Offline: colormap the recorded frames, draw the circles and encode the video
+def recording_to_video(record_dir, fps=10):
+    session = SessionReader(record_dir)
+    height, width = session.shape[:2]
+    centers = generate_hexagon_vertices((width//2, height//2), 50)
     # define the video codec
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     # create the video writer object
-    video = cv2.VideoWriter('video.mp4', fourcc, 10, (width, height))
-    # loop through the images
-    for image in images:
-        # read the image
-        frame = cv2.imread(os.path.join(IMAGE_DIR, image))
-        # write the image to video
-        video.write(frame)
+    video = cv2.VideoWriter('video.mp4', fourcc, fps, (width, height))
+    for image_data in session:
+        # Apply 'hot' colormap
+        image_data = cv2.applyColorMap(image_data, cv2.COLORMAP_HOT)
+        video.write(draw_circles(image_data, centers, RADIUS_MM))
     # release the video writer object
     video.release()
 
 def acquire_images(device, stream):
-    # Get device parameters need to control streaming
-    device_params = device.GetParameters()
-
-    # Map the GenICam AcquisitionStart and AcquisitionStop commands
-    start = device_params.Get("AcquisitionStart")
-    stop = device_params.Get("AcquisitionStop")
-
-    # Get stream parameters
-    stream_params = stream.GetParameters()
-
-    # Map a few GenICam stream stats counters
-    frame_rate = stream_params.Get("AcquisitionRate")
-    bandwidth = stream_params[ "Bandwidth" ]
-
-    # Enable streaming and send the AcquisitionStart command
-    print("Enabling streaming and sending AcquisitionStart command.")
-    device.StreamEnable()
-    start.Execute()
-    sl_array = []
-    image_count = 0
-    while not kb.is_stopping():
-        # Retrieve next pvbuffer
-        result, pvbuffer, operational_result = stream.RetrieveBuffer(1000)
-        if result.IsOK():
-            if operational_result.IsOK():
-                # We now have a valid pvbuffer. 
-                # This is where you would typically process the pvbuffer.
-                sl = process_pv_buffer(pvbuffer, image_count)
-                sl_array.append(sl)
-                image_count += 1
-
-    images_to_video() # convert images to video
-    sl_array = np.array(sl_array)
-
-    # Assuming sl_array is your array of data
-    df = pd.DataFrame(sl_array, columns=['side-lobe 1', 'side-lobe 2', 'side-lobe 3', 'side-lobe 4', 'side-lobe 5', 'side-lobe 6', 'main lobe'])
-
     # Get current datetime
     now = datetime.datetime.now()
 
     # Format datetime as a string
     datetime_stamp = now.strftime("%Y%m%d_%H%M%S")
 
+    record_dir = os.path.join(IMAGE_DIR, f'recording_{datetime_stamp}')
+    recorder = FrameRecorder(record_dir, RECORD_CAPACITY, n_sums=7)
+
+    def on_frame(frame):
+        # Runs on the engine's consumer thread with a private copy of the frame, so
+        # neither the measurement nor disk latency ever holds up RetrieveBuffer
+        process_pv_buffer(frame, recorder)
+
+    engine = acq.AcquisitionEngine(device, stream)
+    engine.add_consumer(on_frame, queue_size=BUFFER_COUNT)
+
+    # Acquire images until the user instructs us to stop.
+    print("\n<press a key to stop streaming>")
+    kb.start()
+    engine.run(should_stop=acq.stop_on_key(kb))
+    kb.stop()
+    recorder.close()
+    print(f'Recorded {recorder.count} frames to {record_dir} ({recorder.frames_skipped} skipped)')
+
+    if recorder.count:
+        recording_to_video(record_dir) # convert the recording to video
+        sl_array = SessionReader(record_dir).meta['sums']
+    else:
+        sl_array = np.empty((0, 7))
+
+    # Assuming sl_array is your array of data
+    df = pd.DataFrame(sl_array, columns=['side-lobe 1', 'side-lobe 2', 'side-lobe 3', 'side-lobe 4', 'side-lobe 5', 'side-lobe 6', 'main lobe'])
+
     # Add datetime stamp to filename
     filename = f'sum_intensities_{datetime_stamp}.csv'
 
     # Save DataFrame to CSV
     df.to_csv(os.path.join(IMAGE_DIR, filename), index=False)
 
-    # Tell the device to stop sending images.
-    print("\nSending AcquisitionStop command to the device")
-    stop.Execute()
-
-    # Disable streaming on the device
-    print("Disable streaming on the controller.")
-    device.StreamDisable()
-
-    # Abort all buffers from the stream and dequeue
-    print("Aborting buffers still in stream")
-    stream.AbortQueuedBuffers()
-    while stream.GetQueuedBufferCount() > 0:
-        result, pvbuffer, lOperationalResult = stream.RetrieveBuffer()
-
 print("PvStreamSample:")
 
 connection_ID = psu.PvSelectDevice()
 if connection_ID:
-    device = connect_to_device(connection_ID)
+    device = acq.connect_to_device(connection_ID)
     if device:
-        stream = open_stream(connection_ID)
+        stream = acq.open_stream(connection_ID)
         if stream:
-            configure_stream(device, stream)
-            buffer_list = configure_stream_buffers(device, stream)
+            acq.configure_stream(device, stream)
+            buffer_list = acq.configure_stream_buffers(device, stream, BUFFER_COUNT)
             acquire_images(device, stream)
             buffer_list.clear()
-            
-            # Close the stream
-            print("Closing stream")
-            stream.Close()
-            eb.PvStream.Free(stream);    
-
-        # Disconnect the device
-        print("Disconnecting device")
-        device.Disconnect()
-        eb.PvDevice.Free(device)
+            acq.close_stream(stream)
+
+        acq.disconnect_device(device)
 
 print("<press a key to exit>")
 kb.start()
@@ -3,6 +3,7 @@ Implelemnted pointing error tracking w.r.t marker position.
 dated 2023-01-23
 '''
 
+import os
 import sys
 import pyqtgraph as pg
 from PyQt5.QtCore import QThread, pyqtSignal,QDateTime
@@ -10,15 +11,26 @@ from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QMainWindow,\
     QHBoxLayout, QPushButton, QLabel, QLineEdit, QCheckBox, QTabWidget, QGroupBox, QGridLayout,QComboBox, QSlider
 import numpy as np
 from scipy.stats import multivariate_normal
-from PyQt5.QtGui import QColor, QFont
+from PyQt5.QtGui import QColor, QFont, QTransform
 from PyQt5.QtCore import Qt
-import queue
 import time
 from pyqtgraph import ROI, mkPen
 from PyQt5.QtGui import QIcon, QPixmap
 import subprocess
 import eBUS as eb
 import lib.PvSampleUtils as psu
+import lib.acquisition as acq
+import lib.roi as roi
+import lib.pointing as pointing
+import lib.peak_fit as peak_fit
+from lib.frame_ring import FrameRing, FrameSlot
+from lib.timeseries import TimeSeriesRing, HistoryStore
+from lib.centroid import CentroidEngine
+from lib.orientation import TransformPlan
+from lib.preview import PreviewPyramid
+from lib.export import ExportJob
+import queue
+import threading
 import crcmod
 from PyQt5.QtCore import QMutex, QMutexLocker
 import matplotlib.pyplot as plt
@@ -29,6 +41,25 @@ import matplotlib.pyplot as plt
 # warnings.filterwarnings("ignore")
 
 BUFFER_COUNT = 64
+DISPLAY_RING_SIZE = 4
+# Hand PvBuffers straight to the GUI instead of copying them into the display ring
+DISPLAY_OWNERSHIP = True
+# GUI refresh rate, independent of the camera frame rate
+DISPLAY_FPS = 60
+# Bin factors the live view may use when zoomed out
+PREVIEW_FACTORS = (1, 2, 4)
+# Frames waiting for the analytics worker. In ownership mode each one holds a
+# PvBuffer; the queue is shrunk to fit the analytics' share of the checkout limit
+ANALYTICS_QUEUE_SIZE = BUFFER_COUNT//2
+# PvBuffers the display can hold in ownership mode: one waiting in the slot,
+# the one on screen and, while show_frame swaps them, the one replacing it
+DISPLAY_CHECKOUT = 3
+# Points shown in the ROI sum / efficiency plots
+PLOT_HISTORY = 2500
+# Directory the full measurement histories spill to during long runs (None keeps them in memory)
+HISTORY_SPILL_DIR = None
+# Where the Save buttons write
+DATA_DIR = 'C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'
 SPEED = "Baud115200"
 STOPBITS = "One"
 PARITY = "None"
@@ -46,171 +77,46 @@ except:
     print("Warning: This sample requires python3-opencv to display a window")
 
 class ImageAcquisitionThread(QThread):
-    def __init__(self, display_queue, mutex):
+    def __init__(self, display_ring, analytics=None):
         super(ImageAcquisitionThread, self).__init__()
-        self.display_queue = display_queue
+        self.display_ring = display_ring
+        self.analytics = analytics
         self.isRunning = True
-        self.mutex = QMutex()
-    
-    def connect_to_device(self,connection_ID):
-        # Connect to the GigE Vision or USB3 Vision device
-        print("Connecting to device.")
-        result, device = eb.PvDevice.CreateAndConnect(connection_ID)
-        if device == None:
-            print(f"Unable to connect to device: {result.GetCodeString()} ({result.GetDescription()})")
-        return device
-
-    def open_stream(self,connection_ID):
-        # Open stream to the GigE Vision or USB3 Vision device
-        print("Opening stream from device.")
-        result, stream = eb.PvStream.CreateAndOpen(connection_ID)
-        if stream == None:
-            print(f"Unable to stream from device. {result.GetCodeString()} ({result.GetDescription()})")
-        return stream
-
-    def configure_stream(self,device, stream):
-        # If this is a GigE Vision device, configure GigE Vision specific streaming parameters
-        if isinstance(device, eb.PvDeviceGEV):
-            # Negotiate packet size
-            device.NegotiatePacketSize()
-            # Configure device streaming destination
-            device.SetStreamDestination(stream.GetLocalIPAddress(), stream.GetLocalPort())
-
-    def configure_stream_buffers(self,device, stream):
-        buffer_list = []
-        # Reading payload size from device
-        size = device.GetPayloadSize()
-
-        # Use BUFFER_COUNT or the maximum number of buffers, whichever is smaller
-        buffer_count = stream.GetQueuedBufferMaximum()
-        if buffer_count > BUFFER_COUNT:
-            buffer_count = BUFFER_COUNT
-
-        # Allocate buffers
-        for i in range(buffer_count):
-            # Create new pvbuffer object
-            pvbuffer = eb.PvBuffer()
-            # Have the new pvbuffer object allocate payload memory
-            pvbuffer.Alloc(size)
-            # Add to external list - used to eventually release the buffers
-            buffer_list.append(pvbuffer)
-        
-        # Queue all buffers in the stream
-        for pvbuffer in buffer_list:
-            stream.QueueBuffer(pvbuffer)
-        print(f"Created {buffer_count} buffers")
-        return buffer_list
     
-    def init_params(self,device,stream):
+    def init_params(self,device,stream,buffer_count=BUFFER_COUNT):
         self.device = device
         self.stream = stream
+        # configure_stream_buffers may have allocated fewer than BUFFER_COUNT
+        self.buffer_count = buffer_count
     
     def run(self):
-        # Get device parameters need to control streaming
-        device_params = self.device.GetParameters()
-
-        # Map the GenICam AcquisitionStart and AcquisitionStop commands
-        start = device_params.Get("AcquisitionStart")
-        stop = device_params.Get("AcquisitionStop")
-
-        # Get stream parameters
-        stream_params = self.stream.GetParameters()
-
-        # Map a few GenICam stream stats counters
-        frame_rate = stream_params.Get("AcquisitionRate")
-        bandwidth = stream_params[ "Bandwidth" ]
-
-        # Enable streaming and send the AcquisitionStart command
-        print("Enabling streaming and sending AcquisitionStart command.")
-        self.device.StreamEnable()
-        start.Execute()
-
-        doodle = "|\\-|-/"
-        doodle_index = 0
-        display_image = False
-        warning_issued = False
-
-        while not self.isInterruptionRequested():
-            # Retrieve next pvbuffer
-            result, pvbuffer, operational_result = self.stream.RetrieveBuffer(1000)
-            if result.IsOK():
-                if operational_result.IsOK():
-                    #
-                    # We now have a valid pvbuffer. This is where you would typically process the pvbuffer.
-                    # -----------------------------------------------------------------------------------------
-                    # ...
-
-                    result, frame_rate_val = frame_rate.GetValue()
-                    result, bandwidth_val = bandwidth.GetValue()
-
-                    print(f"{doodle[doodle_index]} BlockID: {pvbuffer.GetBlockID()}", end='')
-                    print(f" {frame_rate_val:.1f} FPS  {bandwidth_val / 1000000.0:.1f} Mb/s     ", end='\r')
-
-                    payload_type = pvbuffer.GetPayloadType()
-                    if payload_type == eb.PvPayloadTypeImage:
-                        image = pvbuffer.GetImage()
-                        image_data = image.GetDataPointer()
-                        print(f" W: {image.GetWidth()} H: {image.GetHeight()} ", end='')
-                        
-                        if opencv_is_available:
-                            if image.GetPixelType() == eb.PvPixelMono8:
-                                display_image = True
-                            if image.GetPixelType() == eb.PvPixelRGB8:
-                                image_data = cv2.cvtColor(image_data, cv2.COLOR_RGB2BGR)
-                                display_image = True
-
-                            if display_image:
-                                with QMutexLocker(self.mutex):
-                                    self.display_queue.put(np.transpose(image_data))
-                            else:
-                                if not warning_issued:
-                                    # display a message that video only display for Mono8 / RGB8 images
-                                    print(f" ")
-                                    print(f" Currently only Mono8 / RGB8 images are displayed", end='\r')
-                                    print(f"")
-                                    warning_issued = True
-
-                            if cv2.waitKey(1) & 0xFF != 0xFF:
-                                break
-
-                    elif payload_type == eb.PvPayloadTypeChunkData:
-                        print(f" Chunk Data payload type with {pvbuffer.GetChunkCount()} chunks", end='')
-
-                    elif payload_type == eb.PvPayloadTypeRawData:
-                        print(f" Raw Data with {pvbuffer.GetRawData().GetPayloadLength()} bytes", end='')
-
-                    elif payload_type == eb.PvPayloadTypeMultiPart:
-                        print(f" Multi Part with {pvbuffer.GetMultiPartContainer().GetPartCount()} parts", end='')
-
-                    else:
-                        print(" Payload type not supported by this sample", end='')
-
-                    print(f" {frame_rate_val:.1f} FPS  {bandwidth_val / 1000000.0:.1f} Mb/s     ", end='\r')
-                else:
-                    # Non OK operational result
-                    print(f"{doodle[ doodle_index ]} {operational_result.GetCodeString()}       ", end='\r')
-                # Re-queue the pvbuffer in the stream object
-                self.stream.QueueBuffer(pvbuffer)
-
-            else:
-                # Retrieve pvbuffer failure
-                print(f"{doodle[ doodle_index ]} {result.GetCodeString()}      ", end='\r')
-
-            doodle_index = (doodle_index + 1) % 6
-
-        # Tell the device to stop sending images.
-        print("\nSending AcquisitionStop command to the device")
-        stop.Execute()
-
-        # Disable streaming on the device
-        print("Disable streaming on the controller.")
-        self.device.StreamDisable()
-
-        # Abort all buffers from the stream and dequeue
-        print("Aborting buffers still in stream")
-        self.stream.AbortQueuedBuffers()
-        while self.stream.GetQueuedBufferCount() > 0:
-            result, pvbuffer, lOperationalResult = self.stream.RetrieveBuffer()
+        # At most half of the buffers are checked out, the rest stay queued in the stream.
+        # The display never holds more than DISPLAY_CHECKOUT of them, and the analytics
+        # worker (its queue plus the frame in hand) gets the rest of that half, so a slow
+        # GUI thread can't use up the buffers the measurements need
+        analytics_queue = max(1, min(ANALYTICS_QUEUE_SIZE, self.buffer_count//2 - DISPLAY_CHECKOUT - 2))
+        self.engine = acq.AcquisitionEngine(self.device, self.stream, ownership=DISPLAY_OWNERSHIP,
+                                            max_checked_out=min(DISPLAY_CHECKOUT + analytics_queue + 2,
+                                                                max(1, self.buffer_count - 1)))
+
+        def queue_frame(frame):
+            if frame.pixel_type != eb.PvPixelMono8 and frame.pixel_type != eb.PvPixelRGB8:
+                return
+            if DISPLAY_OWNERSHIP:
+                # Zero-copy: the slot keeps the PvBuffer checked out until the GUI releases it
+                self.display_ring.put(frame)
+                return
+            image_data = frame.data
+            if frame.pixel_type == eb.PvPixelRGB8 and opencv_is_available:
+                image_data = cv2.cvtColor(image_data, cv2.COLOR_RGB2BGR)
+            # The ring copies into a preallocated slot and drops the oldest frame when full
+            self.display_ring.put(image_data, frame.block_id)
+
+        self.engine.add_consumer(queue_frame, inline=True)
+        if self.analytics is not None:
+            # Every frame is measured on the engine's worker thread, whatever the GUI is doing
+            self.engine.add_consumer(self.analytics.process, queue_size=analytics_queue)
+        self.engine.run(should_stop=self.isInterruptionRequested)
     
     def pause(self):
         self.is_paused = True
@@ -226,26 +132,61 @@ class ImageAcquisitionThread(QThread):
         print('Stopping image acquisition thread')
         self.terminate()
 
+class ExportThread(QThread):
+    """
+    Writes ExportJobs one after another, off the GUI thread. Progress is
+    reported as (done, total, label) and completion as the list of files
+    written, or an error message.
+    """
+    progress_signal = pyqtSignal(int, int, str)
+    done_signal = pyqtSignal(object)
+    error_signal = pyqtSignal(str)
+    def __init__(self):
+        super(ExportThread, self).__init__()
+        self.jobs = queue.Queue()
+
+    def submit(self, job):
+        self.jobs.put(job)
+        if not self.isRunning():
+            self.start()
+
+    def stop(self):
+        # Pending jobs are written before the thread exits
+        if self.isRunning():
+            self.jobs.put(None)
+            self.wait()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            try:
+                paths = job.run(progress=lambda done, total, label: self.progress_signal.emit(done, total, label))
+                self.done_signal.emit(paths)
+            except Exception as e:
+                self.error_signal.emit(f'{job.base_path}: {e}')
+
 class ImageDisplayThread(QThread):
-    update_signal = pyqtSignal(np.ndarray)
-    def __init__(self,display_queue, mutex):
+    # Only a wake-up: the GUI takes the newest frame from the ring itself, so
+    # signals queued while the GUI thread is busy don't hold frames (or PvBuffers)
+    update_signal = pyqtSignal()
+    def __init__(self,display_ring):
         super(ImageDisplayThread, self).__init__()
-        self.display_queue = display_queue
+        self.display_ring = display_ring
         self.isRunning = True
-        self.mutex = QMutex()
+        # Set while a wake-up is on its way to the GUI thread, cleared by show_frame
+        self.pending = threading.Event()
     def run(self):
-        while not self.isInterruptionRequested():            
-            try:
-                with QMutexLocker(self.mutex):
-                    image_data = self.display_queue.get(block=True, timeout=0.01)
-                self.update_signal.emit(image_data)
-                self.msleep(int(1000/30))
-            except (queue.Empty, queue.Full):
-                if queue.Empty:
-                    print('Queue is empty')
-                elif queue.Full:
-                    print('Queue is full')
-                pass
+        while not self.isInterruptionRequested():
+            if self.pending.is_set():
+                self.msleep(1)
+                continue
+            if not self.display_ring.wait(timeout=0.01):
+                continue
+            self.pending.set()
+            self.update_signal.emit()
+            self.msleep(int(1000/DISPLAY_FPS))
 
     def pause(self):
         self.is_paused = True
@@ -262,6 +203,54 @@ class ImageDisplayThread(QThread):
         print('Stopping image acquisition thread')
         self.terminate
 
+class FrameAnalytics:
+    """
+    Measures every acquired frame (pointing error, lobe sums, ROI sums,
+    efficiency) and appends the results to the GUI's histories. It runs as a
+    threaded engine consumer, so the measurement rate only depends on the
+    camera; the GUI thread renders `latest` at DISPLAY_FPS.
+    """
+    def __init__(self, gui):
+        self.gui = gui
+        self.latest = None
+        self.frames_processed = 0
+
+    def process(self, frame):
+        if frame.data.ndim != 2:
+            return
+        gui = self.gui
+        image = gui.transform_plan.oriented(frame.data)
+        # The (row, col) view of the display image the vertices index, made contiguous
+        # once here (a copy only when the orientation flips) so the pointing kernel
+        # gathers its windows with one take
+        oriented_frame = np.ascontiguousarray(np.transpose(image))
+
+        # The GUI thread moves ROIs and vertices, clears and saves the histories under the same lock
+        with QMutexLocker(gui.mutex):
+            # Acquisition time from the device timestamp, so frames that waited in
+            # the queue keep the time they were taken, not the time they were measured
+            if gui.time_origin is None:
+                gui.time_origin = frame.timestamp
+            elapsed_sec = (frame.timestamp - gui.time_origin)/gui.timestamp_frequency
+            dist_array, rms_err = gui.measure_pointing_error(oriented_frame)
+            lobe_stats = gui.measure_lobe_sums(oriented_frame)
+
+            roi_sum = np.round(gui.roi_mask.sum(image)*(15e-3*15e-3),3) - gui.roi_bg_value
+            full_roi_sum = np.round(gui.full_roi_mask.sum(image)*(15e-3*15e-3),3) - gui.full_roi_bg_value
+            efficiency = roi_sum/full_roi_sum
+
+            if not np.isnan(rms_err):
+                gui.p_err_hist.append(elapsed_sec, *dist_array, rms_err)
+            gui.eff_hist.append(elapsed_sec, efficiency)
+            gui.roi_hist.append(elapsed_sec, roi_sum, full_roi_sum)
+            gui.plot_series.append(elapsed_sec, roi_sum, efficiency)
+
+        # Replaced as a whole, so the GUI never sees a half-written snapshot
+        self.latest = {'block_id': frame.block_id, 'time': elapsed_sec,
+                       'pointing_error': dist_array, 'rms_error': rms_err, 'lobe_stats': lobe_stats,
+                       'roi_sum': roi_sum, 'full_roi_sum': full_roi_sum, 'efficiency': efficiency}
+        self.frames_processed += 1
+
 class GUI(QWidget):
     def __init__(self):
         super().__init__()
@@ -284,6 +273,7 @@ class GUI(QWidget):
         self.full_sum_plot = pg.PlotWidget()
         self.xprofile_plot = pg.PlotWidget()
         self.yprofile_plot = pg.PlotWidget()
+        self.init_plots()
 
         # start and stop buttons
         self.start_button = QPushButton('Start', self)
@@ -375,8 +365,11 @@ class GUI(QWidget):
         # self.zoom_slider.toolTip()
         self.zoom_slider.valueChanged.connect(self.zoom)
 
-        self.save_csv_image = QPushButton('Save Image CSV',self)
+        self.save_csv_image = QPushButton('Save Data',self)
         self.save_csv_image.clicked.connect(self.save_csv_on_click)
+        # CSV files and PNG plots are derived from the same data as the .npz, only written when asked for
+        self.save_derived_checkbox = QCheckBox('Also save CSV/PNG', self)
+        self.export_status = QLabel('', self)
         self.save_image = QPushButton('Save Image',self)
         self.save_image.clicked.connect(self.save_on_click)
         self.disp_hex_vertices = QPushButton('Print Vercices',self)
@@ -392,6 +385,12 @@ class GUI(QWidget):
         for qline in self.pointing_error_textbox:
             qline.setReadOnly(True)
 
+        # Per-beam intensity inside an inner-ROI sized circle at each hexagon vertex
+        self.lobe_sum_label = QLabel('Lobe Sum')
+        self.lobe_sum_textbox = [QLineEdit(self) for i in range(7)]
+        for qline in self.lobe_sum_textbox:
+            qline.setReadOnly(True)
+
         self.p_err_label = QLabel("RMS Pointing Error (u rad):")
         self.p_err_out = QLineEdit(self)
 
@@ -403,6 +402,9 @@ class GUI(QWidget):
         self.combo_box = QComboBox()
         self.combo_box.addItem('Use Max')
         self.combo_box.addItem('Use Centroid')
+        self.combo_box.addItem('Use Parabolic Fit')
+        self.combo_box.addItem('Use Gaussian Fit')
+        self.combo_box.addItem('Use 2D Quadratic Fit')
         self.combo_box.setCurrentIndex(1)
         self.combo_box.currentIndexChanged.connect(lambda: self.find_appr_coord(self.combo_box))
 
@@ -475,29 +477,37 @@ class GUI(QWidget):
 
         self.setLayout(main_layout)
 
-        # Display queue for image threads
-        display_queue = queue.Queue()
+        # Bounded display handoff for image threads
+        self.display_ring = FrameSlot() if DISPLAY_OWNERSHIP else FrameRing(DISPLAY_RING_SIZE)
+        self.current_frame = None
 
         # create mutex object
         self.mutex = QMutex()
 
-        # Image acquisition and display threads
-        self.image_acq_thread = ImageAcquisitionThread(display_queue, self.mutex)
-        self.image_disp_thread = ImageDisplayThread(display_queue, self.mutex)
-        self.image_disp_thread.update_signal.connect(self.update_image)
+        # Image acquisition and display threads; the analytics run on a worker of the acquisition engine
+        self.analytics = FrameAnalytics(self)
+        self.image_acq_thread = ImageAcquisitionThread(self.display_ring, self.analytics)
+        self.image_disp_thread = ImageDisplayThread(self.display_ring)
+        self.image_disp_thread.update_signal.connect(self.show_frame)
+        # Saving runs in the background so the GUI returns straight away
+        self.export_thread = ExportThread()
+        self.export_thread.progress_signal.connect(self.update_export_progress)
+        self.export_thread.done_signal.connect(self.export_done)
+        self.export_thread.error_signal.connect(self.export_failed)
 
         self.connection_id = psu.PvSelectDevice()
-        self.device = self.image_acq_thread.connect_to_device(self.connection_id)
-        self.stream = self.image_acq_thread.open_stream(self.connection_id)
+        self.device = acq.connect_to_device(self.connection_id)
+        self.stream = acq.open_stream(self.connection_id)
         
     
         # print row and column start and stop
         self.parameters = self.device.GetParameters()
         self.enable_serial(self.parameters)
         self.parameters.SetEnumValue("TestPattern", "Off")
+        self.timestamp_frequency = self.read_timestamp_frequency()
 
-        self.image_acq_thread.configure_stream(self.device, self.stream)
-        self.buffer_list = self.image_acq_thread.configure_stream_buffers(self.device, self.stream)
+        acq.configure_stream(self.device, self.stream)
+        self.buffer_list = acq.configure_stream_buffers(self.device, self.stream, BUFFER_COUNT)
 
         # Set initial color map
         self.image_view.setColorMap(pg.ColorMap(pos=[0, 0.5, 1], color=[(0, 0, 0), (255, 255, 255), (0, 0, 0)]))
@@ -515,19 +525,27 @@ class GUI(QWidget):
 
         self.full_roi.sigRegionChanged.connect(self.update_inner_roi)
 
+        # Pixel masks for the per-frame ROI sums, rebuilt only when an ROI moves or resizes
+        self.roi_mask = roi.EllipseRegion(self.roi.pos(), self.roi.size())
+        self.full_roi_mask = roi.EllipseRegion(self.full_roi.pos(), self.full_roi.size())
+        # Lobe radius for the analytics worker, which must not touch the ROI items themselves
+        self.lobe_radius = self.roi.size()[0]*0.5
+        self.roi.sigRegionChanged.connect(self.update_roi_masks)
+        self.full_roi.sigRegionChanged.connect(self.update_roi_masks)
+
         # Lists to store data for the sum plot
-        self.sum_data = []
-        self.full_sum_data = []
+        self.plot_series = TimeSeriesRing(['time', 'roi_sum', 'efficiency'], PLOT_HISTORY)
         self.hexagon_vertices = []
         self.current_x = self.n_cols//2
         self.current_y = self.n_rows//2
 
-        self.eff_hist = []
-        self.p_err_hist = []
-        self.roi_hist = []
+        self.eff_hist = self.new_history('efficiency_hist', ['time', 'efficiency'])
+        self.roi_hist = self.new_history('roi_hist', ['time', 'roi_sum', 'full_roi_sum'])
+        self.p_err_hist = self.new_history('p_err_hist', ['time'] + ['beam_{_i}'.format(_i=i+1) for i in range(7)] + ['rms'])
 
         self.crosses = []
         self.hexagonal_vertices = []
+        self.lobe_stats = None
         self.zoom_factor = 1
 
         # Set GUI properties
@@ -540,28 +558,45 @@ class GUI(QWidget):
         icon = QIcon(pixmap)
         self.setWindowIcon(icon)
 
-        self.transform = 2
+        # Transpose and flips of the displayed frame, planned once per combo box selection
+        self.transform_plan = TransformPlan.from_name(self.flip_img_cb.currentText())
+        self.display_transform = None
+        self.display_shape = None
+        self.display_factor = 1
+        self.preview = PreviewPyramid(PREVIEW_FACTORS)
 
         self.knn = 30
         self.find_coord = self.find_max_coordinates
+        self.pointing_method = 'max'
+        self.centroid_engine = CentroidEngine()
 
         self.image_view.getView().scene().sigMouseClicked.connect(self.image_clicked)
         # Load JPEG image
 
         self.image = np.zeros((100,100))
-        self.start_time = QDateTime.currentDateTime()
-        self.time_axis = []
+        # Device timestamp of the first measured frame, set by FrameAnalytics
+        self.time_origin = None
 
         self.show()
     
     # def show_rois(self,event)
+    def new_history(self, name, columns):
+        spill_path = None if HISTORY_SPILL_DIR is None else os.path.join(HISTORY_SPILL_DIR, name+'.f64')
+        return HistoryStore(columns, spill_path=spill_path)
+
     def update_inner_roi(self):
         center = self.full_roi.pos() + (self.full_roi.size() - self.roi.size())/2
         self.roi.setPos(center)
 
+    def update_roi_masks(self):
+        with QMutexLocker(self.mutex):
+            self.roi_mask.set_geometry(self.roi.pos(), self.roi.size())
+            self.full_roi_mask.set_geometry(self.full_roi.pos(), self.full_roi.size())
+            self.lobe_radius = self.roi.size()[0]*0.5
+
     def start_thread(self):
         
-        self.image_acq_thread.init_params(self.device,self.stream)
+        self.image_acq_thread.init_params(self.device,self.stream,len(self.buffer_list))
         self.image_acq_thread.start()
         print('Image Generation Started')
         self.image_disp_thread.start()
@@ -571,10 +606,27 @@ class GUI(QWidget):
 
     def stop_thread(self):
         self.image_acq_thread.requestInterruption()
+        # The engine stops the device, aborts the stream's buffers and stops its
+        # workers (the analytics too) before run() returns
+        self.image_acq_thread.wait()
         print('Image Generation Stopped')
         # self.image_acq_thread.stop()
         self.image_disp_thread.requestInterruption()
+        self.image_disp_thread.wait()
         print('Image Display Stopped')
+        # Nothing may point into the PvBuffers once they are freed: keep a copy of the
+        # displayed frame and hand back the frames still held
+        self.image = np.array(self.image)
+        item = self.image_view.getImageItem()
+        if item.image is not None:
+            item.setImage(np.array(item.image), autoLevels=False)
+        if self.current_frame is not None:
+            self.current_frame.release()
+            self.current_frame = None
+        self.display_ring.clear()
+        # Let a save in progress finish its files before the GUI goes away
+        self.export_thread.stop()
+        print('Export Stopped')
 
         self.serial.Close()
         # self.image_disp_thread.stop()
@@ -597,6 +649,11 @@ class GUI(QWidget):
         # Close the GUI
         self.close()
     
+    def closeEvent(self, event):
+        # Closing the window mid-save would leave a truncated .npz behind
+        self.export_thread.stop()
+        super().closeEvent(event)
+
     def zoom(self,value):
        self.zoom_factor = 1+0.01*value
     
@@ -609,22 +666,30 @@ class GUI(QWidget):
         print('roi_bg_value:',self.roi_bg_value)
         print('full_roi_bg_value:',self.full_roi_bg_value)
     
+    def scene_to_image(self, pos):
+        # View coordinates are self.image[x, y] coordinates: the image item's own
+        # transform mirrors (and for a binned preview scales) the pixels it shows,
+        # so its item-local coordinates are not
+        return self.image_view.getView().getViewBox().mapSceneToView(pos)
+
     def update_hexagon(self, event):
         pos = event.pos()
         hexagon_radius = 125
-        clicked_point = self.image_view.getImageItem().mapFromScene(pos)
+        clicked_point = self.scene_to_image(pos)
         hexagon_center = [clicked_point.x(), clicked_point.y()] 
         # Set up the hexagon vertices
         angle_offset = np.pi / 3 + np.pi + np.deg2rad(2)  # Offset to start the hexagon from the top
         
-        self.hexagon_vertices = [
+        # Built in full and swapped in under the mutex: the analytics worker reads the list
+        hexagon_vertices = [(clicked_point.x(), clicked_point.y())] + [
             (
                 hexagon_center[0] + hexagon_radius * np.cos(angle_offset - i * 2 * np.pi / 6),
                 hexagon_center[1] + hexagon_radius * np.sin(angle_offset - i * 2 * np.pi / 6),
             )
             for i in range(6)
         ]
-        self.hexagon_vertices.insert(0,(clicked_point.x(), clicked_point.y()))
+        with QMutexLocker(self.mutex):
+            self.hexagon_vertices = hexagon_vertices
 
         # Clear existing crosses
         for cross in self.crosses:
@@ -749,11 +814,12 @@ class GUI(QWidget):
     
     def image_clicked(self, event):
         pos = event.pos()
-        clicked_point = self.image_view.getImageItem().mapFromScene(pos)
+        clicked_point = self.scene_to_image(pos)
         self.current_x = int(clicked_point.x())
         self.current_y = int(clicked_point.y())
-        self.current_x = np.clip(self.current_x,0,640)
-        self.current_y = np.clip(self.current_y,0,512)
+        # Full-resolution pixel indices, whatever the displayed preview is binned by
+        self.current_x = np.clip(self.current_x,0,self.image.shape[0]-1)
+        self.current_y = np.clip(self.current_y,0,self.image.shape[1]-1)
         # self.update_image(self.image_view.getImageItem().image)
     
     def enable_serial(self,parameters):
@@ -804,6 +870,43 @@ class GUI(QWidget):
             print("height set")
     
     
+    def init_plots(self):
+        # Axis styling and curves are created once; update_image only calls setData
+        view = self.image_view.getView()
+        view.showGrid(x=True, y=True)
+        for axis in ('left', 'bottom'):
+            view.getAxis(axis).setStyle(tickFont=pg.QtGui.QFont("Arial",8))
+            view.getAxis(axis).setTextPen(pg.mkPen(color=(255,255,255)))
+
+        for plot, font_size in ((self.xprofile_plot, 10), (self.yprofile_plot, 10),
+                                (self.sum_plot, 11), (self.full_sum_plot, 11)):
+            plot.showGrid(x=True, y=True)
+            for axis in ('left', 'bottom'):
+                plot.getAxis(axis).setStyle(tickFont=pg.QtGui.QFont("Arial",font_size))
+                plot.getAxis(axis).setTextPen(pg.mkPen(color=(255,255,255)))
+
+        styles = {'color': '#ffffff', 'font-size': '12pt'}
+        self.xprofile_plot.setLabel('left', 'Intensity', **styles)
+        self.xprofile_plot.setLabel('bottom', 'X', **styles)
+        self.yprofile_plot.setLabel('left', 'Intensity', **styles)
+        self.yprofile_plot.setLabel('bottom', 'Y', **styles)
+        self.sum_plot.setLabel('left', 'Sum Inside ROI', **styles)
+        self.sum_plot.setLabel('bottom', 'Time (s)', **styles)
+        self.full_sum_plot.setLabel('left', 'Efficiency', **styles)
+        self.full_sum_plot.setLabel('bottom', 'Time (s)', **styles)
+
+        # Set y limit to 255 for the line profile plots
+        self.xprofile_plot.setYRange(0, 255)
+        self.yprofile_plot.setYRange(0, 255)
+        self.full_sum_plot.setYRange(0,0.25)
+
+        self.x_profile = np.empty(0)
+        self.y_profile = np.empty(0)
+        self.x_curve = self.xprofile_plot.plot(pen='r', name='X profile')
+        self.y_curve = self.yprofile_plot.plot(pen='g', name='Y profile')
+        self.sum_curve = self.sum_plot.plot(pen='y')
+        self.full_sum_curve = self.full_sum_plot.plot(pen='y')
+
     def init_pointing_error_tab(self):
         pointing_error_layout = QVBoxLayout(self.pointing_error_tab)
         # create groupbox and grid layout
@@ -812,11 +915,13 @@ class GUI(QWidget):
 
         pointing_error_grid_layout.addWidget(self.combo_box_label,0,0)
         pointing_error_grid_layout.addWidget(self.combo_box,0,1)
+        pointing_error_grid_layout.addWidget(self.lobe_sum_label,0,2)
 
         # add widgets to the grid layout inside groupbox
         for i in range(7):
             pointing_error_grid_layout.addWidget(self.pointing_error_labels[i],i+1,0)
             pointing_error_grid_layout.addWidget(self.pointing_error_textbox[i],i+1,1)
+            pointing_error_grid_layout.addWidget(self.lobe_sum_textbox[i],i+1,2)
 
         pointing_error_grid_layout.addWidget(self.p_err_label,i+2,0)
         pointing_error_grid_layout.addWidget(self.p_err_out, i+2, 1)
@@ -832,6 +937,8 @@ class GUI(QWidget):
         save_grid_layout = QGridLayout()
         save_grid_layout.addWidget(self.file_name)
         save_grid_layout.addWidget(self.save_csv_image)
+        save_grid_layout.addWidget(self.save_derived_checkbox)
+        save_grid_layout.addWidget(self.export_status)
         save_grid_layout.addWidget(self.save_image)
         save_grid_layout.addWidget(self.disp_hex_vertices)
         save_grp_box.setLayout(save_grid_layout)
@@ -1042,7 +1149,7 @@ class GUI(QWidget):
 
     def update_infinite_lines(self, event):
         pos = event.pos()
-        clicked_point = self.image_view.getImageItem().mapFromScene(pos)
+        clicked_point = self.scene_to_image(pos)
 
         if self.horizontal_line:
             self.horizontal_line.setPos(self.current_y)#
@@ -1166,64 +1273,82 @@ class GUI(QWidget):
         rows, cols = np.unravel_index(flattened_index, matrix.shape)
         return rows, cols
     
-    def find_centroid_coord(self,matrix):
-        rows,cols = np.indices(matrix.shape)
-
-        centroid_x = int(np.average(cols,weights=matrix))
-        centroid_y = int(np.average(rows,weights=matrix))
+    def find_fitted_peak_coord(self,matrix):
+        # Argmax refined from its 3x3 neighbourhood with the selected peak fit
+        return peak_fit.locate_peak(matrix, self.pointing_method)
 
-        return centroid_x, centroid_y
+    def find_centroid_coord(self,matrix):
+        # Sub-pixel centroid in the same (axis 0, axis 1) order as find_max_coordinates
+        rows, cols = self.centroid_engine.centroid(matrix)
+        return rows, cols
     
     def find_appr_coord(self, combo_box):
         selected_option = combo_box.currentText()
         if selected_option == 'Use Max':
             self.find_coord = self.find_max_coordinates
+            self.pointing_method = 'max'
         elif selected_option == 'Use Centroid':
             self.find_coord = self.find_centroid_coord
+            self.pointing_method = 'centroid'
+        elif selected_option == 'Use Parabolic Fit':
+            self.find_coord = self.find_fitted_peak_coord
+            self.pointing_method = 'parabolic'
+        elif selected_option == 'Use Gaussian Fit':
+            self.find_coord = self.find_fitted_peak_coord
+            self.pointing_method = 'gaussian'
+        elif selected_option == 'Use 2D Quadratic Fit':
+            self.find_coord = self.find_fitted_peak_coord
+            self.pointing_method = 'quadratic'
     
     def img_transform(self,combo_box):
         selected_option = combo_box.currentText()
-        if selected_option == 'None':
-            self.transform = None
-        elif selected_option == 'UD':
-            self.transform = np.flipud
-        elif selected_option == 'LR':
-            self.transform = np.fliplr
-        elif selected_option == 'LR-UD':
-            self.transform = 1
-        elif selected_option == 'UD-LR':
-            self.transform = 2
+        self.transform_plan = TransformPlan.from_name(selected_option)
+        # Rebuilt for the new flips on the next frame
+        self.display_transform = None
     
 
-    def update_pointing_error(self, image):
-        # print('updating..')
-        # print(self.hexagon_vertices)
-        current_time = QDateTime.currentDateTime()
-        elapsed_sec = self.start_time.msecsTo(current_time)/1000
-        hexagon_vertices = np.array(self.hexagon_vertices).astype(int)
-        dist_array = []
-        for qline,vertex in zip(self.pointing_error_textbox,hexagon_vertices):
-            if vertex[0]-self.knn >=0 and vertex[0]+self.knn<=640 and vertex[1]-self.knn >=0 and vertex[1]+self.knn<=512:
-                img = image[vertex[0]-self.knn:vertex[0]+self.knn,vertex[1]-self.knn:vertex[1]+self.knn]
-                # calculate euclidean distance between vertex and coordinate correspondng to max of the img
-                max_coord = self.find_coord(img)
-                dist = np.sqrt(np.sum((np.array(max_coord).ravel()-np.array([self.knn,self.knn]).ravel())**2))#np.round(np.linalg.norm(max_coord-vertex),2)
-                dist = dist*15/2.8
-                dist_array.append(dist)
-                dist = np.round(dist,2)
-                qline.setText(str(dist))
-            else:
-                pass
-        if len(dist_array)>0:
-            dist_array = np.array(dist_array)
-            p_err = dist_array#*15/2.8
-            rms_err = np.sqrt(np.mean(p_err[1:]**2))
-            dist_array = np.append(np.array([elapsed_sec]),dist_array)
-            self.p_err_hist.append(np.append(dist_array,rms_err))
-            rms_err = np.round(rms_err,2)
-            self.p_err_out.setText(str(rms_err))
-            
-    
+    def measure_pointing_error(self, frame, method=None):
+        # One column per beam so every history row has the same layout, nan where the window is off-image
+        dist_array = np.full(len(self.pointing_error_textbox), np.nan)
+        if len(self.hexagon_vertices) == 0:
+            return dist_array, np.nan
+        # Vertices are (x, y) in display coordinates, i.e. image[x, y], so frame is
+        # the transposed (row, col) view of the display image, like for the lobe integrator
+        p_err, rms_err = pointing.pointing_error(frame, self.hexagon_vertices[:len(dist_array)],
+                                                 self.knn, method or self.pointing_method)
+        dist_array[:len(p_err)] = p_err['error']
+        return dist_array, rms_err
+
+    def read_timestamp_frequency(self):
+        # Device timestamp ticks per second; GigE Vision devices report it, USB3 Vision timestamps are in ns
+        parameter = self.parameters.Get("GevTimestampTickFrequency")
+        if parameter is not None:
+            result, frequency = parameter.GetValue()
+            if result.IsOK() and frequency > 0:
+                return float(frequency)
+        return 1e9
+
+    def update_pointing_error(self, dist_array, rms_err):
+        for qline,dist in zip(self.pointing_error_textbox,dist_array):
+            if not np.isnan(dist):
+                qline.setText(str(np.round(dist,2)))
+        if not np.isnan(rms_err):
+            self.p_err_out.setText(str(np.round(rms_err,2)))
+
+    def measure_lobe_sums(self, frame):
+        if len(self.hexagon_vertices) == 0:
+            return None
+        # frame is the transposed (row, col) view of the display image, see measure_pointing_error
+        integrator = roi.lobe_integrator(frame.shape, self.hexagon_vertices, self.lobe_radius)
+        return integrator.measure(frame)
+
+    def update_lobe_sums(self, lobe_stats):
+        self.lobe_stats = lobe_stats
+        if lobe_stats is None:
+            return
+        for qline, lobe_sum in zip(self.lobe_sum_textbox, lobe_stats['sum']):
+            qline.setText(str(np.round(lobe_sum*(15e-3*15e-3),3)))
+
     def hexagon_lock(self):
         vertex = np.array(self.hexagon_vertices[0]).astype(int)
 
@@ -1234,14 +1359,16 @@ class GUI(QWidget):
         
         hexagon_center = np.array([vertex[0],vertex[1]])+np.array([max_coord[0],max_coord[1]])-np.array([self.knn,self.knn])
         hexagon_radius = 125
-        self.hexagon_vertices = [
+        # Built in full and swapped in under the mutex: the analytics worker reads the list
+        hexagon_vertices = [(hexagon_center[0], hexagon_center[1])] + [
             (
                 hexagon_center[0] + hexagon_radius * np.cos(angle_offset - i * 2 * np.pi / 6),
                 hexagon_center[1] + hexagon_radius * np.sin(angle_offset - i * 2 * np.pi / 6),
             )
             for i in range(6)
         ]
-        self.hexagon_vertices.insert(0,(hexagon_center[0], hexagon_center[1]))
+        with QMutexLocker(self.mutex):
+            self.hexagon_vertices = hexagon_vertices
 
         # Clear existing crosses
         for cross in self.crosses:
@@ -1258,241 +1385,160 @@ class GUI(QWidget):
             self.crosses.append(cross)
     
     def save_csv_on_click(self):
-        name = 'C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'+self.file_name.text()+'.csv'
-        img = self.image_view.image
-        img = np.transpose(img)
-        np.savetxt(name,img)
-
-        hex_array = np.array(self.hexagon_vertices)
-        
-
-        hexagon_vertices = np.array(self.hexagon_vertices).astype(int)
-        max_dist_array = []
-        centroid_dist_array = []
-
-        for qline,vertex in zip(self.pointing_error_textbox,hexagon_vertices):
-            if vertex[0]-self.knn >=0 and vertex[0]+self.knn<=640 and vertex[1]-self.knn >=0 and vertex[1]+self.knn<=512:
-                img = self.image[vertex[0]-self.knn:vertex[0]+self.knn,vertex[1]-self.knn:vertex[1]+self.knn]
-                # calculate euclidean distance between vertex and coordinate correspondng to max of the img
-                max_coord = self.find_max_coordinates(img)
-                max_dist = np.sqrt(np.sum((np.array(max_coord).ravel()-np.array([self.knn,self.knn]).ravel())**2))#np.round(np.linalg.norm(max_coord-vertex),2)
-                max_dist = max_dist*15/2.8
-                max_dist_array.append(max_dist)
-
-                max_coord = self.find_centroid_coord(img)
-                centroid_dist = np.sqrt(np.sum((np.array(max_coord).ravel()-np.array([self.knn,self.knn]).ravel())**2))#np.round(np.linalg.norm(max_coord-vertex),2)
-                centroid_dist = centroid_dist*15/2.8
-                centroid_dist_array.append(centroid_dist)
-            else:
-                pass
-        
-        if len(max_dist_array)>0 and len(centroid_dist_array)>0:
-            max_dist_array = np.array(max_dist_array)
-            max_p_err = max_dist_array
-            max_rms_err = np.sqrt(np.mean(max_p_err[1:]**2))
-            # max_rms_err = np.round(max_rms_err,2)
-
-            centroid_dist_array = np.array(centroid_dist_array)
-            centroid_p_err = centroid_dist_array
-            centroid_rms_err = np.sqrt(np.mean(centroid_p_err[1:]**2))
-            # centroid_rms_err = np.round(centroid_rms_err,2)
-        
-            p_err_data = np.zeros((2,len(max_dist_array)+1))
-            p_err_data[0,0:len(max_dist_array)] = max_p_err
-            p_err_data[0,len(max_dist_array)] = max_rms_err
-
-            p_err_data[1,0:len(max_dist_array)] = centroid_p_err
-            p_err_data[1,len(max_dist_array)] = centroid_rms_err
-
-
-
-            np.savetxt('C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'+self.file_name.text()+'_p_err_data.csv',p_err_data, delimiter=',')
-            np.savetxt('C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'+self.file_name.text()+'_vertices.csv', hex_array, delimiter=',')
-
-            np.savetxt('C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'+self.file_name.text()+'_p_err_hist.csv',np.array(self.p_err_hist), delimiter=',')
-
-            plt.figure(figsize=(10,7))
-            plt.plot(np.array(self.p_err_hist)[:,0],np.array(self.p_err_hist)[:,-1])
-            plt.xlabel('Time (s)',fontsize=14)
-            plt.ylabel('RMS Pointing Error ' + r'$\mu rad$', fontsize=14)
-            plt.grid()
-            plt.xticks(fontsize=14)
-            plt.yticks(fontsize=14)
-            plt.savefig('C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'+self.file_name.text()+'_p_err_hist.png')
-            plt.clf()
-            plt.close()
-
-        else:
-            np.savetxt('C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'+self.file_name.text()+'_efficiency_hist.csv',np.array(self.eff_hist), delimiter=',')
-            np.savetxt('C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'+self.file_name.text()+'_roi_hist.csv',np.array(self.roi_hist), delimiter=',')
-
-            plt.figure(figsize=(10,7))
-            plt.plot(np.array(self.eff_hist)[:,0],100*np.array(self.eff_hist)[:,1])
-            plt.xlabel('Time (s)',fontsize=14)
-            plt.ylabel('Efficiency (%)', fontsize=14)
-            plt.grid()
-            plt.ylim(0,26)
-            plt.xticks(fontsize=14)
-            plt.yticks(fontsize=14)
-            plt.savefig('C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'+self.file_name.text()+'_efficiency_hist.png')
-            plt.clf()
-            plt.close()
-
-        
+        # Snapshot everything on the GUI thread (the displayed frame may point into a
+        # buffer that is about to be requeued), then write it in the background
+        job = ExportJob(DATA_DIR+self.file_name.text(), derived=self.save_derived_checkbox.isChecked())
+        frame = np.ascontiguousarray(np.transpose(self.image))
+        job.add_array('frame', frame)
+        job.add_array('vertices', np.array(self.hexagon_vertices, dtype=np.float64))
+
+        # Both methods on the displayed frame, each in one batched pass over the vertex windows
+        max_dist_array, max_rms_err = self.measure_pointing_error(frame, 'max')
+        centroid_dist_array, centroid_rms_err = self.measure_pointing_error(frame, 'centroid')
+        in_frame = ~np.isnan(max_dist_array)
+
+        if np.any(in_frame):
+            # Rows: max, centroid; the in-frame beam errors followed by the RMS error
+            p_err_data = np.zeros((2,np.count_nonzero(in_frame)+1))
+            p_err_data[0,:-1] = max_dist_array[in_frame]
+            p_err_data[0,-1] = max_rms_err
+            p_err_data[1,:-1] = centroid_dist_array[in_frame]
+            p_err_data[1,-1] = centroid_rms_err
+            job.add_array('p_err_data', p_err_data)
+
+        with QMutexLocker(self.mutex):
+            p_err_hist = self.p_err_hist.to_array()
+            eff_hist = self.eff_hist.to_array()
+            roi_hist = self.roi_hist.to_array()
+        job.add_columns('p_err_hist', p_err_hist, self.p_err_hist.columns)
+        job.add_columns('efficiency_hist', eff_hist, self.eff_hist.columns)
+        job.add_columns('roi_hist', roi_hist, self.roi_hist.columns)
+        job.add_plot('p_err_hist', 'time', 'rms', 'Time (s)', 'RMS Pointing Error ' + r'$\mu rad$')
+        job.add_plot('efficiency_hist', 'time', 'efficiency', 'Time (s)', 'Efficiency (%)', scale=100, ylim=(0,26))
+
+        self.export_status.setText('Saving '+os.path.basename(job.npz_path))
+        self.export_thread.submit(job)
+
+    def update_export_progress(self, done, total, label):
+        self.export_status.setText(f'Saving {done}/{total}: {os.path.basename(label)}')
+
+    def export_done(self, paths):
+        self.export_status.setText(f'Saved {os.path.basename(paths[0])}'
+                                   + (f' (+{len(paths)-1} CSV/PNG)' if len(paths) > 1 else ''))
+
+    def export_failed(self, message):
+        self.export_status.setText('Save failed')
+        print(f'Export failed: {message}')
 
     def save_on_click(self):
-        img = self.image_view.image
+        img = self.image
         img = np.transpose(img)
         plt.figure()
         plt.imshow(img,cmap='jet')
         plt.colorbar()
         plt.tight_layout()
-        plt.savefig('C:/Users/bs-iitm/OneDrive - smail.iitm.ac.in/my gui/data/'+self.file_name.text()+'.png')
+        plt.savefig(DATA_DIR+self.file_name.text()+'.png')
         plt.clf()
     
     def disp_hex_on_click(self):
         print(self.hexagon_vertices)
 
-    def update_image(self, image):
-
-        current_time = QDateTime.currentDateTime()
-        elapsed_sec = self.start_time.msecsTo(current_time)
-        self.time_axis.append(elapsed_sec*1e-3)
-
-        if self.transform is not None:
-            if self.transform == 2:
-                image = np.fliplr(np.flipud(image))#self.transform(image)
-            elif self.transform ==1:
-                image = np.flipud(np.fliplr(image))
-            else:
-                image = self.transform(image)
-        
+    def show_frame(self):
+        # Latest frame wins, anything older than that was already skipped
+        self.image_disp_thread.pending.clear()
+        if DISPLAY_OWNERSHIP:
+            frame = self.display_ring.take(timeout=0)
+        else:
+            image_data = self.display_ring.get_latest(timeout=0)
+            frame = None if image_data is None else acq.Frame(image_data)
+        if frame is None:
+            return
+        # self.image and the image view point into frame.data, so the frame
+        # (and in ownership mode its PvBuffer) is held until the next one replaces it
+        previous, self.current_frame = self.current_frame, frame
+        self.update_image(frame.data)
+        if previous is not None:
+            previous.release()
+
+    def update_image(self, frame_data):
+        # Render only: the measurements come from the analytics worker, which
+        # sees every frame, while this runs at most DISPLAY_FPS times a second
+
+        # self.image is the frame in display orientation (one view, no copy), indexed [x, y]
+        # like everything drawn on the view. pyqtgraph gets the unflipped transpose, which is
+        # F-contiguous with positive strides, and mirrors it with the image item's transform
+        image = self.transform_plan.oriented(frame_data)
         self.image = image
         shape_x,shape_y = self.image.shape
-        self.current_x = np.clip(self.current_x,0,shape_x)
-        self.current_y = np.clip(self.current_y,0,shape_y)
+
+        # Zoomed out, several frame pixels share a screen pixel: show a binned preview
+        # instead, scaled back up by the image item's transform
+        if self.zoom_factor > 1 or frame_data.ndim != 2:
+            factor = 1
+        else:
+            factor = self.preview.factor_for(min(self.image_view.getView().getViewBox().viewPixelSize()))
+        preview = self.preview.binned(frame_data, factor)
+        if self.display_transform is None or self.display_shape != image.shape or self.display_factor != factor:
+            self.display_transform = QTransform(*self.transform_plan.display_matrix(image.shape, factor))
+            self.display_shape = image.shape
+            self.display_factor = factor
+        self.current_x = np.clip(self.current_x,0,shape_x-1)
+        self.current_y = np.clip(self.current_y,0,shape_y-1)
         # self.image_view.getView().setLimits(xMin=0,xMax=shape_x,yMin=0,yMax=shape_y)
-        self.image_view.setImage(image, levels=(0, 255),autoHistogramRange=False)
+        self.image_view.setImage(self.transform_plan.unflipped(preview), levels=(0, 255),autoHistogramRange=False,
+                                 transform=self.display_transform)
         if self.zoom_factor == 1:
             self.image_view.getView().setLimits(xMin=0,xMax=shape_x,yMin=0,yMax=shape_y)
         else:
             #, levels=(0, 255),autoHistogramRange=False
-            w,h = self.image_view.getImageItem().width()/self.zoom_factor,self.image_view.getImageItem().height()/self.zoom_factor
+            # From the full-resolution image: the image item may hold a binned preview
+            w,h = shape_x/self.zoom_factor,shape_y/self.zoom_factor
             center_x,center_y = self.current_x,self.current_y
             self.image_view.getView().setRange(xRange=[center_x-w/2,center_x+w/2],yRange=[center_y-h/2,center_y+h/2])
 
-        self.image_view.getView().showGrid(x=True, y=True)
-        self.image_view.getView().getAxis('left').setStyle(tickFont=pg.QtGui.QFont("Arial",8))
-        self.image_view.getView().getAxis('left').setTextPen(pg.mkPen(color=(255,255,255)))
-        self.image_view.getView().getAxis('bottom').setStyle(tickFont=pg.QtGui.QFont("Arial",8))
-        self.image_view.getView().getAxis('bottom').setTextPen(pg.mkPen(color=(255,255,255)))
-
-        
+        # Copy the profiles so the curves never point into a frame that is being recycled
         x_profile = image[:, self.current_y]
         y_profile = image[self.current_x, :]
+        if self.x_profile.shape != x_profile.shape:
+            self.x_profile = np.empty(x_profile.shape)
+        if self.y_profile.shape != y_profile.shape:
+            self.y_profile = np.empty(y_profile.shape)
+        np.copyto(self.x_profile, x_profile)
+        np.copyto(self.y_profile, y_profile)
+        self.x_curve.setData(self.x_profile)
+        self.y_curve.setData(self.y_profile)
 
-        self.xprofile_plot.clear()
-        self.yprofile_plot.clear()
-
-        x_curve = self.xprofile_plot.plot(x_profile, pen='r', name='X profile')
-        y_curve = self.yprofile_plot.plot(y_profile, pen='g', name='Y profile')
-
-        # Set y limit to 255 for the line profile plots
-        self.yprofile_plot.setYRange(0, 255)
-        self.xprofile_plot.setYRange(0, 255)
-
-        # Add grid lines to the line profiles
-        self.xprofile_plot.showGrid(x=True, y=True)
-        self.xprofile_plot.getAxis('left').setStyle(tickFont=pg.QtGui.QFont("Arial",10))
-        self.xprofile_plot.getAxis('left').setTextPen(pg.mkPen(color=(255,255,255)))
-        self.xprofile_plot.getAxis('bottom').setStyle(tickFont=pg.QtGui.QFont("Arial",10))
-        self.xprofile_plot.getAxis('bottom').setTextPen(pg.mkPen(color=(255,255,255)))
-        self.yprofile_plot.showGrid(x=True, y=True)
-        self.yprofile_plot.getAxis('left').setStyle(tickFont=pg.QtGui.QFont("Arial",10))
-        self.yprofile_plot.getAxis('left').setTextPen(pg.mkPen(color=(255,255,255)))
-        self.yprofile_plot.getAxis('bottom').setStyle(tickFont=pg.QtGui.QFont("Arial",10))
-        self.yprofile_plot.getAxis('bottom').setTextPen(pg.mkPen(color=(255,255,255)))
-
-        self.update_pointing_error(image)
-
-        # Increase the fontsize of x and y ticks
-        styles = {'color': '#ffffff', 'font-size': '12pt'}
-        self.xprofile_plot.setLabel('left', 'Intensity', **styles)
-        self.xprofile_plot.setLabel('bottom', 'X', **styles)
-        self.yprofile_plot.setLabel('left', 'Intensity', **styles)
-        self.yprofile_plot.setLabel('bottom', 'Y', **styles)
-        
-
-        # Get the region inside the ROI using the CircleROI's getArrayRegion method
-        roi_region = self.roi.getArrayRegion(image,
-                                            self.image_view.getImageItem(),
-                                            axes=(0, 1),
-                                            returnMappedCoords=False)
-
-        # Update the sum plot with the sum inside ROI as a function of time
-        roi_sum = np.round(np.sum(roi_region)*(15e-3*15e-3),3)
-        self.roi_textbox.setText(str(np.round(roi_sum-self.roi_bg_value,2)))
         self.roi_radius_textbox.setText(str(np.round(self.roi.size()[0]*0.5*15))+' um')
-
-        self.sum_data.append((len(self.sum_data), roi_sum-self.roi_bg_value))
-
-        if len(self.time_axis) > 2500:
-            self.time_axis.pop(0)
-        if len(self.sum_data) > 2500:
-            self.sum_data.pop(0)
-        self.sum_plot.clear()#np.arange(len(self.sum_data))
-        self.sum_plot.plot(np.array(self.time_axis), [item[1] for item in self.sum_data], pen='y')
-        self.sum_plot.setLabel('left', 'Sum Inside ROI', **styles)
-        self.sum_plot.setLabel('bottom', 'Time (s)', **styles)
-        self.sum_plot.showGrid(x=True, y=True)
-        self.sum_plot.getAxis('left').setStyle(tickFont=pg.QtGui.QFont("Arial",11))
-        self.sum_plot.getAxis('left').setTextPen(pg.mkPen(color=(255,255,255)))
-        self.sum_plot.getAxis('bottom').setStyle(tickFont=pg.QtGui.QFont("Arial",11))
-        self.sum_plot.getAxis('bottom').setTextPen(pg.mkPen(color=(255,255,255)))
-        full_roi_region = self.full_roi.getArrayRegion(image,
-                                            self.image_view.getImageItem(),
-                                            axes=(0, 1),
-                                            returnMappedCoords=False)
-        full_roi_sum = np.round(np.sum(full_roi_region)*(15e-3*15e-3),3)
-        self.full_roi_textbox.setText(str(np.round(full_roi_sum-self.full_roi_bg_value,2)))
         self.full_roi_radius_textbox.setText(str(np.round(self.full_roi.size()[0]*0.5*15))+' um')
 
-        self.eff_textbox.setText(str(np.round(100*((roi_sum-self.roi_bg_value)/(full_roi_sum-self.full_roi_bg_value)),3)))
-
-        self.eff_hist.append([elapsed_sec/1000,(roi_sum-self.roi_bg_value)/(full_roi_sum-self.full_roi_bg_value)])
-
-        self.roi_hist.append([elapsed_sec*1e-3, (roi_sum-self.roi_bg_value), (full_roi_sum-self.full_roi_bg_value)])
-
-        self.full_sum_data.append((len(self.full_sum_data), (roi_sum-self.roi_bg_value)/(full_roi_sum-self.full_roi_bg_value)))
-        if len(self.full_sum_data) > 2500:
-            self.full_sum_data.pop(0)
-        self.full_sum_plot.clear()
-        kernel = np.ones(20)/20
-        # result = np.convolve(np.array([item[1] for item in self.full_sum_data]),kernel, mode='same')
-        # self.full_sum_plot.plot(np.arange(len(result)), result, pen='y') np.arange(len(self.full_sum_data))
-        self.full_sum_plot.plot(np.array(self.time_axis), [item[1] for item in self.full_sum_data], pen='y')
-        self.full_sum_plot.setLabel('left', 'Efficiency', **styles)
-        self.full_sum_plot.setLabel('bottom', 'Time (s)', **styles)
-        self.full_sum_plot.showGrid(x=True, y=True)
-        self.full_sum_plot.setYRange(0,0.25)
-        self.full_sum_plot.getAxis('left').setStyle(tickFont=pg.QtGui.QFont("Arial",11))
-        self.full_sum_plot.getAxis('left').setTextPen(pg.mkPen(color=(255,255,255)))
-        self.full_sum_plot.getAxis('bottom').setStyle(tickFont=pg.QtGui.QFont("Arial",11))
-        self.full_sum_plot.getAxis('bottom').setTextPen(pg.mkPen(color=(255,255,255)))
+        snapshot = self.analytics.latest
+        if snapshot is None:
+            return
+        self.update_pointing_error(snapshot['pointing_error'], snapshot['rms_error'])
+        self.update_lobe_sums(snapshot['lobe_stats'])
+        self.roi_textbox.setText(str(np.round(snapshot['roi_sum'],2)))
+        self.full_roi_textbox.setText(str(np.round(snapshot['full_roi_sum'],2)))
+        self.eff_textbox.setText(str(np.round(100*snapshot['efficiency'],3)))
+
+        # The worker keeps appending, so plot a copy of the ring taken under the lock
+        with QMutexLocker(self.mutex):
+            series = self.plot_series.view().copy()
+        time_axis = series[:, self.plot_series.index['time']]
+        self.sum_curve.setData(time_axis, series[:, self.plot_series.index['roi_sum']])
+        # kernel = np.ones(20)/20
+        # result = np.convolve(series[:, self.plot_series.index['efficiency']],kernel, mode='same')
+        self.full_sum_curve.setData(time_axis, series[:, self.plot_series.index['efficiency']])
 
     def clear_roi_plot(self):
-        self.sum_data = []
-        self.sum_plot.clear()
-
-        self.full_sum_data = []
-        self.full_sum_plot.clear()
-
-        self.eff_hist = []
-        self.p_err_hist = []
-        self.roi_hist = []
-
-        self.time_axis=[]
-        self.start_time = QDateTime.currentDateTime()
+        with QMutexLocker(self.mutex):
+            self.plot_series.clear()
+            self.eff_hist.clear()
+            self.p_err_hist.clear()
+            self.roi_hist.clear()
+            # The next measured frame is time 0
+            self.time_origin = None
+        self.sum_curve.setData([], [])
+        self.full_sum_curve.setData([], [])
 
     def set_integration_time(self):
         try:
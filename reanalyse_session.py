@@ -0,0 +1,84 @@
+'''
+Re-run the lobe, pointing-error and efficiency analysis on a recording made
+by my_prog.py or control_stream.py (lib/recorder.py), with any lobe radius,
+window size or pointing method, and save the columns next to it (see
+lib/batch_analysis.py).
+
+The lobes are the ones the recorder stored in session.json unless --centers
+or --radius-mm override them; recordings without them fall back to a
+hexagon around the frame center.
+
+    python3 reanalyse_session.py images/recording_20240101_120000 --method centroid --radius-mm 0.25
+    python3 reanalyse_session.py recordings/control_20240101_120000 --centers 128,108
+'''
+
+import time
+import argparse
+
+import numpy as np
+
+import lib.pointing as pointing
+from lib.recorder import SessionReader
+from lib.batch_analysis import StackAnalysis, analyse_session, CHUNK_SIZE
+
+PIXEL_SIZE_MM = 15e-3
+# Lobe radius for recordings that don't store one
+DEFAULT_RADIUS_MM = 0.3
+# Inner and full efficiency circles, the GUI's default ROIs (300 and 900 um across)
+EFFICIENCY_RADII_MM = (0.15, 0.45)
+
+
+def generate_hexagon_vertices(center, radius):
+    angles_rad = np.radians(np.array([60 * i for i in range(6)]))
+    x = center[0] + radius * np.cos(angles_rad)
+    y = center[1] + radius * np.sin(angles_rad)
+    return np.vstack([np.column_stack([x, y]), center])
+
+def parse_center(text):
+    # "x,y" in pixels
+    x, y = text.split(",")
+    return int(x), int(y)
+
+def print_progress(done, total):
+    print(f"\r{done}/{total} frames", end="", flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording")
+    parser.add_argument("--centers", type=parse_center, nargs="+", default=None, metavar="X,Y",
+                        help="lobe centers in pixels, main lobe last (default: the recording's)")
+    parser.add_argument("--radius-mm", type=float, default=None,
+                        help=f"lobe radius (default: the recording's, else {DEFAULT_RADIUS_MM})")
+    parser.add_argument("--efficiency-radii-mm", type=float, nargs=2, default=EFFICIENCY_RADII_MM,
+                        metavar=("INNER", "FULL"), help="efficiency circles around the main lobe")
+    parser.add_argument("--spacing", type=int, default=50,
+                        help="hexagon radius in pixels, for recordings without centers")
+    parser.add_argument("--knn", type=int, default=30, help="half-size of the pointing windows")
+    parser.add_argument("--method", choices=pointing.METHODS, default="max")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="frames per chunk")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, 0 to run inline")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    session = SessionReader(args.recording)
+    centers = args.centers or session.centers
+    if centers is None:
+        height, width = session.shape[:2]
+        centers = generate_hexagon_vertices((width // 2, height // 2), args.spacing).astype(int)
+    if args.radius_mm is not None:
+        radius = int(args.radius_mm / PIXEL_SIZE_MM)
+    else:
+        radius = session.radius or int(DEFAULT_RADIUS_MM / PIXEL_SIZE_MM)
+    efficiency_radii = [r / PIXEL_SIZE_MM for r in args.efficiency_radii_mm]
+    analysis = StackAnalysis(centers, radius, args.knn, args.method, efficiency_radii=efficiency_radii)
+
+    start = time.perf_counter()
+    columns = analyse_session(args.recording, analysis, args.output, args.chunk, args.workers, print_progress)
+    elapsed = time.perf_counter() - start
+    count = len(columns["efficiency"])
+    print(f"\n{count} frames in {elapsed:.1f} s"
+          + (f" ({elapsed / count * 1e3:.2f} ms/frame)" if count else ""))
+    if count:
+        print(f"mean efficiency {np.nanmean(columns['efficiency']):.4f}")
+    if count and not np.isnan(columns["rms_error"]).all():
+        print(f"mean rms pointing error {np.nanmean(columns['rms_error']):.2f} urad")
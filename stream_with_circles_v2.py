@@ -12,6 +12,9 @@ USB3 Vision device.
 import numpy as np
 import eBUS as eb
 import lib.PvSampleUtils as psu
+import lib.acquisition as acq
+from lib.frame_ring import FrameSlot
+import lib.roi as roi
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 BUFFER_COUNT = 50
@@ -28,55 +31,6 @@ except:
     opencv_is_available=False
     print("Warning: This sample requires python3-opencv to display a window")
 
-def connect_to_device(connection_ID):
-    # Connect to the GigE Vision or USB3 Vision device
-    print("Connecting to device.")
-    result, device = eb.PvDevice.CreateAndConnect(connection_ID)
-    if device == None:
-        print(f"Unable to connect to device: {result.GetCodeString()} ({result.GetDescription()})")
-    return device
-
-def open_stream(connection_ID):
-    # Open stream to the GigE Vision or USB3 Vision device
-    print("Opening stream from device.")
-    result, stream = eb.PvStream.CreateAndOpen(connection_ID)
-    if stream == None:
-        print(f"Unable to stream from device. {result.GetCodeString()} ({result.GetDescription()})")
-    return stream
-
-def configure_stream(device, stream):
-    # If this is a GigE Vision device, configure GigE Vision specific streaming parameters
-    if isinstance(device, eb.PvDeviceGEV):
-        # Negotiate packet size
-        device.NegotiatePacketSize()
-        # Configure device streaming destination
-        device.SetStreamDestination(stream.GetLocalIPAddress(), stream.GetLocalPort())
-
-def configure_stream_buffers(device, stream):
-    buffer_list = []
-    # Reading payload size from device
-    size = device.GetPayloadSize()
-
-    # Use BUFFER_COUNT or the maximum number of buffers, whichever is smaller
-    buffer_count = stream.GetQueuedBufferMaximum()
-    if buffer_count > BUFFER_COUNT:
-        buffer_count = BUFFER_COUNT
-
-    # Allocate buffers
-    for i in range(buffer_count):
-        # Create new pvbuffer object
-        pvbuffer = eb.PvBuffer()
-        # Have the new pvbuffer object allocate payload memory
-        pvbuffer.Alloc(size)
-        # Add to external list - used to eventually release the buffers
-        buffer_list.append(pvbuffer)
-    
-    # Queue all buffers in the stream
-    for pvbuffer in buffer_list:
-        stream.QueueBuffer(pvbuffer)
-    print(f"Created {buffer_count} buffers")
-    return buffer_list
-
 def sum_of_intensity_within_circle(image_data, radius_mm):
     pixel_size = 15e-3  # Pixel size in mm
     # Calculate the radius in pixels
@@ -85,12 +39,8 @@ def sum_of_intensity_within_circle(image_data, radius_mm):
     # Get the center of the image
     center = (image_data.shape[1] // 2, image_data.shape[0] // 2)
 
-    # Create a mask for the circle
-    y, x = np.ogrid[-center[1]:image_data.shape[0]-center[1], -center[0]:image_data.shape[1]-center[0]]
-    mask = x*x + y*y <= radius_pixels*radius_pixels
-
-    # Calculate the sum of pixel intensities within the circle
-    sum_intensity = np.sum(image_data[mask])
+    # Calculate the sum of pixel intensities within the circle (cached mask)
+    sum_intensity = roi.sum_in_circle(image_data, center, radius_pixels)
 
     return sum_intensity
 
@@ -99,18 +49,9 @@ def process_multiple_circles(image_data, centers, radius_mm):
     # Calculate the radius in pixels
     radius_pixels = int(radius_mm / pixel_size)
     centers = centers.astype(int)
-    sum_intensities = []
-    idx = 0
-    for center in centers:
-        # Create a mask for the circle
-        y, x = np.ogrid[-center[1]:image_data.shape[0]-center[1], -center[0]:image_data.shape[1]-center[0]]
-        mask = x*x + y*y <= radius_pixels*radius_pixels
-
-        # Calculate the sum of pixel intensities within the circle
-        sum_intensity = np.sum(image_data[mask])*(pixel_size**2)
-        sum_intensities.append(sum_intensity)
+    # Sum every circle from the cached masks before anything is drawn on the image
+    sum_intensities = list(roi.sum_in_circles(image_data, centers, radius_pixels)*(pixel_size**2))
 
-        
     return sum_intensities
 
 def generate_hexagon_vertices(center, radius):
@@ -130,102 +71,44 @@ def generate_hexagon_vertices(center, radius):
     return vertices
 
 def acquire_images(device, stream):
-    # Get device parameters need to control streaming
-    device_params = device.GetParameters()
     mail_lobe=[]
 
-    # Map the GenICam AcquisitionStart and AcquisitionStop commands
-    start = device_params.Get("AcquisitionStart")
-    stop = device_params.Get("AcquisitionStop")
-
-    # Get stream parameters
-    stream_params = stream.GetParameters()
-
-    # Map a few GenICam stream stats counters
-    frame_rate = stream_params.Get("AcquisitionRate")
-    bandwidth = stream_params[ "Bandwidth" ]
-
-    # Enable streaming and send the AcquisitionStart command
-    print("Enabling streaming and sending AcquisitionStart command.")
-    device.StreamEnable()
-    start.Execute()
-
-    doodle = "|\\-|-/"
-    doodle_index = 0
-    display_image = False
-    warning_issued = False
+    # Acquisition runs on the engine's own thread; the animation only shows the newest frame
+    engine = acq.AcquisitionEngine(device, stream)
+    latest = FrameSlot()
+    engine.add_consumer(latest.put)
+    engine.start()
 
     fig, ax = plt.subplots()
     im = ax.imshow(np.zeros((Height, Width)))
 
     # Create the animation
-    animation = FuncAnimation(fig, update_animation, fargs=(im, stream, doodle), blit=False)
+    animation = FuncAnimation(fig, update_animation, fargs=(im, latest), interval=1000/300, blit=False)
 
-    # Start the animation
+    # Start the animation, until the plot window is closed
     plt.show()
 
-    # Wait for keyboard input loop to finish
-    kb.start()
-    while not kb.is_stopping():
-        # Continue looping until a key is pressed
-        pass
-    kb.stop()
-
-    # Close the plot window after stopping the keyboard input loop
-    plt.close()
-
-    # Tell the device to stop sending images.
-    print("\nSending AcquisitionStop command to the device")
-    stop.Execute()
-
-    # Disable streaming on the device
-    print("Disable streaming on the controller.")
-    device.StreamDisable()
-
-    # Abort all buffers from the stream and dequeue
-    print("Aborting buffers still in stream")
-    stream.AbortQueuedBuffers()
-    while stream.GetQueuedBufferCount() > 0:
-        result, pvbuffer, lOperationalResult = stream.RetrieveBuffer()
+    engine.request_stop()
+    engine.join()
+    latest.clear()
     return mail_lobe
 
-def update_animation(im, stream, doodle):
-    # Retrieve next pvbuffer
-    result, pvbuffer, operational_result = stream.RetrieveBuffer(1000)
-
-    if result.IsOK():
-        if operational_result.IsOK():
-            payload_type = pvbuffer.GetPayloadType()
-
-            if payload_type == eb.PvPayloadTypeImage:
-                image = pvbuffer.GetImage()
-                image_data = image.GetDataPointer()
-
-                if opencv_is_available and image.GetPixelType() == eb.PvPixelMono8:
-                    image_data = cv2.applyColorMap(image_data, cv2.COLORMAP_JET)
-
-                im.set_array(image_data)
-                plt.draw()
-                plt.pause(1 / 300)  # Adjust the pause duration based on the frame rate
-
-            # Re-queue the pvbuffer in the stream object
-            stream.QueueBuffer(pvbuffer)
-
-        else:
-            # Non OK operational result
-            print(f"{doodle[doodle_index]} {operational_result.GetCodeString()}       ", end='\r')
-
-    else:
-        # Retrieve pvbuffer failure
-        print(f"{doodle[doodle_index]} {result.GetCodeString()}      ", end='\r')
-
-    doodle_index = (doodle_index + 1) % 6
+def update_animation(i, im, latest):
+    # Newest frame since the last update, older ones were already skipped
+    frame = latest.take(timeout=0)
+    if frame is None:
+        return
+    image_data = frame.data
+    if opencv_is_available and frame.pixel_type == eb.PvPixelMono8:
+        image_data = cv2.applyColorMap(image_data, cv2.COLORMAP_JET)
+    im.set_array(image_data)
+    frame.release()
 
 print("PvStreamSample:")
 
 connection_ID = psu.PvSelectDevice()
 if connection_ID:
-    device = connect_to_device(connection_ID)
+    device = acq.connect_to_device(connection_ID)
     # print(dir(device.GetParameters()))
     width=640
     height=512
@@ -262,10 +145,10 @@ if connection_ID:
         print("y_offset set")   
     
     if device:
-        stream = open_stream(connection_ID)
+        stream = acq.open_stream(connection_ID)
         if stream:
-            configure_stream(device, stream)
-            buffer_list = configure_stream_buffers(device, stream)
+            acq.configure_stream(device, stream)
+            buffer_list = acq.configure_stream_buffers(device, stream, BUFFER_COUNT)
             main_lobe = acquire_images(device, stream)
             buffer_list.clear()
             